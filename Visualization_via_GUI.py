@@ -11,12 +11,12 @@ Loads model + images, shows detections with an interactive matplotlib GUI.
 Usage:
     python demo_visualization.py --weights output_atrnet_star/model_0004999.pth
     python demo_visualization.py --weights output_atrnet_star/model_final.pth --num-samples 50
+    python demo_visualization.py --predictions output_atrnet_star/inference/detections
 """
 
 import argparse
 import os
 import sys
-import json
 import random
 import numpy as np
 import cv2
@@ -30,7 +30,9 @@ from matplotlib.colors import hsv_to_rgb
 sys.path.insert(0, os.path.dirname(__file__))
 from detectron2.config import get_cfg
 from detectron2.data import DatasetCatalog
+from detectron2.data.datasets.coco_index import load_coco_index
 from detectron2.engine import DefaultPredictor
+from detectron2.evaluation import DetectionReader
 
 from diffusiondet import add_diffusiondet_config
 from diffusiondet.util.model_ema import add_model_ema_configs
@@ -56,17 +58,18 @@ def build_predictor(weights, config_file, threshold=0.01):
     return DefaultPredictor(cfg)
 
 
+def test_annotations(data_dir):
+    return os.path.join(data_dir,
+           "Ground_Range/annotation_coco/SOC_40classes/annotations/test.json")
+
+
 def load_categories(data_dir):
-    ann = os.path.join(data_dir,
-          "Ground_Range/annotation_coco/SOC_40classes/annotations/test.json")
-    with open(ann) as f:
-        d = json.load(f)
-    return {c["id"]: c["name"] for c in d["categories"]}
+    return {c["id"]: c["name"] for c in load_coco_index(test_annotations(data_dir)).categories()}
 
 
 # ── Inference ────────────────────────────────────────────────────────────────
 def run_inference(predictor, image_path):
-    """Return (gray_HxW, boxes_Nx4, scores_N, classes_N)."""
+    """Return (gray_HxW, boxes_Nx4, scores_N, category_ids_N)."""
     gray = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
     if gray is None:
         raise FileNotFoundError(image_path)
@@ -77,10 +80,21 @@ def run_inference(predictor, image_path):
         gray,
         inst.pred_boxes.tensor.numpy(),
         inst.scores.numpy(),
-        inst.pred_classes.numpy(),
+        inst.pred_classes.numpy() + 1,   # COCO category ids are 1-indexed
     )
 
 
+def read_detections(reader, image_ids, image_path):
+    """Same as run_inference, from saved detections (image looked up by file name)."""
+    gray = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise FileNotFoundError(image_path)
+    det = reader.get(image_ids.get(Path(image_path).name, -1))
+    boxes = det["bbox"].astype(np.float64)
+    boxes[:, 2:] += boxes[:, :2]   # XYWH -> XYXY
+    return gray, boxes, det["score"], det["category_id"]
+
+
 def auto_threshold(scores, target_lo=3, target_hi=5):
     """Find threshold that yields target_lo..target_hi detections."""
     if len(scores) == 0:
@@ -92,9 +106,10 @@ def auto_threshold(scores, target_lo=3, target_hi=5):
 
 # ── GUI ──────────────────────────────────────────────────────────────────────
 class DetectionGUI:
-    def __init__(self, image_paths, predictor, categories):
+    def __init__(self, image_paths, source, categories):
+        """`source(image_path)` returns (gray, boxes, scores, category_ids)."""
         self.image_paths = image_paths
-        self.predictor   = predictor
+        self.source      = source
         self.categories  = categories
         self.idx         = 0
         self._cache      = {}
@@ -138,8 +153,8 @@ class DetectionGUI:
     def _get(self):
         p = self.image_paths[self.idx]
         if p not in self._cache:
-            print(f"Running inference on {Path(p).name} …")
-            self._cache[p] = run_inference(self.predictor, p)
+            print(f"Loading detections of {Path(p).name} …")
+            self._cache[p] = self.source(p)
         return self._cache[p]
 
     def _go(self, idx):
@@ -172,7 +187,7 @@ class DetectionGUI:
         for box, score, cls_id in zip(boxes_f, scores_f, cls_f):
             x1, y1, x2, y2 = box
             color = class_color(int(cls_id))
-            cat   = self.categories.get(int(cls_id) + 1, f"cls_{cls_id}")
+            cat   = self.categories.get(int(cls_id), f"cls_{cls_id}")
             seen_classes[cat] = color
 
             # Box with semi-transparent fill
@@ -239,8 +254,12 @@ class DetectionGUI:
 # ── Entry point ───────────────────────────────────────────────────────────────
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--weights", required=True,
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--weights",
                         help="Path to model checkpoint (.pth)")
+    source.add_argument("--predictions",
+                        help="Show saved detections instead: detections/ directory "
+                             "(TEST.SAVE_DETECTIONS) or COCO results json of the test split")
     parser.add_argument("--config-file",
                         default="configs/diffdet.atrnet.res50.yaml")
     parser.add_argument("--data-dir", default=None,
@@ -268,15 +287,23 @@ def main():
     categories = load_categories(data_dir)
     print(f"Loaded {len(categories)} categories")
 
-    print(f"Loading model from {args.weights} …")
-    predictor = build_predictor(args.weights, args.config_file)
-    print("Model ready — opening GUI")
+    if args.predictions:
+        reader = DetectionReader(args.predictions)
+        index = load_coco_index(test_annotations(data_dir))
+        image_ids = dict(zip((Path(f).name for f in index.file_names.tolist()), index.image_ids.tolist()))
+        source = lambda p: read_detections(reader, image_ids, p)
+        print(f"Loaded {len(reader)} detections — opening GUI")
+    else:
+        print(f"Loading model from {args.weights} …")
+        predictor = build_predictor(args.weights, args.config_file)
+        source = lambda p: run_inference(predictor, p)
+        print("Model ready — opening GUI")
 
     plt.rcParams.update({
         "figure.facecolor": "#1e1e2e",
         "text.color": "white",
     })
-    DetectionGUI(image_paths, predictor, categories)
+    DetectionGUI(image_paths, source, categories)
 
 
 if __name__ == "__main__":
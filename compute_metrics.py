@@ -2,10 +2,11 @@
 """
 Compute detection metrics for DiffDet4SAR on ATRNet-STAR.
 
-Usage (after running --eval-only which saves coco_eval_instances_results.json):
+Usage (after running --eval-only with TEST.SAVE_DETECTIONS True, which saves the
+detections/ directory, or TEST.SAVE_COCO_JSON True, coco_eval_instances_results.json):
 
   python compute_metrics.py \
-      --predictions output_atrnet_star_pando/inference/atrnet_star_test/coco_eval_instances_results.json \
+      --predictions output_atrnet_star_pando/inference/atrnet_star_test/detections \
       --annotations $ATRNET_DATA_DIR/Ground_Range/annotation_coco/SOC_40classes/annotations/test.json \
       --output-dir metrics_output
 
@@ -17,7 +18,7 @@ Outputs (saved to --output-dir):
 """
 
 import argparse
-import json
+import multiprocessing as mp
 import os
 import sys
 from pathlib import Path
@@ -34,88 +35,108 @@ try:
 except ImportError:
     sys.exit("pycocotools is required: pip install pycocotools")
 
+from detectron2.data.datasets.coco_index import load_coco_index
+from detectron2.evaluation.detection_store import DetectionReader
+from detectron2.evaluation.numpy_cocoeval import COCOevalNumpy
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # AP metrics via pycocotools
 # ─────────────────────────────────────────────────────────────────────────────
 
+class MetricsSession:
+    """
+    Ground truth and predictions of one metrics run, each loaded once.
+
+    GT comes from the cached COCO index (detectron2/data/datasets/coco_index.py);
+    predictions (a detections/ directory or a COCO results json, see
+    DetectionReader) are read once into columnar arrays grouped by image (those of
+    ``index.image_ids[i]`` are ``pred_offsets[i]:pred_offsets[i + 1]``, in file
+    order). COCO AP, per-class AP and the confusion matrices are all derived from
+    these arrays. Predictions on images that are not in the GT are dropped.
+    COCO AP is computed by COCOevalNumpy straight from the arrays (no loadRes),
+    with `num_workers` processes.
+    """
+
+    def __init__(self, gt_json: str, pred_json: str, num_workers=None):
+        self.gt_json = gt_json
+        self.num_workers = num_workers
+        self.index = load_coco_index(gt_json)
+
+        predictions = DetectionReader(pred_json)
+        img = np.asarray(predictions["image_id"], dtype=np.int64)
+        cats = np.asarray(predictions["category_id"], dtype=np.int64)
+        scores = np.asarray(predictions["score"], dtype=np.float64)
+        boxes = np.asarray(predictions["bbox"], dtype=np.float64).reshape(-1, 4)
+        del predictions
+
+        image_ids = self.index.image_ids
+        pos = np.searchsorted(image_ids, img)
+        known = pos < len(image_ids)
+        known[known] = image_ids[pos[known]] == img[known]
+        if not known.all():
+            print(f"Warning: {np.count_nonzero(~known)} predictions on images not in {gt_json} are ignored")
+        keep = np.flatnonzero(known)
+        keep = keep[np.argsort(pos[keep], kind="stable")]
+        self.pred_offsets = np.searchsorted(pos[keep], np.arange(len(image_ids) + 1))
+        self.pred_image_ids = img[keep]
+        self.pred_cats = cats[keep]
+        self.pred_scores = scores[keep]
+        self.pred_boxes = boxes[keep]  # XYWH, as in the file
+        self._coco_gt = None
+        self._coco_eval = None
+
+    def __len__(self):
+        return len(self.pred_scores)
+
+    @property
+    def coco_gt(self) -> "COCO":
+        if self._coco_gt is None:
+            self._coco_gt = self.index.coco_api() if self.index.bbox_only else COCO(self.gt_json)
+        return self._coco_gt
+
+    def category_ids(self, names):
+        """IDs of the category `names` found in the GT, and the names that are not."""
+        ids = dict(zip(self.index.cat_names.tolist(), self.index.cat_ids.tolist()))
+        return [ids[n] for n in names if n in ids], [n for n in names if n not in ids]
+
+    def coco_eval(self) -> "COCOeval":
+        """COCOeval (bbox), evaluated, accumulated and summarized; computed once."""
+        if self._coco_eval is None:
+            index = self.index
+            gt = {
+                "image_ids": np.repeat(index.image_ids, np.diff(index.ann_offsets)),
+                "category_ids": index.category_ids,
+                "ids": index.ann_ids,
+                "boxes": index.bboxes,
+                "areas": index.areas,
+                "iscrowd": index.iscrowd,
+            }
+            dt = {
+                "image_ids": self.pred_image_ids,
+                "category_ids": self.pred_cats,
+                "boxes": self.pred_boxes,
+                "scores": self.pred_scores,
+            }
+            evaluator = COCOevalNumpy.from_arrays(self.coco_gt, dt, gt, num_workers=self.num_workers)
+            evaluator.evaluate()
+            evaluator.accumulate()
+            evaluator.summarize()
+            self._coco_eval = evaluator
+        return self._coco_eval
+
+    def per_class_ap(self):
+        return per_class_ap(self.coco_eval(), self.coco_gt)
+
+    def confusion_matrices(self, subsets, iou_threshold=0.5, score_threshold=0.0, num_workers=1):
+        """See build_confusion_matrices."""
+        return _confusion_matrices(self, subsets, iou_threshold, score_threshold, num_workers)
+
+
 def compute_coco_metrics(gt_json: str, pred_json: str):
     """Return COCOeval object (already evaluated) + ordered category list."""
-    import types
-
-    coco_gt = COCO(gt_json)
-
-    # Sanitize predictions: ensure plain Python floats in bbox/score.
-    with open(pred_json) as f:
-        _preds = json.load(f)
-    for p in _preds:
-        p["bbox"]  = [float(x) for x in p["bbox"]]
-        p["score"] = float(p["score"])
-
-    coco_dt = coco_gt.loadRes(_preds)
-
-    evaluator = COCOeval(coco_gt, coco_dt, iouType="bbox")
-
-    # Patch computeIoU with a pure-NumPy implementation that bypasses the
-    # Cython maskUtils.iou call.  pycocotools compiled against NumPy 1.x
-    # raises "TypeError: Cannot convert numpy.ndarray to numpy.ndarray" when
-    # run with NumPy 2.x because of a Cython ABI mismatch.
-    def _computeIoU_numpy(self, imgId, catId):
-        p = self.params
-        if p.useCats:
-            gt = self._gts[imgId, catId]
-            dt = self._dts[imgId, catId]
-        else:
-            gt = [_ for cId in p.catIds for _ in self._gts[imgId, cId]]
-            dt = [_ for cId in p.catIds for _ in self._dts[imgId, cId]]
-        if len(gt) == 0 and len(dt) == 0:
-            return []
-        inds = np.argsort([-d["score"] for d in dt], kind="mergesort")
-        dt = [dt[i] for i in inds]
-        if len(dt) > p.maxDets[-1]:
-            dt = dt[0:p.maxDets[-1]]
-
-        # Return zero-IoU matrix when one side is empty (avoids reshape crash).
-        if len(dt) == 0 or len(gt) == 0:
-            return np.zeros((len(dt), len(gt)), dtype=np.float64)
-
-        def _xywh_to_xyxy(boxes):
-            """Convert list of [x,y,w,h] to [D,4] xyxy float64 array."""
-            return np.array(
-                [[b[0], b[1], b[0] + b[2], b[1] + b[3]] for b in boxes],
-                dtype=np.float64,
-            )
-
-        d_boxes = _xywh_to_xyxy([d["bbox"] for d in dt])   # [D, 4]
-        g_boxes = _xywh_to_xyxy([g["bbox"] for g in gt])   # [G, 4]
-
-        # Compute IoU matrix [D, G]
-        inter_x1 = np.maximum(d_boxes[:, 0:1], g_boxes[:, 0])
-        inter_y1 = np.maximum(d_boxes[:, 1:2], g_boxes[:, 1])
-        inter_x2 = np.minimum(d_boxes[:, 2:3], g_boxes[:, 2])
-        inter_y2 = np.minimum(d_boxes[:, 3:4], g_boxes[:, 3])
-        inter_w  = np.maximum(0.0, inter_x2 - inter_x1)
-        inter_h  = np.maximum(0.0, inter_y2 - inter_y1)
-        inter    = inter_w * inter_h                         # [D, G]
-
-        area_d = (d_boxes[:, 2] - d_boxes[:, 0]) * (d_boxes[:, 3] - d_boxes[:, 1])  # [D]
-        area_g = (g_boxes[:, 2] - g_boxes[:, 0]) * (g_boxes[:, 3] - g_boxes[:, 1])  # [G]
-
-        # For iscrowd=1 GTs, denominator is detection area (not union)
-        iscrowd = np.array([int(o["iscrowd"]) for o in gt], dtype=bool)  # [G]
-        union = area_d[:, None] + area_g[None, :] - inter               # [D, G]
-        if iscrowd.any():
-            union[:, iscrowd] = area_d[:, None]  # broadcast [D,1] → [D, #crowd]
-
-        iou = inter / np.where(union > 0, union, 1e-9)
-        return iou
-
-    evaluator.computeIoU = types.MethodType(_computeIoU_numpy, evaluator)
-
-    evaluator.evaluate()
-    evaluator.accumulate()
-    evaluator.summarize()
-    return evaluator, coco_gt
+    session = MetricsSession(gt_json, pred_json)
+    return session.coco_eval(), session.coco_gt
 
 
 def per_class_ap(evaluator: "COCOeval", coco_gt: "COCO"):
@@ -171,6 +192,7 @@ def build_confusion_matrix(
     iou_threshold: float = 0.5,
     filter_cat_ids=None,
     score_threshold: float = 0.0,
+    num_workers: int = 1,
 ):
     """
     Build an (N+1) x (N+1) confusion matrix where index N is 'background'.
@@ -180,105 +202,174 @@ def build_confusion_matrix(
     filter_cat_ids : if given, only consider GT/predictions for those category
                      IDs.  The resulting CM covers only those classes.
     score_threshold: discard predictions with score < this value.
+
+    See build_confusion_matrices to get several class subsets in one pass.
     """
-    coco_gt = COCO(gt_json)
-    with open(pred_json) as f:
-        predictions = json.load(f)
+    return build_confusion_matrices(
+        gt_json, pred_json, {"cm": filter_cat_ids},
+        iou_threshold=iou_threshold, score_threshold=score_threshold, num_workers=num_workers,
+    )["cm"]
 
-    # Optionally restrict to a subset of classes.
-    if filter_cat_ids is not None:
-        active_cat_ids = sorted(filter_cat_ids)
-    else:
-        active_cat_ids = sorted(coco_gt.getCatIds())
 
-    active_cat_set = set(active_cat_ids)
-    n_cls = len(active_cat_ids)
-    cat_to_idx = {c: i for i, c in enumerate(active_cat_ids)}
-    id_to_name  = {c["id"]: c["name"] for c in coco_gt.dataset["categories"]}
+def build_confusion_matrices(
+    gt_json: str,
+    pred_json: str,
+    subsets,
+    iou_threshold: float = 0.5,
+    score_threshold: float = 0.0,
+    num_workers: int = 1,
+):
+    """
+    Confusion matrices of several class subsets (see build_confusion_matrix) in a
+    single pass over the images.
 
-    cm = np.zeros((n_cls + 1, n_cls + 1), dtype=np.int64)  # +1 for background
+    subsets : dict name -> list of category IDs, or None for all classes. Each
+              subset is matched on its own GT / predictions, exactly as if
+              build_confusion_matrix were called with filter_cat_ids=subset.
+    num_workers: processes the images are split across.
 
-    # Group predictions by image (apply score threshold here).
-    # NOTE: pass imgIds as a list to avoid a pycocotools bug where string image
-    # IDs are iterated character-by-character when passed as a bare scalar.
-    preds_by_image = {}
-    for p in predictions:
-        if p["score"] < score_threshold:
-            continue
-        if filter_cat_ids is not None and p["category_id"] not in active_cat_set:
-            continue
-        preds_by_image.setdefault(p["image_id"], []).append(p)
+    Returns dict name -> (cm, names).
+    """
+    return MetricsSession(gt_json, pred_json).confusion_matrices(
+        subsets, iou_threshold=iou_threshold, score_threshold=score_threshold, num_workers=num_workers
+    )
 
-    img_ids = coco_gt.getImgIds()
-    for img_id in img_ids:
-        # ↓ wrap in list — bare string IDs are mishandled by _isArrayLike in
-        #   some pycocotools builds, causing getAnnIds to return [].
-        ann_ids = coco_gt.getAnnIds(imgIds=[img_id])
-        gt_anns_all = coco_gt.loadAnns(ann_ids)
 
-        # Filter GT to active classes only.
-        gt_anns = [a for a in gt_anns_all if a["category_id"] in active_cat_set]
-        preds   = preds_by_image.get(img_id, [])
+_CM_CHUNK = 2048
+_CM_STATE = None
+
+
+def _xywh_to_xyxy(boxes):
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes
+
+
+def _confusion_matrices(session, subsets, iou_threshold, score_threshold, num_workers):
+    index = session.index
+    id_to_name = dict(zip(index.cat_ids.tolist(), index.cat_names.tolist()))
+
+    # per subset: category id -> row/column of its matrix (-1: not in the subset)
+    max_cat = int(max(index.cat_ids.max(initial=0), session.pred_cats.max(initial=0)))
+    views, names = [], {}
+    for name, cat_ids in subsets.items():
+        active = sorted(cat_ids) if cat_ids is not None else sorted(index.cat_ids.tolist())
+        lut = np.full(max_cat + 2, -1, dtype=np.int64)
+        lut[np.asarray(active, dtype=np.int64)] = np.arange(len(active))
+        views.append(lut)
+        names[name] = [id_to_name[c] for c in active] + ["background"]
+
+    gt = {
+        "offsets": index.ann_offsets,
+        "boxes": _xywh_to_xyxy(index.bboxes),
+        "cats": np.clip(index.category_ids, 0, max_cat + 1),
+    }
+    keep = ~(session.pred_scores < score_threshold)
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    preds = {
+        "offsets": kept_before[session.pred_offsets],
+        "boxes": _xywh_to_xyxy(session.pred_boxes[keep]),
+        "cats": session.pred_cats[keep],
+    }
+
+    state = (gt, preds, views, iou_threshold)
+    num_images = len(index.image_ids)
+    chunks = [(s, min(s + _CM_CHUNK, num_images)) for s in range(0, num_images, _CM_CHUNK)]
+    if num_workers > 1 and len(chunks) > 1 and "fork" in mp.get_all_start_methods():
+        global _CM_STATE
+        _CM_STATE = state  # inherited by the forked workers, not pickled
+        try:
+            with mp.get_context("fork").Pool(num_workers) as pool:
+                partial = pool.map(_confusion_chunk, chunks)
+        finally:
+            _CM_STATE = None
+    else:
+        partial = [_confusion_chunk(c, state) for c in chunks]
 
-        if not gt_anns and not preds:
-            continue
+    ret = {}
+    for v, name in enumerate(subsets):
+        n = len(names[name])
+        cm = sum((p[v] for p in partial), np.zeros(n * n, dtype=np.int64))
+        ret[name] = (cm.reshape(n, n), names[name])
+    return ret
 
-        # Build GT arrays (xywh → xyxy).
-        if gt_anns:
-            gt_boxes = np.array(
-                [[a["bbox"][0], a["bbox"][1],
-                  a["bbox"][0] + a["bbox"][2],
-                  a["bbox"][1] + a["bbox"][3]] for a in gt_anns], dtype=float)
-            gt_cats  = np.array([a["category_id"] for a in gt_anns])
-        else:
-            gt_boxes = np.zeros((0, 4))
-            gt_cats  = np.array([], dtype=int)
-
-        # Build prediction arrays (xywh → xyxy).
-        if preds:
-            pd_boxes = np.array(
-                [[p["bbox"][0], p["bbox"][1],
-                  p["bbox"][0] + p["bbox"][2],
-                  p["bbox"][1] + p["bbox"][3]] for p in preds], dtype=float)
-            pd_cats  = np.array([p["category_id"] for p in preds])
-        else:
-            pd_boxes = np.zeros((0, 4))
-            pd_cats  = np.array([], dtype=int)
-
-        matched_gt = set()
-        matched_pd = set()
-
-        if len(gt_boxes) and len(pd_boxes):
-            iou_mat = _box_iou(gt_boxes, pd_boxes)  # [G, P]
-
-            # Greedy matching: highest IoU first.
-            flat_idx = np.argsort(-iou_mat.ravel())
-            for fi in flat_idx:
-                gi, pi = divmod(fi, len(pd_boxes))
-                if iou_mat[gi, pi] < iou_threshold:
-                    break
-                if gi in matched_gt or pi in matched_pd:
-                    continue
-                matched_gt.add(gi)
-                matched_pd.add(pi)
-                gt_idx = cat_to_idx[int(gt_cats[gi])]
-                pd_idx = cat_to_idx[int(pd_cats[pi])]
-                cm[gt_idx, pd_idx] += 1
-
-        # Unmatched GT → background column (missed detection).
-        for gi in range(len(gt_anns)):
-            if gi not in matched_gt:
-                gt_idx = cat_to_idx[int(gt_cats[gi])]
-                cm[gt_idx, n_cls] += 1
-
-        # Unmatched predictions → background row (false positive).
-        for pi in range(len(preds)):
-            if pi not in matched_pd:
-                pd_idx = cat_to_idx[int(pd_cats[pi])]
-                cm[n_cls, pd_idx] += 1
-
-    names = [id_to_name[c] for c in active_cat_ids] + ["background"]
-    return cm, names
+
+def _greedy_match(iou, iou_threshold):
+    """
+    Same matching as walking ``np.argsort(-iou.ravel())`` and accepting every pair
+    whose GT and prediction are both still free, until the IoU drops below the
+    threshold. Instead of one pair at a time, each round accepts all candidates
+    that come first in both their row and their column among the remaining ones,
+    which is what the sequential walk would accept too.
+
+    Returns (matched_gt, matched_pd): index arrays of the matched pairs.
+    """
+    n_pd = iou.shape[1]
+    order = np.argsort(-iou.ravel())
+    below = iou.ravel()[order] < iou_threshold
+    stop = int(np.argmax(below)) if below.any() else len(order)
+    gi, pi = np.divmod(order[:stop], n_pd)
+
+    matched_gt, matched_pd = [], []
+    free_gt = np.ones(iou.shape[0], dtype=bool)
+    free_pd = np.ones(n_pd, dtype=bool)
+    while len(gi):
+        first_g = np.zeros(len(gi), dtype=bool)
+        first_g[np.unique(gi, return_index=True)[1]] = True
+        first_p = np.zeros(len(pi), dtype=bool)
+        first_p[np.unique(pi, return_index=True)[1]] = True
+        accept = first_g & first_p
+        matched_gt.append(gi[accept])
+        matched_pd.append(pi[accept])
+        free_gt[gi[accept]] = False
+        free_pd[pi[accept]] = False
+        keep = free_gt[gi] & free_pd[pi]
+        gi, pi = gi[keep], pi[keep]
+    if not matched_gt:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(matched_gt), np.concatenate(matched_pd)
+
+
+def _confusion_chunk(bounds, state=None):
+    """Flattened confusion matrices (one per view) of images bounds[0]:bounds[1]."""
+    gt, preds, views, iou_threshold = state if state is not None else _CM_STATE
+    cells = [[] for _ in views]
+    for i in range(*bounds):
+        g0, g1 = gt["offsets"][i], gt["offsets"][i + 1]
+        p0, p1 = preds["offsets"][i], preds["offsets"][i + 1]
+        if g0 == g1 and p0 == p1:
+            continue
+        gt_boxes, gt_cats = gt["boxes"][g0:g1], gt["cats"][g0:g1]
+        pd_boxes, pd_cats = preds["boxes"][p0:p1], preds["cats"][p0:p1]
+        iou_all = _box_iou(gt_boxes, pd_boxes) if g1 > g0 and p1 > p0 else None
+
+        for lut, out in zip(views, cells):
+            n_cls = lut.max() + 1
+            gt_cls, pd_cls = lut[gt_cats], lut[pd_cats]
+            gt_keep, pd_keep = gt_cls >= 0, pd_cls >= 0
+            gt_cls, pd_cls = gt_cls[gt_keep], pd_cls[pd_keep]
+            matched_gt = matched_pd = np.zeros(0, dtype=np.int64)
+            if len(gt_cls) and len(pd_cls):
+                # elementwise the same IoU values as computing them on the subset boxes
+                iou = iou_all[np.ix_(gt_keep, pd_keep)]
+                matched_gt, matched_pd = _greedy_match(iou, iou_threshold)
+            unmatched_gt = np.ones(len(gt_cls), dtype=bool)
+            unmatched_gt[matched_gt] = False
+            unmatched_pd = np.ones(len(pd_cls), dtype=bool)
+            unmatched_pd[matched_pd] = False
+            stride = n_cls + 1
+            out.append(gt_cls[matched_gt] * stride + pd_cls[matched_pd])
+            # unmatched GT -> background column (missed detection)
+            out.append(gt_cls[unmatched_gt] * stride + n_cls)
+            # unmatched predictions -> background row (false positive)
+            out.append(n_cls * stride + pd_cls[unmatched_pd])
+
+    ret = []
+    for lut, out in zip(views, cells):
+        n = lut.max() + 2
+        flat = np.concatenate(out) if out else np.zeros(0, dtype=np.int64)
+        ret.append(np.bincount(flat, minlength=n * n).astype(np.int64))
+    return ret
 
 
 def _box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
@@ -387,7 +478,8 @@ def plot_confusion_matrix(cm, names, output_path, normalise=True, title_extra=""
 def main():
     parser = argparse.ArgumentParser(description="Compute detection metrics for DiffDet4SAR")
     parser.add_argument("--predictions", required=True,
-                        help="Path to coco_eval_instances_results.json from COCOEvaluator")
+                        help="detections/ directory or coco_eval_instances_results.json "
+                             "from COCOEvaluator")
     parser.add_argument("--annotations",
                         default=None,
                         help="Path to COCO annotation JSON (test.json). "
@@ -405,6 +497,8 @@ def main():
                              "matrix. Defaults to the 10 known military classes in "
                              "ATRNet-STAR (2S1 BMP2 BRDM_2 BTR_60 BTR70 D7 T62 T72 "
                              "ZIL131 ZSU_23_4). Pass a subset to restrict further.")
+    parser.add_argument("--num-workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="Processes used for COCO eval and the confusion matrices")
     args = parser.parse_args()
 
     # Resolve annotation path
@@ -430,9 +524,12 @@ def main():
     out.mkdir(parents=True, exist_ok=True)
 
     # ── 1. COCO mAP metrics ──────────────────────────────────────────────────
+    # GT and predictions are parsed once; every report below derives from the session.
+    session = MetricsSession(args.annotations, args.predictions, num_workers=args.num_workers)
+    print(f"Loaded {len(session.index)} images, {len(session)} predictions")
+
     print("\n── COCO AP Metrics ─────────────────────────────────────────────")
-    evaluator, coco_gt = compute_coco_metrics(args.annotations, args.predictions)
-    rows = per_class_ap(evaluator, coco_gt)
+    rows = session.per_class_ap()
 
     # Print table
     header = f"{'Class':<25} {'AP50:95':>9} {'AP50':>9} {'AP75':>9}"
@@ -474,15 +571,26 @@ def main():
     # Plot bar chart
     plot_per_class_ap(rows, out / "per_class_ap.png")
 
-    # ── 2. Confusion matrix — all classes ───────────────────────────────────
-    print(f"\n── Confusion Matrix — all classes (IoU ≥ {args.iou_threshold}) ──────────")
-    print("Building confusion matrix (this may take a minute for 29k images)...")
-    cm_all, names_all = build_confusion_matrix(
-        args.annotations, args.predictions,
+    # ── 2. Confusion matrices — all classes and military vehicles ───────────
+    # Resolve which category IDs count as military vehicles.
+    requested = args.tank_classes if args.tank_classes is not None else MILITARY_VEHICLE_NAMES
+    tank_cat_ids, missing = session.category_ids(requested)
+    if missing:
+        print(f"Warning: tank class names not found in annotation file and skipped: {missing}")
+
+    subsets = {"all": None}
+    if tank_cat_ids:
+        subsets["military"] = tank_cat_ids
+    print(f"\nBuilding confusion matrices (IoU ≥ {args.iou_threshold}, {args.num_workers} workers)...")
+    cms = session.confusion_matrices(
+        subsets,
         iou_threshold=args.iou_threshold,
         score_threshold=args.score_threshold,
+        num_workers=args.num_workers,
     )
 
+    print(f"\n── Confusion Matrix — all classes (IoU ≥ {args.iou_threshold}) ──────────")
+    cm_all, names_all = cms["all"]
     cm_csv = out / "confusion_matrix.csv"
     with open(cm_csv, "w") as f:
         f.write("," + ",".join(names_all) + "\n")
@@ -492,25 +600,11 @@ def main():
     plot_confusion_matrix(cm_all, names_all, out / "confusion_matrix.png", normalise=True)
 
     # ── 3. Confusion matrix — military vehicles only ─────────────────────────
-    # Resolve which category IDs count as military vehicles.
-    all_cats = {c["name"]: c["id"] for c in coco_gt.dataset["categories"]}
-    requested = args.tank_classes if args.tank_classes is not None else MILITARY_VEHICLE_NAMES
-    tank_cat_ids = [all_cats[n] for n in requested if n in all_cats]
-    missing = [n for n in requested if n not in all_cats]
-    if missing:
-        print(f"Warning: tank class names not found in annotation file and skipped: {missing}")
-
     if tank_cat_ids:
         print(f"\n── Confusion Matrix — military vehicles ({len(tank_cat_ids)} classes, "
               f"IoU ≥ {args.iou_threshold}) ──")
-        print("Classes:", [n for n in requested if n in all_cats])
-        print("Building military-vehicle confusion matrix...")
-        cm_mil, names_mil = build_confusion_matrix(
-            args.annotations, args.predictions,
-            iou_threshold=args.iou_threshold,
-            filter_cat_ids=tank_cat_ids,
-            score_threshold=args.score_threshold,
-        )
+        print("Classes:", [n for n in requested if n not in missing])
+        cm_mil, names_mil = cms["military"]
 
         mil_csv = out / "confusion_matrix_military.csv"
         with open(mil_csv, "w") as f:
@@ -46,6 +46,16 @@ _C.MODEL.PIXEL_MEAN = [103.530, 116.280, 123.675]
 # Otherwise, you can use [57.375, 57.120, 58.395] (ImageNet std)
 _C.MODEL.PIXEL_STD = [1.0, 1.0, 1.0]
 
+# torch.compile the submodules of the meta-architecture listed in MODULES (e.g. "backbone").
+# A submodule whose compilation fails falls back to eager mode (the error is logged).
+# Compiled kernels are cached in $TORCHINDUCTOR_CACHE_DIR (set it in the launcher to
+# reuse them between runs), by default a per-user temporary directory.
+_C.MODEL.COMPILE = CN({"ENABLED": False})
+_C.MODEL.COMPILE.MODULES = ["backbone"]
+# Options: "default", "reduce-overhead", "max-autotune"
+_C.MODEL.COMPILE.MODE = "default"
+_C.MODEL.COMPILE.BACKEND = "inductor"
+
 
 # -----------------------------------------------------------------------------
 # INPUT
@@ -122,6 +132,17 @@ _C.DATALOADER.NUM_WORKERS = 4
 # is compatible. This groups portrait images together, and landscape images
 # are not batched with portrait images.
 _C.DATALOADER.ASPECT_RATIO_GROUPING = True
+# If > 0 (e.g. 32, the backbone's size divisibility), batch images whose sizes after
+# resizing, rounded up to a multiple of this value, are the same (takes precedence over
+# ASPECT_RATIO_GROUPING). With multi-scale training every batch then has a single scale
+# and almost no padding. Images wait in their bucket (at most 4 batches of images in
+# total) until it is full, which reorders the sampled stream.
+# See detectron2.data.common.SizeBucketedDataset.
+_C.DATALOADER.SIZE_BUCKET_GRANULARITY = 0
+# If > 0 and training on CUDA, copy this many batches to the GPU ahead of time in a
+# background thread (pinned memory, separate stream), overlapping the host-to-device
+# transfer with compute. See detectron2.data.common.DevicePrefetcher.
+_C.DATALOADER.DEVICE_PREFETCH_DEPTH = 0
 # Options: TrainingSampler, RepeatFactorTrainingSampler
 _C.DATALOADER.SAMPLER_TRAIN = "TrainingSampler"
 # Repeat threshold for RepeatFactorTrainingSampler
@@ -158,6 +179,9 @@ _C.MODEL.FPN.NORM = ""
 # Types for fusing the FPN top-down and lateral features. Can be either "sum" or "avg"
 _C.MODEL.FPN.FUSE_TYPE = "sum"
 
+# Recompute the top-down pathway during backward instead of storing its activations
+_C.MODEL.FPN.USE_CHECKPOINT = False
+
 
 # ---------------------------------------------------------------------------- #
 # Proposal generator options
@@ -521,6 +545,10 @@ _C.MODEL.RESNETS.DEFORM_MODULATED = False
 # Number of groups in deformable conv.
 _C.MODEL.RESNETS.DEFORM_NUM_GROUPS = 1
 
+# Stages whose activations are recomputed during backward (activation checkpointing),
+# e.g. ["res2", "res3"]. Trades extra compute for lower peak memory in training.
+_C.MODEL.RESNETS.CHECKPOINT_STAGES = []
+
 
 # ---------------------------------------------------------------------------- #
 # Solver
@@ -619,6 +647,39 @@ _C.TEST.KEYPOINT_OKS_SIGMAS = []
 # Maximum number of detections to return per image during inference (100 is
 # based on the limit established for the COCO dataset).
 _C.TEST.DETECTIONS_PER_IMAGE = 100
+# Number of images per batch at test time, across all GPUs (each GPU gets
+# IMS_PER_BATCH // num_gpus, at least 1). With more than one image per batch, each
+# GPU visits its images ordered by size so that batches need little padding.
+_C.TEST.IMS_PER_BATCH = 1
+# Write the box predictions to "coco_eval_instances_results.json" in the inference
+# output directory (needed by compute_metrics.py). Off by default: periodic
+# evaluations during training do not need it.
+_C.TEST.SAVE_COCO_JSON = False
+# Write the box predictions to "detections/" in the inference output directory, in
+# the binary format read by compute_metrics.py and the visualization tools (much
+# smaller and faster than the json; convert with tools/convert_detections.py).
+_C.TEST.SAVE_DETECTIONS = False
+# Compute box AP with the NumPy evaluator (evaluation.COCOevalNumpy) instead of
+# pycocotools. Check that it reproduces pycocotools on your data first with
+# tools/verify_numpy_cocoeval.py. Needed for the bootstrap intervals of EVAL_SUBSET.
+_C.TEST.NUMPY_COCOEVAL = False
+# Evaluate periodically in a separate process (hooks.AsyncEvalHook) instead of
+# pausing training: every EVAL_PERIOD the weights (the EMA weights if MODEL_EMA is
+# enabled) are copied to CPU and evaluated while training continues. The results
+# are logged with the iteration of the weights.
+_C.TEST.ASYNC_EVAL = CN({"ENABLED": False})
+# Snapshots that may be evaluated or waiting at once; older waiting ones are skipped.
+_C.TEST.ASYNC_EVAL.MAX_IN_FLIGHT = 2
+# Device of the evaluation process, e.g. a spare GPU ("cuda:1"); MODEL.DEVICE if empty.
+_C.TEST.ASYNC_EVAL.DEVICE = ""
+# Run the periodic evaluations during training on a fixed, class-stratified sample of
+# NUM_IMAGES images of each test set (data.stratified_image_subset, drawn with SEED),
+# and report bootstrap confidence intervals of AP and AP50 from NUM_BOOTSTRAP
+# resamples of it (with TEST.NUMPY_COCOEVAL). The evaluation after training and --eval-only use the full sets.
+_C.TEST.EVAL_SUBSET = CN({"ENABLED": False})
+_C.TEST.EVAL_SUBSET.NUM_IMAGES = 2000
+_C.TEST.EVAL_SUBSET.SEED = 0
+_C.TEST.EVAL_SUBSET.NUM_BOOTSTRAP = 200
 
 _C.TEST.AUG = CN({"ENABLED": False})
 # _C.TEST.AUG.MIN_SIZES = (400, 500, 600, 700, 800, 900, 1000, 1100, 1200)
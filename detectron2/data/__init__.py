@@ -8,9 +8,10 @@ from .build import (
     get_detection_dataset_dicts,
     load_proposals_into_dataset,
     print_instances_class_histogram,
+    stratified_image_subset,
 )
 from .catalog import DatasetCatalog, MetadataCatalog, Metadata
-from .common import DatasetFromList, MapDataset, ToIterableDataset
+from .common import DatasetFromList, DevicePrefetcher, MapDataset, ToIterableDataset
 from .dataset_mapper import DatasetMapper
 
 # ensure the builtin datasets are registered
@@ -4,7 +4,7 @@ import logging
 import numpy as np
 import operator
 import pickle
-from collections import OrderedDict, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from typing import Any, Callable, Dict, List, Optional, Union
 import torch
 import torch.utils.data as torchdata
@@ -19,7 +19,13 @@ from detectron2.utils.file_io import PathManager
 from detectron2.utils.logger import _log_api_usage, log_first_n
 
 from .catalog import DatasetCatalog, MetadataCatalog
-from .common import AspectRatioGroupedDataset, DatasetFromList, MapDataset, ToIterableDataset
+from .common import (
+    AspectRatioGroupedDataset,
+    DatasetFromList,
+    MapDataset,
+    SizeBucketedDataset,
+    ToIterableDataset,
+)
 from .dataset_mapper import DatasetMapper
 from .detection_utils import check_metadata_consistency
 from .samplers import (
@@ -40,6 +46,7 @@ __all__ = [
     "get_detection_dataset_dicts",
     "load_proposals_into_dataset",
     "print_instances_class_histogram",
+    "stratified_image_subset",
 ]
 
 
@@ -214,6 +221,57 @@ def print_instances_class_histogram(dataset_dicts, class_names):
     )
 
 
+def stratified_image_subset(dataset_dicts, num_images, seed=0):
+    """
+    Draw a fixed sample of `num_images` images that keeps the share of each category.
+
+    Each image belongs to the stratum of its least frequent category (images without
+    non-crowd annotations form one more stratum). Strata get a share of `num_images`
+    proportional to their size, and at least one image if `num_images` allows, and
+    their images are drawn at random with `seed`. The sample only depends on the
+    image ids and annotations, not on the order of `dataset_dicts`.
+
+    Args:
+        dataset_dicts (list[dict]): dataset dicts with "image_id" and "annotations".
+        num_images (int): size of the sample.
+        seed (int): seed of the draw.
+
+    Returns:
+        list[int]: sorted "image_id" of the sampled images (all of them if
+        `num_images` is not smaller than the dataset).
+    """
+    image_ids = np.asarray([d["image_id"] for d in dataset_dicts])
+    order = np.argsort(image_ids, kind="stable")
+    image_ids = image_ids[order]
+    if num_images >= len(image_ids):
+        return image_ids.tolist()
+
+    categories = [
+        {a["category_id"] for a in dataset_dicts[i].get("annotations", []) if not a.get("iscrowd", 0)}
+        for i in order
+    ]
+    frequency = Counter(c for cats in categories for c in cats)
+    strata = np.asarray([min(cats, key=lambda c: (frequency[c], c)) if cats else -1 for cats in categories])
+    _, inverse, sizes = np.unique(strata, return_inverse=True, return_counts=True)
+
+    # largest remainder allocation
+    quota = sizes * (num_images / len(strata))
+    alloc = np.floor(quota).astype(np.int64)
+    if num_images >= len(sizes):
+        # every stratum (e.g. each rare category) is represented
+        alloc = np.maximum(alloc, 1)
+    while alloc.sum() > num_images:
+        alloc[np.argmax(np.where(alloc > 1, alloc - quota, -np.inf))] -= 1
+    # hand out the remaining images by largest remainder, to strata with images left
+    alloc = np.minimum(alloc, sizes)
+    while alloc.sum() < num_images:
+        alloc[np.argmin(np.where(alloc < sizes, alloc - quota, np.inf))] += 1
+
+    rng = np.random.default_rng(seed)
+    sampled = [rng.choice(np.flatnonzero(inverse == s), n, replace=False) for s, n in enumerate(alloc)]
+    return np.sort(image_ids[np.concatenate(sampled)]).tolist()
+
+
 def get_detection_dataset_dicts(
     names,
     filter_empty=True,
@@ -297,6 +355,7 @@ def build_batch_data_loader(
     total_batch_size,
     *,
     aspect_ratio_grouping=False,
+    size_bucket_granularity=0,
     num_workers=0,
     collate_fn=None,
     drop_last: bool = True,
@@ -311,8 +370,8 @@ def build_batch_data_loader(
         dataset (torch.utils.data.Dataset): a pytorch map-style or iterable dataset.
         sampler (torch.utils.data.sampler.Sampler or None): a sampler that produces indices.
             Must be provided iff. ``dataset`` is a map-style dataset.
-        total_batch_size, aspect_ratio_grouping, num_workers, collate_fn: see
-            :func:`build_detection_train_loader`.
+        total_batch_size, aspect_ratio_grouping, size_bucket_granularity, num_workers,
+            collate_fn: see :func:`build_detection_train_loader`.
         drop_last (bool): if ``True``, the dataloader will drop incomplete batches.
 
     Returns:
@@ -334,8 +393,8 @@ def build_batch_data_loader(
     else:
         dataset = ToIterableDataset(dataset, sampler, shard_chunk_size=batch_size)
 
-    if aspect_ratio_grouping:
-        assert drop_last, "Aspect ratio grouping will drop incomplete batches."
+    if aspect_ratio_grouping or size_bucket_granularity > 0:
+        assert drop_last, "Aspect ratio grouping / size bucketing will drop incomplete batches."
         data_loader = torchdata.DataLoader(
             dataset,
             num_workers=num_workers,
@@ -343,7 +402,11 @@ def build_batch_data_loader(
             worker_init_fn=worker_init_reset_seed,
             **kwargs
         )  # yield individual mapped dict
-        data_loader = AspectRatioGroupedDataset(data_loader, batch_size)
+        if size_bucket_granularity > 0:
+            # buckets by size also separate landscape from portrait images
+            data_loader = SizeBucketedDataset(data_loader, batch_size, size_bucket_granularity)
+        else:
+            data_loader = AspectRatioGroupedDataset(data_loader, batch_size)
         if collate_fn is None:
             return data_loader
         return MapDataset(data_loader, collate_fn)
@@ -481,6 +544,7 @@ def _train_loader_from_config(cfg, mapper=None, *, dataset=None, sampler=None):
         "mapper": mapper,
         "total_batch_size": cfg.SOLVER.IMS_PER_BATCH,
         "aspect_ratio_grouping": cfg.DATALOADER.ASPECT_RATIO_GROUPING,
+        "size_bucket_granularity": cfg.DATALOADER.SIZE_BUCKET_GRANULARITY,
         "num_workers": cfg.DATALOADER.NUM_WORKERS,
     }
 
@@ -493,6 +557,7 @@ def build_detection_train_loader(
     sampler=None,
     total_batch_size,
     aspect_ratio_grouping=True,
+    size_bucket_granularity=0,
     num_workers=0,
     collate_fn=None,
     **kwargs
@@ -516,6 +581,9 @@ def build_detection_train_loader(
         aspect_ratio_grouping (bool): whether to group images with similar
             aspect ratio for efficiency. When enabled, it requires each
             element in dataset be a dict with keys "width" and "height".
+        size_bucket_granularity (int): if > 0, batch images whose sizes after the
+            mapper, rounded up to a multiple of it, are equal (see
+            :class:`SizeBucketedDataset`). Takes precedence over ``aspect_ratio_grouping``.
         num_workers (int): number of parallel data loading workers
         collate_fn: a function that determines how to do batching, same as the argument of
             `torch.utils.data.DataLoader`. Defaults to do no collation and return a list of
@@ -545,16 +613,20 @@ def build_detection_train_loader(
         sampler,
         total_batch_size,
         aspect_ratio_grouping=aspect_ratio_grouping,
+        size_bucket_granularity=size_bucket_granularity,
         num_workers=num_workers,
         collate_fn=collate_fn,
         **kwargs
     )
 
 
-def _test_loader_from_config(cfg, dataset_name, mapper=None):
+def _test_loader_from_config(cfg, dataset_name, mapper=None, image_ids=None):
     """
     Uses the given `dataset_name` argument (instead of the names in cfg), because the
     standard practice is to evaluate each test set individually (not combining them).
+
+    If `image_ids` is given, only these images are loaded (e.g. a subset of the
+    test set from :func:`stratified_image_subset`).
     """
     if isinstance(dataset_name, str):
         dataset_name = [dataset_name]
@@ -568,15 +640,28 @@ def _test_loader_from_config(cfg, dataset_name, mapper=None):
         if cfg.MODEL.LOAD_PROPOSALS
         else None,
     )
+    if image_ids is not None:
+        image_ids = set(image_ids)
+        dataset = [d for d in dataset if d["image_id"] in image_ids]
     if mapper is None:
         mapper = DatasetMapper(cfg, False)
+    batch_size = max(1, cfg.TEST.IMS_PER_BATCH // get_world_size())
+    sampler = None
+    if not isinstance(dataset, torchdata.IterableDataset):
+        sort_keys = None
+        if batch_size > 1:
+            # group landscape / portrait images, then order by area, to keep padding low
+            sort_keys = [
+                (d.get("width", 0) > d.get("height", 0), d.get("width", 0) * d.get("height", 0))
+                for d in dataset
+            ]
+        sampler = InferenceSampler(len(dataset), sort_keys=sort_keys)
     return {
         "dataset": dataset,
         "mapper": mapper,
         "num_workers": cfg.DATALOADER.NUM_WORKERS,
-        "sampler": InferenceSampler(len(dataset))
-        if not isinstance(dataset, torchdata.IterableDataset)
-        else None,
+        "sampler": sampler,
+        "batch_size": batch_size,
     }
 
 
@@ -608,7 +693,7 @@ def build_detection_test_loader(
             if `dataset` is iterable.
         batch_size: the batch size of the data loader to be created.
             Default to 1 image per worker since this is the standard when reporting
-            inference time in papers.
+            inference time in papers. With a cfg, ``TEST.IMS_PER_BATCH`` is used.
         num_workers: number of parallel data loading workers
         collate_fn: same as the argument of `torch.utils.data.DataLoader`.
             Defaults to do no collation and return a list of data.
@@ -5,15 +5,26 @@ import itertools
 import logging
 import numpy as np
 import pickle
+import queue
 import random
+import threading
+import time
 from typing import Callable, Union
 import torch
 import torch.utils.data as data
 from torch.utils.data.sampler import Sampler
 
+from detectron2.structures import Boxes, BoxMode, Instances
 from detectron2.utils.serialize import PicklableWrapper
 
-__all__ = ["MapDataset", "DatasetFromList", "AspectRatioGroupedDataset", "ToIterableDataset"]
+__all__ = [
+    "MapDataset",
+    "DatasetFromList",
+    "AspectRatioGroupedDataset",
+    "SizeBucketedDataset",
+    "ToIterableDataset",
+    "DevicePrefetcher",
+]
 
 logger = logging.getLogger(__name__)
 
@@ -186,6 +197,89 @@ class _TorchSerializedList:
         return pickle.loads(bytes)
 
 
+class ColumnarDetectionList:
+    """
+    A list-like object for detection records that stores them column-wise in torch
+    tensors: file names in one byte table, boxes / box modes / classes / crowd
+    flags of all annotations in flat arrays addressed by per-image offsets.
+    Compared with :class:`_TorchSerializedList` it takes less RAM and rebuilds a
+    record without unpickling, while sharing memory across dataloader workers in
+    the same way.
+
+    Only the fields used for box detection are kept: "file_name", "image_id",
+    "height", "width" and, per annotation, "bbox", "bbox_mode", "category_id" and
+    "iscrowd". Other fields (e.g. "segmentation") are dropped with a warning.
+    Use it with ``set_default_dataset_from_list_serialize_method(ColumnarDetectionList)``.
+    """
+
+    _RECORD_KEYS = {"file_name", "image_id", "height", "width", "annotations"}
+    _ANNOTATION_KEYS = {"bbox", "bbox_mode", "category_id", "iscrowd"}
+
+    def __init__(self, lst: list):
+        logger.info("Storing {} records in columnar arrays ...".format(len(lst)))
+        dropped = set()
+        names, num_annos, bboxes, modes, classes, crowd = [], [], [], [], [], []
+        for record in lst:
+            dropped.update(record.keys() - self._RECORD_KEYS)
+            names.append(record["file_name"].encode("utf-8"))
+            annos = record.get("annotations", [])
+            num_annos.append(len(annos))
+            for obj in annos:
+                dropped.update("annotations." + k for k in obj.keys() - self._ANNOTATION_KEYS)
+                bboxes.append(obj["bbox"])
+                modes.append(int(obj["bbox_mode"]))
+                classes.append(obj["category_id"])
+                crowd.append(obj.get("iscrowd", 0))
+        if dropped:
+            logger.warning("ColumnarDetectionList drops the fields {}".format(sorted(dropped)))
+
+        def _tensor(array):
+            return torch.as_tensor(np.ascontiguousarray(array))
+
+        self._names = _tensor(np.frombuffer(b"".join(names), dtype=np.uint8).copy())
+        self._name_addr = _tensor(np.cumsum([0] + [len(x) for x in names], dtype=np.int64))
+        self._image_ids = _tensor(np.asarray([r["image_id"] for r in lst], dtype=np.int64))
+        self._sizes = _tensor(np.asarray([(r["height"], r["width"]) for r in lst], dtype=np.int32).reshape(-1, 2))
+        self._has_annos = _tensor(np.asarray(["annotations" in r for r in lst], dtype=np.bool_))
+        self._anno_addr = _tensor(np.cumsum([0] + num_annos, dtype=np.int64))
+        self._bboxes = _tensor(np.asarray(bboxes, dtype=np.float32).reshape(-1, 4))
+        self._bbox_modes = _tensor(np.asarray(modes, dtype=np.int8))
+        self._classes = _tensor(np.asarray(classes, dtype=np.int32))
+        self._iscrowd = _tensor(np.asarray(crowd, dtype=np.uint8))
+        nbytes = sum(
+            t.numel() * t.element_size()
+            for t in (self._names, self._name_addr, self._image_ids, self._sizes, self._has_annos,
+                      self._anno_addr, self._bboxes, self._bbox_modes, self._classes, self._iscrowd)
+        )
+        logger.info("Columnar dataset takes {:.2f} MiB".format(nbytes / 1024**2))
+
+    def __len__(self):
+        return len(self._image_ids)
+
+    def __getitem__(self, idx):
+        name_start, name_end = self._name_addr.numpy()[idx : idx + 2].tolist()
+        height, width = self._sizes.numpy()[idx].tolist()
+        record = {
+            "file_name": self._names.numpy()[name_start:name_end].tobytes().decode("utf-8"),
+            "image_id": int(self._image_ids.numpy()[idx]),
+            "height": height,
+            "width": width,
+        }
+        if not self._has_annos.numpy()[idx]:
+            return record
+        start, end = self._anno_addr.numpy()[idx : idx + 2].tolist()
+        record["annotations"] = [
+            {"bbox": bbox, "bbox_mode": BoxMode(mode), "category_id": category, "iscrowd": crowd}
+            for bbox, mode, category, crowd in zip(
+                self._bboxes.numpy()[start:end].tolist(),
+                self._bbox_modes.numpy()[start:end].tolist(),
+                self._classes.numpy()[start:end].tolist(),
+                self._iscrowd.numpy()[start:end].tolist(),
+            )
+        ]
+        return record
+
+
 _DEFAULT_DATASET_FROM_LIST_SERIALIZE_METHOD = _TorchSerializedList
 
 
@@ -337,3 +431,186 @@ class AspectRatioGroupedDataset(data.IterableDataset):
                 # guaranteed to execute
                 del bucket[:]
                 yield data
+
+
+class SizeBucketedDataset(data.IterableDataset):
+    """
+    Batch mapped data whose images have (nearly) the same size together.
+
+    Unlike :class:`AspectRatioGroupedDataset`, which only separates landscape from
+    portrait images, images are bucketed by their size after resizing, rounded up
+    to a multiple of `granularity`. With random multi-scale training every batch
+    then contains images of a single scale, and padding them to a common size
+    (``ImageList.from_tensors``) adds at most `granularity` - 1 pixels per side.
+
+    With many distinct sizes a bucket may take long to fill, so at most
+    `max_pending` images are held: when that many are waiting, a batch is made of
+    the images of the fullest buckets, whatever their sizes.
+
+    It assumes the underlying dataset produces mapped dicts with an "image" (C, H, W)
+    tensor, or an "image_size" (H, W) entry.
+    """
+
+    def __init__(self, dataset, batch_size, granularity=32, max_pending=None):
+        """
+        Args:
+            dataset: an iterable of mapped dicts.
+            batch_size (int):
+            granularity (int): images whose sizes round up to the same multiple of
+                it are batched together.
+            max_pending (int): maximum number of images held in the buckets;
+                defaults to 4 * batch_size.
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.granularity = granularity
+        self.max_pending = max_pending or 4 * batch_size
+        assert self.max_pending >= batch_size, (self.max_pending, batch_size)
+        self._buckets = {}
+        self._num_pending = 0
+
+    def _key(self, d):
+        h, w = d["image"].shape[-2:] if "image" in d else d["image_size"]
+        g = self.granularity
+        return (h + g - 1) // g, (w + g - 1) // g
+
+    def _pop_fullest(self):
+        data = []
+        for key in sorted(self._buckets, key=lambda k: len(self._buckets[k]), reverse=True):
+            bucket = self._buckets[key]
+            taken = bucket[: self.batch_size - len(data)]
+            del bucket[: len(taken)]
+            data += taken
+            if len(data) == self.batch_size:
+                break
+        self._num_pending -= len(data)
+        return data
+
+    def __iter__(self):
+        for d in self.dataset:
+            bucket = self._buckets.setdefault(self._key(d), [])
+            bucket.append(d)
+            self._num_pending += 1
+            if len(bucket) == self.batch_size:
+                data = bucket[:]
+                # Clear bucket first, because code after yield is not
+                # guaranteed to execute
+                del bucket[:]
+                self._num_pending -= len(data)
+                yield data
+            elif self._num_pending >= self.max_pending:
+                yield self._pop_fullest()
+
+
+class DevicePrefetcher:
+    """
+    Wrap a data loader that yields lists of dicts and copy every batch to `device`
+    in a background thread, so the host-to-device transfer of batch k+1 overlaps
+    with the forward/backward of batch k.
+
+    Tensors (e.g. "image", "features") and the tensor fields of "instances" are
+    pinned and copied with ``non_blocking=True`` on a dedicated CUDA stream. Up to
+    `depth` transferred batches are kept ready. Moving the batch to the device
+    again in the model is then a no-op.
+
+    The time the background thread spent transferring the batches handed out since
+    the last call is returned by :meth:`pop_transfer_time`.
+    """
+
+    def __init__(self, data_loader, device, depth=2):
+        """
+        Args:
+            data_loader: an iterable of lists of dicts.
+            device (str or torch.device): a CUDA device.
+            depth (int): number of batches transferred ahead.
+        """
+        assert depth > 0, depth
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+        assert self.device.type == "cuda", self.device
+        self.depth = depth
+        self._transfer_time = 0.0
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def pop_transfer_time(self):
+        """
+        Returns:
+            float: seconds spent pinning and copying the batches returned since the
+            previous call.
+        """
+        ret, self._transfer_time = self._transfer_time, 0.0
+        return ret
+
+    def _to_device(self, obj, moved):
+        if isinstance(obj, torch.Tensor):
+            if obj.device.type != "cpu":
+                return obj
+            t = obj.pin_memory().to(self.device, non_blocking=True)
+            moved.append(t)
+            return t
+        if isinstance(obj, Instances):
+            ret = Instances(obj.image_size)
+            for k, v in obj.get_fields().items():
+                ret.set(k, self._to_device(v, moved))
+            return ret
+        if isinstance(obj, Boxes):
+            return type(obj)(self._to_device(obj.tensor, moved))
+        if isinstance(obj, dict):
+            return {k: self._to_device(v, moved) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._to_device(v, moved) for v in obj)
+        return obj
+
+    def _produce(self, iterator, out, stop):
+        torch.cuda.set_device(self.device)
+        stream = torch.cuda.Stream(self.device)
+        try:
+            for batch in iterator:
+                start = time.perf_counter()
+                moved = []
+                with torch.cuda.stream(stream):
+                    batch = self._to_device(batch, moved)
+                # blocks this thread only; the training stream keeps running
+                stream.synchronize()
+                item = (batch, moved, time.perf_counter() - start)
+                while not stop.is_set():
+                    try:
+                        out.put(item, timeout=1.0)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            out.put(StopIteration())
+        except Exception as e:
+            out.put(e)
+
+    def __iter__(self):
+        if self.device.index is None:
+            # threads do not inherit the current device, so pin it down here
+            self.device = torch.device("cuda", torch.cuda.current_device())
+        out = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._produce, args=(iter(self.data_loader), out, stop), daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                item = out.get()
+                if isinstance(item, StopIteration):
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, moved, transfer_time = item
+                current = torch.cuda.current_stream(self.device)
+                for t in moved:
+                    # the memory was allocated on the side stream; keep the caching
+                    # allocator from reusing it while the training stream reads it
+                    t.record_stream(current)
+                self._transfer_time += transfer_time
+                yield batch
+        finally:
+            stop.set()
@@ -78,6 +78,7 @@ class DatasetMapper:
         self.proposal_topk          = precomputed_proposal_topk
         self.recompute_boxes        = recompute_boxes
         # fmt: on
+        self.image_reader = utils.ImageReader(image_format)
         logger = logging.getLogger(__name__)
         mode = "training" if is_train else "inference"
         logger.info(f"[DatasetMapper] Augmentations used in {mode}: {augmentations}")
@@ -151,7 +152,7 @@ class DatasetMapper:
         """
         dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
         # USER: Write your own image loading if it's not from a file
-        image = utils.read_image(dataset_dict["file_name"], format=self.image_format)
+        image = self.image_reader(dataset_dict["file_name"])
         utils.check_image_size(dataset_dict, image)
 
         # USER: Remove if you don't do semantic/panoptic segmentation.
@@ -1,5 +1,6 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 from .coco import load_coco_json, load_sem_seg, register_coco_instances, convert_to_coco_json
+from .coco_index import load_coco_index, load_coco_json_cached, register_coco_instances_cached
 from .coco_panoptic import register_coco_panoptic, register_coco_panoptic_separated
 from .lvis import load_lvis_json, register_lvis_instances, get_lvis_instances_meta
 from .pascal_voc import load_voc_instances, register_pascal_voc
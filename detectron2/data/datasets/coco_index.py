@@ -0,0 +1,360 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""
+Persistent binary index of COCO instance annotation files.
+
+Parsing a large annotation json (``json.load`` + ``COCO()`` index) takes seconds
+and is repeated by every training, evaluation and analysis entry point. A
+:class:`CocoIndex` holds the parsed file in columnar numpy arrays (images sorted
+by id, their annotations stored contiguously with per-image offsets) together
+with precomputed statistics, and is cached as an ``.npz`` keyed by the json's
+path, size and mtime. Later loads only read the arrays.
+
+The cache directory is ``$COCO_INDEX_CACHE_DIR`` or ``~/.cache/detectron2/coco_index``;
+the json's own directory is not written to, so read-only dataset copies work.
+"""
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import numpy as np
+from fvcore.common.timer import Timer
+
+from detectron2.structures import BoxMode
+from detectron2.utils.file_io import PathManager
+
+from .coco import load_coco_json
+from ..catalog import DatasetCatalog, MetadataCatalog
+
+__all__ = ["CocoIndex", "load_coco_index", "load_coco_json_cached", "register_coco_instances_cached"]
+
+logger = logging.getLogger(__name__)
+
+_INDEX_VERSION = 1
+
+
+def _default_cache_dir():
+    return os.environ.get("COCO_INDEX_CACHE_DIR") or os.path.expanduser("~/.cache/detectron2/coco_index")
+
+
+class CocoIndex:
+    """
+    Columnar view of a COCO instances json.
+
+    Attributes:
+        cat_ids (ndarray[int64]), cat_names (ndarray[str]): categories, sorted by id.
+        image_ids (ndarray[int64]), file_names (ndarray[str]), heights, widths (ndarray[int32]):
+            images, sorted by id. Image, annotation and category ids must be integers.
+        ann_offsets (ndarray[int64]): annotations of image i are ``ann_offsets[i]:ann_offsets[i + 1]``.
+        ann_ids (ndarray[int64]), bboxes (ndarray[float64], XYWH), category_ids (ndarray[int64]),
+        iscrowd (ndarray[uint8]), areas (ndarray[float64]): annotations, in json order per image.
+        bbox_only (bool): False if any annotation has a non-empty segmentation or keypoints,
+            or the json has no "annotations" (e.g. a test-dev file). Then the index cannot
+            stand in for the json (:meth:`to_dataset_dicts`, :meth:`coco_api`).
+        num_unmatched (int): annotations whose image is not in the json (not indexed).
+        class_histogram (ndarray[int64]): number of annotations per category (``cat_ids`` order).
+        images_per_class (ndarray[int64]): number of images containing each category.
+    """
+
+    _ARRAYS = (
+        "cat_ids", "cat_names", "image_ids", "file_names", "heights", "widths", "ann_offsets",
+        "ann_ids", "bboxes", "category_ids", "iscrowd", "areas", "class_histogram", "images_per_class",
+    )
+
+    def __init__(self, arrays, bbox_only, num_unmatched=0, extra=None):
+        for k in self._ARRAYS:
+            setattr(self, k, arrays[k])
+        self.bbox_only = bool(bbox_only)
+        self.num_unmatched = int(num_unmatched)
+        # fields of the json other than images / annotations / categories (e.g. "info")
+        self.extra = extra or {}
+
+    @classmethod
+    def from_json_dict(cls, data, json_file=""):
+        """
+        Build the index from a parsed COCO json, with the checks of ``load_coco_json``.
+        """
+        for key, field in (("categories", "id"), ("images", "id"), ("annotations", "id"),
+                           ("annotations", "image_id"), ("annotations", "category_id")):
+            _check_int_ids(data.get(key, ()), field, key, json_file)
+        cats = sorted(data["categories"], key=lambda c: c["id"])
+        images = sorted(data["images"], key=lambda img: img["id"])
+        image_ids = np.asarray([img["id"] for img in images], dtype=np.int64)
+        image_pos = {int(i): k for k, i in enumerate(image_ids)}
+
+        per_image = [[] for _ in images]
+        bbox_only = "annotations" in data
+        all_annos = data.get("annotations", [])
+        for anno in all_annos:
+            k = image_pos.get(anno["image_id"])
+            if k is None:
+                continue
+            assert anno.get("ignore", 0) == 0, '"ignore" in COCO json file is not supported.'
+            if "bbox" in anno and len(anno["bbox"]) == 0:
+                raise ValueError(
+                    f"One annotation of image {anno['image_id']} contains empty 'bbox' value! "
+                    "This json does not have valid COCO format."
+                )
+            if anno.get("segmentation") or anno.get("keypoints") or "bbox" not in anno:
+                bbox_only = False
+            per_image[k].append(anno)
+        annos = [a for lst in per_image for a in lst]
+        if len(annos) < len(all_annos):
+            logger.warning(
+                f"{json_file} contains {len(all_annos)} annotations, but only "
+                f"{len(annos)} of them match to images in the file."
+            )
+
+        arrays = {
+            "cat_ids": np.asarray([c["id"] for c in cats], dtype=np.int64),
+            "cat_names": np.asarray([c["name"] for c in cats], dtype=np.str_),
+            "image_ids": image_ids,
+            "file_names": np.asarray([img["file_name"] for img in images], dtype=np.str_),
+            "heights": np.asarray([img["height"] for img in images], dtype=np.int32),
+            "widths": np.asarray([img["width"] for img in images], dtype=np.int32),
+            "ann_offsets": np.cumsum([0] + [len(lst) for lst in per_image], dtype=np.int64),
+            "ann_ids": np.asarray([a["id"] for a in annos], dtype=np.int64),
+            "bboxes": np.asarray([a.get("bbox", [0, 0, 0, 0]) for a in annos], dtype=np.float64).reshape(-1, 4),
+            "category_ids": np.asarray([a["category_id"] for a in annos], dtype=np.int64),
+            "iscrowd": np.asarray([a.get("iscrowd", 0) for a in annos], dtype=np.uint8),
+            # NaN: no "area" in the json
+            "areas": np.asarray([a.get("area", np.nan) for a in annos], dtype=np.float64),
+        }
+        if "minival" not in json_file:
+            assert len(np.unique(arrays["ann_ids"])) == len(annos), "Annotation ids in '{}' are not unique!".format(
+                json_file
+            )
+
+        # annotations of unknown categories are not counted in the statistics
+        cat_pos = np.searchsorted(arrays["cat_ids"], arrays["category_ids"])
+        known = np.isin(arrays["category_ids"], arrays["cat_ids"])
+        arrays["class_histogram"] = np.bincount(cat_pos[known], minlength=len(cats)).astype(np.int64)
+        image_of_ann = np.repeat(np.arange(len(images)), np.diff(arrays["ann_offsets"]))
+        image_cat = np.unique(image_of_ann[known] * max(len(cats), 1) + cat_pos[known])
+        arrays["images_per_class"] = np.bincount(image_cat % max(len(cats), 1), minlength=len(cats)).astype(np.int64)
+
+        extra = {k: v for k, v in data.items() if k not in ("images", "annotations", "categories")}
+        return cls(arrays, bbox_only, len(all_annos) - len(annos), extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            arrays = {k: f[k] for k in cls._ARRAYS}
+            meta = json.loads(str(f["meta"]))
+        return cls(arrays, meta["bbox_only"], meta["num_unmatched"], meta["extra"]), meta
+
+    def save(self, path, source):
+        meta = {
+            "version": _INDEX_VERSION,
+            "source": source,
+            "bbox_only": self.bbox_only,
+            "num_unmatched": self.num_unmatched,
+            "extra": self.extra,
+        }
+        tmp = path + ".tmp{}".format(os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, meta=np.asarray(json.dumps(meta)), **{k: getattr(self, k) for k in self._ARRAYS})
+        os.replace(tmp, path)  # atomic, several processes may build the same index
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @property
+    def num_annotations(self):
+        return len(self.ann_ids)
+
+    def categories(self):
+        """
+        Returns:
+            list[dict]: the categories, as in the json (only "id" and "name").
+        """
+        return [{"id": int(i), "name": str(n)} for i, n in zip(self.cat_ids, self.cat_names)]
+
+    def to_coco_dict(self, image_mask=None, ann_mask=None, cat_mask=None):
+        """
+        Args:
+            image_mask, ann_mask, cat_mask (ndarray[bool]): optionally keep only these
+                images / annotations / categories.
+
+        Returns:
+            dict: a COCO json dict, e.g. for ``COCO().dataset`` without re-parsing the file.
+            Only the indexed fields are kept.
+        """
+        keep_img = np.ones(len(self.image_ids), dtype=bool) if image_mask is None else image_mask
+        keep_ann = np.ones(len(self.ann_ids), dtype=bool) if ann_mask is None else ann_mask.copy()
+        keep_cat = np.ones(len(self.cat_ids), dtype=bool) if cat_mask is None else cat_mask
+        keep_ann &= np.repeat(keep_img, np.diff(self.ann_offsets))
+
+        image_of_ann = np.repeat(self.image_ids, np.diff(self.ann_offsets))[keep_ann].tolist()
+        images = [
+            {"id": i, "file_name": f, "height": h, "width": w}
+            for i, f, h, w in zip(self.image_ids[keep_img].tolist(), self.file_names[keep_img].tolist(),
+                                  self.heights[keep_img].tolist(), self.widths[keep_img].tolist())
+        ]
+        annotations = [
+            {"id": i, "image_id": img, "bbox": b, "category_id": c, "iscrowd": cr}
+            for i, img, b, c, cr in zip(self.ann_ids[keep_ann].tolist(), image_of_ann, self.bboxes[keep_ann].tolist(),
+                                        self.category_ids[keep_ann].tolist(), self.iscrowd[keep_ann].tolist())
+        ]
+        for anno, area in zip(annotations, self.areas[keep_ann].tolist()):
+            if area == area:  # not NaN
+                anno["area"] = area
+        categories = [c for c, keep in zip(self.categories(), keep_cat) if keep]
+        return dict(self.extra, images=images, annotations=annotations, categories=categories)
+
+    def coco_api(self):
+        """
+        Returns:
+            pycocotools.coco.COCO: built from the index instead of the json file.
+        """
+        from pycocotools.coco import COCO
+
+        coco_api = COCO()
+        coco_api.dataset = self.to_coco_dict()
+        with contextlib.redirect_stdout(io.StringIO()):
+            coco_api.createIndex()
+        return coco_api
+
+    def to_dataset_dicts(self, image_root, id_map=None):
+        """
+        Returns:
+            list[dict]: the same records as ``load_coco_json`` for a box-only json.
+        """
+        assert self.bbox_only, "to_dataset_dicts() only supports box-only annotations"
+        category_ids = self.category_ids
+        if id_map:
+            lut = {int(c): id_map[int(c)] for c in np.unique(category_ids) if int(c) in id_map}
+            unknown = set(np.unique(category_ids).tolist()) - lut.keys()
+            if unknown:
+                raise KeyError(
+                    f"Encountered category_id={min(unknown)} "
+                    "but this id does not exist in 'categories' of the json file."
+                )
+            category_ids = [lut[c] for c in category_ids.tolist()]
+        else:
+            category_ids = category_ids.tolist()
+        bboxes = self.bboxes.tolist()
+        iscrowd = self.iscrowd.tolist()
+        offsets = self.ann_offsets.tolist()
+
+        dataset_dicts = []
+        for k, (image_id, file_name, height, width) in enumerate(
+            zip(self.image_ids.tolist(), self.file_names.tolist(), self.heights.tolist(), self.widths.tolist())
+        ):
+            annotations = [
+                {"iscrowd": iscrowd[j], "bbox": bboxes[j], "category_id": category_ids[j], "bbox_mode": BoxMode.XYWH_ABS}
+                for j in range(offsets[k], offsets[k + 1])
+            ]
+            dataset_dicts.append({
+                "file_name": os.path.join(image_root, file_name),
+                "height": height,
+                "width": width,
+                "image_id": image_id,
+                "annotations": annotations,
+            })
+        return dataset_dicts
+
+
+def _check_int_ids(records, field, key, json_file):
+    # the index stores ids as int64: string ids (allowed by load_coco_json) would be
+    # converted, e.g. "007" to 7, and no longer match the json or the predictions
+    for record in records:
+        value = record[field]
+        if not isinstance(value, (int, np.integer)) or isinstance(value, bool):
+            raise ValueError(
+                f"{json_file}: {key} have a non-integer '{field}' ({value!r}), "
+                "which CocoIndex does not support; read the file with load_coco_json instead."
+            )
+
+
+def _cache_path(json_file, cache_dir):
+    key = hashlib.sha1(os.path.abspath(json_file).encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(json_file))[0]
+    return os.path.join(cache_dir, f"{name}-{key}.npz")
+
+
+def load_coco_index(json_file, cache_dir=None):
+    """
+    Load the :class:`CocoIndex` of `json_file` from the cache, (re)building it
+    if the json's path, size or mtime changed.
+
+    Args:
+        json_file (str): path to a COCO instances json.
+        cache_dir (str): defaults to ``$COCO_INDEX_CACHE_DIR`` or ``~/.cache/detectron2/coco_index``.
+
+    Returns:
+        CocoIndex
+    """
+    json_file = PathManager.get_local_path(json_file)
+    stat = os.stat(json_file)
+    source = {"path": os.path.abspath(json_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    cache_file = _cache_path(json_file, cache_dir or _default_cache_dir())
+
+    if os.path.isfile(cache_file):
+        try:
+            index, meta = CocoIndex.load(cache_file)
+            if meta["version"] == _INDEX_VERSION and meta["source"] == source:
+                return index
+        except Exception as e:  # corrupt / partial file: rebuild it
+            logger.warning("Ignoring unreadable COCO index {}: {}".format(cache_file, e))
+
+    timer = Timer()
+    with open(json_file) as f:
+        data = json.load(f)
+    index = CocoIndex.from_json_dict(data, json_file)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        index.save(cache_file, source)
+    except OSError as e:
+        logger.warning("Could not write COCO index {}: {}".format(cache_file, e))
+    logger.info("Indexed {} in {:.2f} seconds (cached at {}).".format(json_file, timer.seconds(), cache_file))
+    return index
+
+
+def load_coco_json_cached(json_file, image_root, dataset_name=None, extra_annotation_keys=None):
+    """
+    Like :func:`load_coco_json`, but reads the json through :func:`load_coco_index`.
+    Falls back to :func:`load_coco_json` for annotations that are not box-only
+    or when extra annotation keys are requested.
+    """
+    try:
+        index = load_coco_index(json_file)
+    except ValueError as e:  # e.g. string ids
+        logger.warning("Not using a COCO index: {}".format(e))
+        index = None
+    if index is None or not index.bbox_only or extra_annotation_keys:
+        return load_coco_json(json_file, image_root, dataset_name, extra_annotation_keys)
+
+    id_map = None
+    if dataset_name is not None:
+        meta = MetadataCatalog.get(dataset_name)
+        cat_ids = index.cat_ids.tolist()
+        meta.thing_classes = index.cat_names.tolist()
+        if not (min(cat_ids) == 1 and max(cat_ids) == len(cat_ids)):
+            if "coco" not in dataset_name:
+                logger.warning(
+                    """
+Category ids in annotations are not in [1, #categories]! We'll apply a mapping for you.
+"""
+                )
+        id_map = {v: i for i, v in enumerate(cat_ids)}
+        meta.thing_dataset_id_to_contiguous_id = id_map
+        meta.class_histogram = index.class_histogram.tolist()
+
+    logger.info("Loaded {} images in COCO format from {} (cached index)".format(len(index), json_file))
+    return index.to_dataset_dicts(image_root, id_map)
+
+
+def register_coco_instances_cached(name, metadata, json_file, image_root):
+    """
+    Same as :func:`register_coco_instances`, but loads the dataset with
+    :func:`load_coco_json_cached`.
+    """
+    assert isinstance(name, str), name
+    assert isinstance(json_file, (str, os.PathLike)), json_file
+    assert isinstance(image_root, (str, os.PathLike)), image_root
+    DatasetCatalog.register(name, lambda: load_coco_json_cached(json_file, image_root, name))
+    MetadataCatalog.get(name).set(
+        json_file=json_file, image_root=image_root, evaluator_type="coco", **metadata
+    )
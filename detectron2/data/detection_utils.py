@@ -5,8 +5,11 @@
 Common data processing utilities that are used in a
 typical object detection data pipeline.
 """
+import functools
+import io
 import logging
 import numpy as np
+import os
 from typing import List, Union
 import pycocotools.mask as mask_util
 import torch
@@ -23,6 +26,7 @@ from detectron2.structures import (
     polygons_to_bitmask,
 )
 from detectron2.utils.file_io import PathManager
+from detectron2.utils.logger import log_first_n
 
 from . import transforms as T
 from .catalog import MetadataCatalog
@@ -40,6 +44,9 @@ __all__ = [
     "create_keypoint_hflip_indices",
     "filter_empty_instances",
     "read_image",
+    "ImageReader",
+    "register_image_decoder",
+    "sniff_image_decoder",
 ]
 
 
@@ -163,6 +170,195 @@ def _apply_exif_orientation(image):
     return image
 
 
+# Decoders used by :class:`ImageReader`, picked from the leading bytes of a file
+# or, when no signature matches, from its extension.
+_IMAGE_DECODERS = {}
+
+
+def register_image_decoder(name, decode, *, magic=(), extensions=(), raw=False):
+    """
+    Register an image decoder for :class:`ImageReader` and :func:`read_image`.
+
+    Args:
+        name (str): name of the decoder; registering an existing name replaces it.
+        decode (callable): ``decode(data: bytes, format: str) -> np.ndarray``.
+        magic (tuple[bytes]): file signatures handled by the decoder.
+        extensions (tuple[str]): extensions (e.g. ".tif") used when no signature matches.
+        raw (bool): if True, `decode` ignores `format` and returns the stored
+            values: HW or HWC (BGR order), any dtype. They are scaled to uint8
+            and converted to the requested format by the reader.
+    """
+    _IMAGE_DECODERS[name] = (decode, tuple(magic), tuple(e.lower() for e in extensions), raw)
+
+
+def sniff_image_decoder(file_name, header):
+    """
+    Returns:
+        str: name of the decoder for a file with the given name and leading bytes.
+    """
+    for name, (_, magic, _, _) in _IMAGE_DECODERS.items():
+        if header.startswith(magic):
+            return name
+    ext = os.path.splitext(file_name)[1].lower()
+    for name, (_, _, extensions, _) in _IMAGE_DECODERS.items():
+        if ext in extensions:
+            return name
+    return "pil"
+
+
+def _decode_pil(data, format):
+    image = Image.open(io.BytesIO(data))
+    # work around this bug: https://github.com/python-pillow/Pillow/issues/3973
+    image = _apply_exif_orientation(image)
+    return convert_PIL_to_numpy(image, format)
+
+
+# numpy equivalents of the transposes in :func:`_apply_exif_orientation`, for HW(C) arrays
+_EXIF_ORIENT_NUMPY = {
+    2: lambda a: a[:, ::-1],
+    3: lambda a: a[::-1, ::-1],
+    4: lambda a: a[::-1],
+    5: lambda a: a.swapaxes(0, 1),
+    6: lambda a: np.rot90(a, -1),
+    7: lambda a: np.rot90(a.swapaxes(0, 1), 2),
+    8: lambda a: np.rot90(a),
+}
+
+
+def _decode_tiff_raw(data):
+    try:
+        import cv2
+    except ImportError:
+        image = np.asarray(Image.open(io.BytesIO(data)))
+        return image[:, :, ::-1] if image.ndim == 3 else image
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError("cv2 could not decode the TIFF image")
+    return image
+
+
+@functools.lru_cache(maxsize=None)
+def _tiff_decoder_applies_orientation():
+    """
+    Whether :func:`_decode_tiff_raw` honors the TIFF orientation tag, which depends
+    on the OpenCV / Pillow build (recent libtiff-based ones do), probed on a 1x2 image.
+    """
+    buf = io.BytesIO()
+    Image.fromarray(np.array([[0, 255]], dtype=np.uint8)).save(
+        buf, format="TIFF", tiffinfo={_EXIF_ORIENT: 2}
+    )
+    return _decode_tiff_raw(buf.getvalue())[0, 0] == 255
+
+
+def _decode_tiff(data, format):
+    # 16-bit / float / multi-band TIFFs common in SAR products, which PIL cannot convert
+    image = _decode_tiff_raw(data)
+    if not _tiff_decoder_applies_orientation():
+        try:
+            orientation = Image.open(io.BytesIO(data)).getexif().get(_EXIF_ORIENT)
+        except Exception:
+            orientation = None
+        transpose = _EXIF_ORIENT_NUMPY.get(orientation)
+        if transpose is not None:
+            image = np.ascontiguousarray(transpose(image))
+    return image
+
+
+register_image_decoder(
+    "pil",
+    _decode_pil,
+    magic=(b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF8", b"BM"),
+    extensions=(".png", ".jpg", ".jpeg", ".gif", ".bmp"),
+)
+register_image_decoder(
+    "tiff",
+    _decode_tiff,
+    magic=(b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"),
+    extensions=(".tif", ".tiff"),
+    raw=True,
+)
+
+
+def _minmax_to_uint8(image):
+    image = image.astype(np.float32)
+    lo, hi = image.min(), image.max()
+    image -= lo
+    image *= 255.0 / max(hi - lo, 1e-12)
+    return image.astype(np.uint8)
+
+
+def _convert_raw_to_numpy(image, format):
+    """
+    Convert a uint8 HW or HWC (BGR) array into `format`, as :func:`convert_PIL_to_numpy` does.
+    """
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    if image.ndim == 2:
+        if format == "L":
+            return image[:, :, None]
+        image = np.repeat(image[:, :, None], 3, axis=2)
+    else:
+        image = image[:, :, :3]
+        if format == "L":
+            gray = Image.fromarray(np.ascontiguousarray(image[:, :, ::-1])).convert("L")
+            return np.asarray(gray)[:, :, None]
+    if format == "BGR":
+        return image
+    rgb = np.ascontiguousarray(image[:, :, ::-1])
+    if format in (None, "RGB"):
+        return rgb
+    return convert_PIL_to_numpy(Image.fromarray(rgb), format)
+
+
+class ImageReader:
+    """
+    Read images with a single decode attempt.
+
+    The decoder is chosen from the file signature (falling back to the extension)
+    of the first file of each directory and extension, and the choice is reused
+    for the remaining files of that directory, i.e. once per dataset split.
+    Images that are not uint8 (e.g. 16-bit or float SAR products) are mapped to
+    uint8 by `intensity_transform`; without one they are min-max normalized per
+    image, which does not preserve intensities across images.
+    """
+
+    def __init__(self, format=None, intensity_transform=None):
+        """
+        Args:
+            format (str): see :func:`read_image`.
+            intensity_transform (callable): maps a non-uint8 HW or HWC array to uint8.
+        """
+        self.format = format
+        self.intensity_transform = intensity_transform
+        self._decoders = {}
+
+    def __call__(self, file_name):
+        with PathManager.open(file_name, "rb") as f:
+            data = f.read()
+        key = (os.path.dirname(file_name), os.path.splitext(file_name)[1].lower())
+        name = self._decoders.get(key)
+        if name is None:
+            name = self._decoders[key] = sniff_image_decoder(file_name, data[:16])
+        decode, _, _, raw = _IMAGE_DECODERS[name]
+        try:
+            image = decode(data, self.format)
+        except Exception as e:
+            raise IOError("Failed to decode image {} with the {} decoder: {}".format(file_name, name, e)) from e
+        if not raw:
+            return image
+        if image.dtype != np.uint8:
+            if self.intensity_transform is not None:
+                image = self.intensity_transform(image)
+            else:
+                log_first_n(
+                    logging.WARNING,
+                    "Images of type {} are min-max normalized per image; "
+                    "pass an intensity_transform to ImageReader for consistent scaling.".format(image.dtype),
+                )
+                image = _minmax_to_uint8(image)
+        return _convert_raw_to_numpy(image, self.format)
+
+
 def read_image(file_name, format=None):
     """
     Read an image into the given format.
@@ -177,33 +373,14 @@ def read_image(file_name, format=None):
             an HWC image in the given format, which is 0-255, uint8 for
             supported image modes in PIL or "BGR"; float (0-1 for Y) for YUV-BT.601.
     """
-    with PathManager.open(file_name, "rb") as f:
-        try:
-            image = Image.open(f)
-            # work around this bug: https://github.com/python-pillow/Pillow/issues/3973
-            image = _apply_exif_orientation(image)
-            return convert_PIL_to_numpy(image, format)
-        except Exception:
-            pass  # fall through to cv2 path for formats PIL cannot handle (e.g. 16-bit TIFFs)
-
-    # cv2 fallback — handles 16-bit / unusual TIFF variants common in SAR datasets
-    import cv2 as _cv2
-    import numpy as _np
-    bgr = _cv2.imread(file_name, _cv2.IMREAD_UNCHANGED)
-    if bgr is None:
-        raise IOError(f"cv2 could not read image: {file_name}")
-    # Normalise to uint8
-    if bgr.dtype != _np.uint8:
-        bgr = _cv2.normalize(bgr, None, 0, 255, _cv2.NORM_MINMAX).astype(_np.uint8)
-    # Convert to the requested format
-    if format == "BGR":
-        img_np = bgr if bgr.ndim == 3 else _cv2.cvtColor(bgr, _cv2.COLOR_GRAY2BGR)
-    else:  # RGB or anything else — Detectron2 typically uses RGB internally
-        if bgr.ndim == 2:
-            img_np = _cv2.cvtColor(bgr, _cv2.COLOR_GRAY2RGB)
-        else:
-            img_np = _cv2.cvtColor(bgr, _cv2.COLOR_BGR2RGB)
-    return img_np
+    reader = _READERS.get(format)
+    if reader is None:
+        reader = _READERS[format] = ImageReader(format)
+    return reader(file_name)
+
+
+# one reader per format, so that read_image sniffs the decoder once per directory
+_READERS = {}
 
 
 def check_image_size(dataset_dict, image):
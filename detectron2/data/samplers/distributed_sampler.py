@@ -250,16 +250,22 @@ class InferenceSampler(Sampler):
     this sampler produces different number of samples on different workers.
     """
 
-    def __init__(self, size: int):
+    def __init__(self, size: int, sort_keys: Optional[list] = None):
         """
         Args:
             size (int): the total number of data of the underlying dataset to sample from
+            sort_keys (list, optional): one key per sample. If given, each worker yields its
+                samples in increasing key order (e.g. by image size, so that batches need
+                little padding). The set of samples per worker does not change.
         """
         self._size = size
         assert size > 0
         self._rank = comm.get_rank()
         self._world_size = comm.get_world_size()
         self._local_indices = self._get_local_indices(size, self._world_size, self._rank)
+        if sort_keys is not None:
+            assert len(sort_keys) == size, (len(sort_keys), size)
+            self._local_indices = sorted(self._local_indices, key=lambda i: sort_keys[i])
 
     @staticmethod
     def _get_local_indices(total_size, world_size, rank):
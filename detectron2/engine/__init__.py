@@ -11,6 +11,7 @@ __all__ = [k for k in globals().keys() if not k.startswith("_")]
 from .hooks import *
 from .defaults import (
     create_ddp_model,
+    maybe_compile_model,
     default_argument_parser,
     default_setup,
     default_writers,
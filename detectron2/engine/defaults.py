@@ -13,6 +13,8 @@ import argparse
 import logging
 import os
 import sys
+import time
+import types
 import weakref
 from collections import OrderedDict
 from typing import Optional
@@ -50,6 +52,7 @@ from .train_loop import AMPTrainer, SimpleTrainer, TrainerBase
 
 __all__ = [
     "create_ddp_model",
+    "maybe_compile_model",
     "default_argument_parser",
     "default_setup",
     "default_writers",
@@ -80,6 +83,84 @@ def create_ddp_model(model, *, fp16_compression=False, **kwargs):
     return ddp
 
 
+def maybe_compile_model(cfg, model):
+    """
+    Compile the submodules of `model` listed in ``cfg.MODEL.COMPILE.MODULES`` with
+    :func:`torch.compile` if ``cfg.MODEL.COMPILE.ENABLED``.
+
+    Only the ``forward`` of each submodule is replaced, so parameter names, checkpoints
+    and EMA states are unaffected. Spatial dimensions of 4D tensor inputs are marked
+    dynamic (image sizes vary), all other dimensions stay static. If dynamo or the
+    backend fails to compile it, the submodule falls back to eager mode; other errors
+    are raised.
+
+    Args:
+        cfg (CfgNode):
+        model: a torch.nn.Module, not yet wrapped by DDP.
+
+    Returns:
+        the same `model`.
+    """
+    if not cfg.MODEL.COMPILE.ENABLED:
+        return model
+    logger = logging.getLogger(__name__)
+    if not hasattr(torch, "compile"):
+        logger.warning(f"torch.compile is not available in torch {torch.__version__}, running eagerly.")
+        return model
+
+    # loads torch._dynamo (used by _mark_spatial_dims_dynamic and _compile_forward) without shadowing `torch`
+    from torch import _dynamo  # noqa: F401
+
+    for name in cfg.MODEL.COMPILE.MODULES:
+        module = getattr(model, name, None)
+        if not isinstance(module, torch.nn.Module):
+            logger.warning(f"MODEL.COMPILE.MODULES: model has no submodule '{name}', skipped.")
+            continue
+        _compile_forward(module, name, mode=cfg.MODEL.COMPILE.MODE, backend=cfg.MODEL.COMPILE.BACKEND)
+        logger.info(f"Compiling {name} with torch.compile (mode={cfg.MODEL.COMPILE.MODE}).")
+    return model
+
+
+def _mark_spatial_dims_dynamic(x):
+    if isinstance(x, torch.Tensor):
+        if x.dim() == 4:
+            torch._dynamo.mark_dynamic(x, 2)
+            torch._dynamo.mark_dynamic(x, 3)
+    elif isinstance(x, (list, tuple)):
+        for y in x:
+            _mark_spatial_dims_dynamic(y)
+
+
+def _compile_forward(module, name, **compile_kwargs):
+    # Compile the class-level forward and bind it to the instance: a deepcopy of the
+    # module then rebinds to the copy instead of calling back into the original.
+    eager_forward = type(module).forward
+    compiled_forward = torch.compile(eager_forward, **compile_kwargs)
+    logger = logging.getLogger(__name__)
+
+    def forward(self, *args, **kwargs):
+        if not self._compile_failed:
+            _mark_spatial_dims_dynamic(args)
+            start = time.perf_counter()
+            try:
+                out = compiled_forward(self, *args, **kwargs)
+            except torch._dynamo.exc.TorchDynamoException:
+                # tracing or backend compilation failed (BackendCompilerFailed, InductorError,
+                # Unsupported, ...); errors raised by the model itself propagate
+                logger.exception(f"torch.compile of {name} failed, falling back to eager mode.")
+                self._compile_failed = True
+            else:
+                if not self._compile_reported:
+                    self._compile_reported = True
+                    logger.info(f"First compiled call of {name} took {time.perf_counter() - start:.1f}s.")
+                return out
+        return eager_forward(self, *args, **kwargs)
+
+    module._compile_failed = False
+    module._compile_reported = False
+    module.forward = types.MethodType(forward, module)
+
+
 def default_argument_parser(epilog=None):
     """
     Create a parser with some common arguments used by detectron2 users.
@@ -288,6 +369,7 @@ class DefaultPredictor:
 
         checkpointer = DetectionCheckpointer(self.model)
         checkpointer.load(cfg.MODEL.WEIGHTS)
+        maybe_compile_model(self.cfg, self.model)
 
         self.aug = T.ResizeShortestEdge(
             [cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST
@@ -7,10 +7,12 @@ import logging
 import math
 import operator
 import os
+import queue
 import tempfile
 import time
+import traceback
 import warnings
-from collections import Counter
+from collections import Counter, deque
 import torch
 from fvcore.common.checkpoint import Checkpointer
 from fvcore.common.checkpoint import PeriodicCheckpointer as _PeriodicCheckpointer
@@ -36,6 +38,7 @@ __all__ = [
     "LRScheduler",
     "AutogradProfiler",
     "EvalHook",
+    "AsyncEvalHook",
     "PreciseBN",
     "TorchProfiler",
     "TorchMemoryStats",
@@ -564,6 +567,183 @@ class EvalHook(HookBase):
         del self._func
 
 
+def _async_eval_worker(eval_function, tasks, results):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        iteration, snapshot = task
+        try:
+            ret = eval_function(snapshot)
+        except Exception:
+            results.put((iteration, None, traceback.format_exc()))
+        else:
+            results.put((iteration, ret, None))
+        del task, snapshot
+
+
+class AsyncEvalHook(HookBase):
+    """
+    Like :class:`EvalHook`, but the evaluation runs in a separate process while
+    training continues.
+
+    Every ``eval_period`` iterations, ``snapshot_function()`` takes a snapshot of the
+    model (e.g. its weights on CPU), which is evaluated by ``eval_function(snapshot)``
+    in a worker process. Results are put in the storage when they arrive, with the
+    iteration of the snapshot, so writers record them at that iteration.
+
+    At most ``max_in_flight`` snapshots are being evaluated or waiting. When another
+    one is due, the oldest waiting snapshot is skipped as stale, or the new one if
+    the only snapshot is being evaluated. After the last iteration, the final
+    snapshot is evaluated and all results are waited for.
+
+    Note:
+        Unlike :class:`EvalHook`, it only needs to be registered in the main process.
+    """
+
+    def __init__(
+        self,
+        eval_period,
+        snapshot_function,
+        eval_function,
+        max_in_flight=1,
+        eval_after_train=True,
+        callback=None,
+    ):
+        """
+        Args:
+            eval_period (int): same as in :class:`EvalHook`.
+            snapshot_function (callable): takes no arguments and returns a picklable
+                snapshot. It should not share memory with the model that training
+                keeps updating (e.g. copy tensors to CPU).
+            eval_function (callable): a picklable function (e.g. a module-level
+                function or a `functools.partial` of one) which takes a snapshot
+                and returns a nested dict of evaluation metrics. It is called in a
+                process started with "spawn", and may keep state (e.g. a model and
+                a data loader) between calls.
+            max_in_flight (int): number of snapshots that are being evaluated or
+                waiting to be evaluated.
+            eval_after_train (bool): whether to evaluate after the last iteration.
+            callback (callable): called with (iteration, results) in the training
+                process when the results of a snapshot arrive.
+        """
+        assert max_in_flight >= 1, max_in_flight
+        self._period = eval_period
+        self._snapshot = snapshot_function
+        self._func = eval_function
+        self._max_in_flight = max_in_flight
+        self._eval_after_train = eval_after_train
+        self._callback = callback
+        self._logger = logging.getLogger(__name__)
+        self._process = None
+
+    def before_train(self):
+        ctx = torch.multiprocessing.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(
+            target=_async_eval_worker, args=(self._func, self._tasks, self._results)
+        )
+        self._process.start()
+        self._waiting = deque()
+        # the snapshot being evaluated is kept alive until its results arrive: tensors
+        # sent to the worker share memory with it
+        self._running = None
+
+    def _submit(self, iteration, force=False):
+        num_in_flight = len(self._waiting) + (self._running is not None)
+        if num_in_flight >= self._max_in_flight:
+            if self._waiting:
+                stale, _ = self._waiting.popleft()
+                self._logger.info("Skipping the stale evaluation of iteration {}.".format(stale))
+            elif not force:
+                self._logger.info(
+                    "Skipping the evaluation of iteration {}: iteration {} is still being "
+                    "evaluated.".format(iteration, self._running[0])
+                )
+                return
+        self._waiting.append((iteration, self._snapshot()))
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._running is None and self._waiting:
+            self._running = self._waiting.popleft()
+            self._tasks.put(self._running)
+
+    def _collect(self, block=False):
+        while self._running is not None:
+            try:
+                iteration, results, error = self._results.get(timeout=1.0 if block else None, block=block)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        "[AsyncEvalHook] The evaluation process exited with code {} while "
+                        "evaluating iteration {}.".format(self._process.exitcode, self._running[0])
+                    )
+                if block:
+                    continue
+                return
+            self._running = None
+            if error is not None:
+                raise RuntimeError(
+                    "[AsyncEvalHook] Evaluation of iteration {} failed:\n{}".format(iteration, error)
+                )
+            self._post(iteration, results)
+            self._dispatch()
+
+    def _post(self, iteration, results):
+        if results:
+            assert isinstance(
+                results, dict
+            ), "Eval function must return a dict. Got {} instead.".format(results)
+
+            flattened_results = flatten_results_dict(results)
+            for k, v in flattened_results.items():
+                try:
+                    v = float(v)
+                except Exception as e:
+                    raise ValueError(
+                        "[AsyncEvalHook] eval_function should return a nested dict of float. "
+                        "Got '{}: {}' instead.".format(k, v)
+                    ) from e
+            self.trainer.storage.put_scalars(
+                **flattened_results, smoothing_hint=False, cur_iter=iteration
+            )
+        self._logger.info("Received the evaluation results of iteration {}.".format(iteration))
+        if self._callback is not None:
+            self._callback(iteration, results)
+
+    def after_step(self):
+        self._collect()
+        next_iter = self.trainer.iter + 1
+        if self._period > 0 and next_iter % self._period == 0:
+            # do the last eval in after_train
+            if next_iter != self.trainer.max_iter:
+                self._submit(self.trainer.iter)
+
+    def after_train(self):
+        if self._process is None:
+            return
+        try:
+            # This condition is to prevent the eval from running after a failed training
+            if self.trainer.iter + 1 >= self.trainer.max_iter:
+                if self._eval_after_train:
+                    # the iteration of the last step, like EvalHook's results
+                    self._submit(self.trainer.storage.iter, force=True)
+                self._collect(block=True)
+                self._tasks.put(None)
+                self._process.join()
+        finally:
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+            self._waiting.clear()
+            self._running = None
+        # func is likely a closure that holds reference to the trainer
+        # therefore we clean it to avoid circular reference in the end
+        del self._snapshot, self._func, self._callback
+
+
 class PreciseBN(HookBase):
     """
     The standard implementation of BatchNorm uses EMA in inference, which is
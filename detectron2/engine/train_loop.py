@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) Facebook, Inc. and its affiliates.
 import concurrent.futures
+import contextlib
 import logging
 import numpy as np
 import time
@@ -250,6 +251,7 @@ class SimpleTrainer(TrainerBase):
         gather_metric_period=1,
         zero_grad_before_forward=False,
         async_write_metrics=False,
+        accumulation_steps=1,
     ):
         """
         Args:
@@ -262,6 +264,8 @@ class SimpleTrainer(TrainerBase):
             zero_grad_before_forward: whether to zero the gradients before the forward.
             async_write_metrics: bool. If True, then write metrics asynchronously to improve
                 training speed
+            accumulation_steps: an int. Number of batches whose gradients are accumulated
+                before each optimizer step. One iteration is one optimizer step.
         """
         super().__init__()
 
@@ -281,6 +285,8 @@ class SimpleTrainer(TrainerBase):
         self.gather_metric_period = gather_metric_period
         self.zero_grad_before_forward = zero_grad_before_forward
         self.async_write_metrics = async_write_metrics
+        assert accumulation_steps >= 1, accumulation_steps
+        self.accumulation_steps = accumulation_steps
         # create a thread pool that can execute non critical logic in run_step asynchronically
         # use only 1 worker so tasks will be executred in order of submitting.
         self.concurrent_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
@@ -290,38 +296,42 @@ class SimpleTrainer(TrainerBase):
         Implement the standard training logic described above.
         """
         assert self.model.training, "[SimpleTrainer] model was changed to eval mode!"
-        start = time.perf_counter()
-        """
-        If you want to do something with the data, you can wrap the dataloader.
-        """
-        data = next(self._data_loader_iter)
-        data_time = time.perf_counter() - start
-
-        if self.zero_grad_before_forward:
+        if self.accumulation_steps > 1:
+            loss_dict, data_time = self._accumulate_gradients(lambda losses: losses.backward())
+        else:
+            start = time.perf_counter()
             """
-            If you need to accumulate gradients or do something similar, you can
-            wrap the optimizer with your custom `zero_grad()` method.
+            If you want to do something with the data, you can wrap the dataloader.
             """
-            self.optimizer.zero_grad()
+            data = next(self._data_loader_iter)
+            data_time = time.perf_counter() - start
+
+            if self.zero_grad_before_forward:
+                """
+                If you need to accumulate gradients or do something similar, you can
+                wrap the optimizer with your custom `zero_grad()` method.
+                """
+                self.optimizer.zero_grad()
 
-        """
-        If you want to do something with the losses, you can wrap the model.
-        """
-        loss_dict = self.model(data)
-        if isinstance(loss_dict, torch.Tensor):
-            losses = loss_dict
-            loss_dict = {"total_loss": loss_dict}
-        else:
-            losses = sum(loss_dict.values())
-        if not self.zero_grad_before_forward:
             """
-            If you need to accumulate gradients or do something similar, you can
-            wrap the optimizer with your custom `zero_grad()` method.
+            If you want to do something with the losses, you can wrap the model.
             """
-            self.optimizer.zero_grad()
-        losses.backward()
+            loss_dict = self.model(data)
+            if isinstance(loss_dict, torch.Tensor):
+                losses = loss_dict
+                loss_dict = {"total_loss": loss_dict}
+            else:
+                losses = sum(loss_dict.values())
+            if not self.zero_grad_before_forward:
+                """
+                If you need to accumulate gradients or do something similar, you can
+                wrap the optimizer with your custom `zero_grad()` method.
+                """
+                self.optimizer.zero_grad()
+            losses.backward()
 
         self.after_backward()
+        self._put_transfer_time()
 
         if self.async_write_metrics:
             # write metrics asynchronically
@@ -338,6 +348,55 @@ class SimpleTrainer(TrainerBase):
         """
         self.optimizer.step()
 
+    def _accumulate_gradients(self, backward, autocast=contextlib.nullcontext):
+        """
+        Run ``self.accumulation_steps`` forward/backward passes on consecutive batches,
+        accumulating their gradients for a single optimizer step.
+
+        Args:
+            backward: callable taking the (already rescaled) loss and running backward.
+            autocast: context manager factory wrapping each forward.
+
+        Returns:
+            dict: losses averaged over the micro-batches.
+            float: total time spent waiting for data.
+        """
+        self.optimizer.zero_grad()
+        data_time = 0.0
+        loss_dict_avg = {}
+        for micro_step in range(self.accumulation_steps):
+            start = time.perf_counter()
+            data = next(self._data_loader_iter)
+            data_time += time.perf_counter() - start
+
+            # Gradients are only all-reduced across workers on the last micro-batch.
+            if isinstance(self.model, DistributedDataParallel) and micro_step < self.accumulation_steps - 1:
+                sync_context = self.model.no_sync()
+            else:
+                sync_context = contextlib.nullcontext()
+            with sync_context:
+                with autocast():
+                    loss_dict = self.model(data)
+                    if isinstance(loss_dict, torch.Tensor):
+                        losses = loss_dict
+                        loss_dict = {"total_loss": loss_dict}
+                    else:
+                        losses = sum(loss_dict.values())
+                # Each micro-batch contributes 1/N so the gradient matches one large batch.
+                backward(losses / self.accumulation_steps)
+
+            for k, v in loss_dict.items():
+                loss_dict_avg[k] = loss_dict_avg.get(k, 0.0) + v.detach() / self.accumulation_steps
+        return loss_dict_avg, data_time
+
+    def _put_transfer_time(self):
+        # Host-to-device copy time of a DevicePrefetcher-wrapped loader. The copies
+        # overlap with the previous step, so only the part not hidden by it shows up
+        # in data_time.
+        pop_transfer_time = getattr(self.data_loader, "pop_transfer_time", None)
+        if pop_transfer_time is not None:
+            get_event_storage().put_scalar("transfer_time", pop_transfer_time())
+
     @property
     def _data_loader_iter(self):
         # only create the data loader iterator when it is used
@@ -451,11 +510,12 @@ class AMPTrainer(SimpleTrainer):
         precision: torch.dtype = torch.float16,
         log_grad_scaler: bool = False,
         async_write_metrics=False,
+        accumulation_steps=1,
     ):
         """
         Args:
             model, data_loader, optimizer, gather_metric_period, zero_grad_before_forward,
-                async_write_metrics: same as in :class:`SimpleTrainer`.
+                async_write_metrics, accumulation_steps: same as in :class:`SimpleTrainer`.
             grad_scaler: torch GradScaler to automatically scale gradients.
             precision: torch.dtype as the target precision to cast to in computations
         """
@@ -465,7 +525,12 @@ class AMPTrainer(SimpleTrainer):
         assert not isinstance(model, DataParallel), unsupported
 
         super().__init__(
-            model, data_loader, optimizer, gather_metric_period, zero_grad_before_forward
+            model,
+            data_loader,
+            optimizer,
+            gather_metric_period,
+            zero_grad_before_forward,
+            accumulation_steps=accumulation_steps,
         )
 
         if grad_scaler is None:
@@ -484,30 +549,37 @@ class AMPTrainer(SimpleTrainer):
         assert torch.cuda.is_available(), "[AMPTrainer] CUDA is required for AMP training!"
         from torch.cuda.amp import autocast
 
-        start = time.perf_counter()
-        data = next(self._data_loader_iter)
-        data_time = time.perf_counter() - start
+        if self.accumulation_steps > 1:
+            loss_dict, data_time = self._accumulate_gradients(
+                lambda losses: self.grad_scaler.scale(losses).backward(),
+                autocast=lambda: autocast(dtype=self.precision),
+            )
+        else:
+            start = time.perf_counter()
+            data = next(self._data_loader_iter)
+            data_time = time.perf_counter() - start
 
-        if self.zero_grad_before_forward:
-            self.optimizer.zero_grad()
-        with autocast(dtype=self.precision):
-            loss_dict = self.model(data)
-            if isinstance(loss_dict, torch.Tensor):
-                losses = loss_dict
-                loss_dict = {"total_loss": loss_dict}
-            else:
-                losses = sum(loss_dict.values())
+            if self.zero_grad_before_forward:
+                self.optimizer.zero_grad()
+            with autocast(dtype=self.precision):
+                loss_dict = self.model(data)
+                if isinstance(loss_dict, torch.Tensor):
+                    losses = loss_dict
+                    loss_dict = {"total_loss": loss_dict}
+                else:
+                    losses = sum(loss_dict.values())
 
-        if not self.zero_grad_before_forward:
-            self.optimizer.zero_grad()
+            if not self.zero_grad_before_forward:
+                self.optimizer.zero_grad()
 
-        self.grad_scaler.scale(losses).backward()
+            self.grad_scaler.scale(losses).backward()
 
         if self.log_grad_scaler:
             storage = get_event_storage()
             storage.put_scalar("[metric]grad_scaler", self.grad_scaler.get_scale())
 
         self.after_backward()
+        self._put_transfer_time()
 
         if self.async_write_metrics:
             # write metrics asynchronically
@@ -1,6 +1,8 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 from .cityscapes_evaluation import CityscapesInstanceEvaluator, CityscapesSemSegEvaluator
 from .coco_evaluation import COCOEvaluator
+from .detection_store import DetectionReader, save_detections
+from .numpy_cocoeval import COCOevalNumpy
 from .rotated_coco_evaluation import RotatedCOCOEvaluator
 from .evaluator import DatasetEvaluator, DatasetEvaluators, inference_context, inference_on_dataset
 from .lvis_evaluation import LVISEvaluator
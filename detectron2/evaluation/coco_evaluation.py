@@ -39,12 +39,15 @@ import detectron2.utils.comm as comm
 from detectron2.config import CfgNode
 from detectron2.data import MetadataCatalog
 from detectron2.data.datasets.coco import convert_to_coco_json
+from detectron2.data.datasets.coco_index import load_coco_index
 # from detectron2.evaluation.fast_eval_api import COCOeval_opt  #自行添加的
-from detectron2.structures import Boxes, BoxMode, pairwise_iou
+from detectron2.structures import Boxes, BoxMode, Instances, pairwise_iou
 from detectron2.utils.file_io import PathManager
 from detectron2.utils.logger import create_small_table
 
+from .detection_store import DetectionStore, detections_to_coco_json, save_detections
 from .evaluator import DatasetEvaluator
+from .numpy_cocoeval import COCOevalNumpy
 
 try:
     from detectron2.evaluation.fast_eval_api import COCOeval_opt
@@ -63,6 +66,10 @@ class COCOEvaluator(DatasetEvaluator):
 
     In addition to COCO, this evaluator is able to support any bounding box detection,
     instance segmentation, or keypoint detection dataset.
+
+    Box-only predictions are not converted to COCO result dicts: they are appended
+    to a :class:`DetectionStore` (a file per rank in `output_dir` when distributed)
+    and evaluated from the merged arrays.
     """
 
     def __init__(
@@ -74,9 +81,14 @@ class COCOEvaluator(DatasetEvaluator):
         *,
         max_dets_per_image=None,
         use_fast_impl=True,
+        use_numpy_impl=False,
         kpt_oks_sigmas=(),
         allow_cached_coco=True,
-        cfg_file = None  #additional
+        cfg_file = None,  #additional
+        save_coco_json=False,
+        save_detections=False,
+        img_ids=None,
+        num_bootstrap=0,
     ):
         """
         Args:
@@ -97,8 +109,12 @@ class COCOEvaluator(DatasetEvaluator):
                 results predicted on the dataset. The dump contains two files:
 
                 1. "instances_predictions.pth" a file that can be loaded with `torch.load` and
-                   contains all the results in the format they are produced by the model.
-                2. "coco_instances_results.json" a json file in COCO's result format.
+                   contains all the results in the format they are produced by the model
+                   (only for proposals and mask / keypoint predictions).
+                2. "coco_eval_instances_results.json" a json file in COCO's result format,
+                   if `save_coco_json` (always for mask / keypoint predictions).
+                3. "detections/" the box predictions in a binary columnar format indexed
+                   by image (see :class:`DetectionReader`), if `save_detections`.
             max_dets_per_image (int): limit on the maximum number of detections per image.
                 By default in COCO, this limit is to 100, but this can be customized
                 to be greater, as is needed in evaluation metrics AP fixed and AP pool
@@ -108,6 +124,10 @@ class COCOEvaluator(DatasetEvaluator):
                 Although the results should be very close to the official implementation in COCO
                 API, it is still recommended to compute results with the official API for use in
                 papers. The faster implementation also uses more RAM.
+            use_numpy_impl (bool): compute bbox AP with :class:`COCOevalNumpy`, in this
+                process. It reproduces the official numbers on the regression fixture of
+                tools/verify_numpy_cocoeval.py; run that script on your own GT and
+                results before relying on it. Takes precedence over `use_fast_impl` for bbox.
             kpt_oks_sigmas (list[float]): The sigmas used to calculate keypoint OKS.
                 See http://cocodataset.org/#keypoints-eval
                 When empty, it will use the defaults in COCO.
@@ -115,16 +135,35 @@ class COCOEvaluator(DatasetEvaluator):
             allow_cached_coco (bool): Whether to use cached coco json from previous validation
                 runs. You should set this to False if you need to use different validation data.
                 Defaults to True.
+            save_coco_json (bool): write box predictions to
+                "coco_eval_instances_results.json" in `output_dir`.
+            save_detections (bool): write box predictions to "detections/" in `output_dir`.
+            img_ids (list[int]): the images to evaluate on when :meth:`evaluate` is called
+                without `img_ids`, e.g. the subset of images that the data loader runs on.
+                Default to None for the whole dataset.
+            num_bootstrap (int): if positive, also report 95% bootstrap confidence
+                intervals of the bbox AP and AP50 ("AP_ci_low", "AP_ci_high", ...),
+                from this number of resamples of the evaluated images. Needs
+                `use_numpy_impl`.
         """
         self._logger = logging.getLogger(__name__)
         self._distributed = distributed
         self._output_dir = output_dir
+        self._save_coco_json = save_coco_json
+        self._save_detections = save_detections
+        self._img_ids = img_ids
+        self._num_bootstrap = num_bootstrap
+        store_path = None
+        if distributed and output_dir and comm.get_world_size() > 1:
+            store_path = os.path.join(output_dir, "detections.rank{}.bin".format(comm.get_rank()))
+        self._detections = DetectionStore(store_path)
         self._cfg_file = cfg_file #additional
 
         if use_fast_impl and (COCOeval_opt is COCOeval):
             self._logger.info("Fast COCO eval is not built. Falling back to official COCO eval.")
             use_fast_impl = False
         self._use_fast_impl = use_fast_impl
+        self._use_numpy_impl = use_numpy_impl
 
         # COCOeval requires the limit on the number of detections per image (maxDets) to be a list
         # with at least 3 elements. The default maxDets in COCOeval is [1, 10, 100], in which the
@@ -165,8 +204,17 @@ class COCOEvaluator(DatasetEvaluator):
             convert_to_coco_json(dataset_name, cache_path, allow_cached=allow_cached_coco)
 
         json_file = PathManager.get_local_path(self._metadata.json_file)
-        with contextlib.redirect_stdout(io.StringIO()):
-            self._coco_api = COCO(json_file)
+        # the cached binary index avoids re-parsing large box-only annotation files
+        try:
+            coco_index = load_coco_index(json_file)
+        except ValueError as e:  # e.g. string ids
+            self._logger.warning("Not using a COCO index: {}".format(e))
+            coco_index = None
+        if coco_index is not None and coco_index.bbox_only:
+            self._coco_api = coco_index.coco_api()
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._coco_api = COCO(json_file)
 
         # Test set json files do not contain annotations (evaluation must be
         # performed using the COCO evaluation server).
@@ -176,6 +224,7 @@ class COCOEvaluator(DatasetEvaluator):
 
     def reset(self):
         self._predictions = []
+        self._detections.reset()
 
     def process(self, inputs, outputs):
         """
@@ -186,12 +235,22 @@ class COCOEvaluator(DatasetEvaluator):
             outputs: the outputs of a COCO model. It is a list of dicts with key
                 "instances" that contains :class:`Instances`.
         """
-        for input, output in zip(inputs, outputs):
+        instances_list = [output["instances"] for output in outputs if "instances" in output]
+        if len(instances_list) == len(outputs) > 1:
+            # one device-to-host copy per field for the whole batch
+            instances_list = _batched_instances_to(instances_list, self._cpu_device)
+        else:
+            instances_list = [None] * len(outputs)
+        for input, output, instances in zip(inputs, outputs, instances_list):
             prediction = {"image_id": input["image_id"]}
 
             if "instances" in output:
-                instances = output["instances"].to(self._cpu_device)
-                prediction["instances"] = instances_to_coco_json(instances, input["image_id"])
+                if instances is None:
+                    instances = output["instances"].to(self._cpu_device)
+                if instances.has("pred_masks") or instances.has("pred_keypoints"):
+                    prediction["instances"] = instances_to_coco_json(instances, input["image_id"])
+                else:
+                    self._detections.append(input["image_id"], *_instances_to_arrays(instances))
             if "proposals" in output:
                 prediction["proposals"] = output["proposals"].to(self._cpu_device)
             if len(prediction) > 1:
@@ -200,33 +259,41 @@ class COCOEvaluator(DatasetEvaluator):
     def evaluate(self, img_ids=None):
         """
         Args:
-            img_ids: a list of image IDs to evaluate on. Default to None for the whole dataset
+            img_ids: a list of image IDs to evaluate on. Default to None for the `img_ids`
+                given to the constructor, or the whole dataset
         """
+        if img_ids is None:
+            img_ids = self._img_ids
         if self._distributed:
             comm.synchronize()
             predictions = comm.gather(self._predictions, dst=0)
             predictions = list(itertools.chain(*predictions))
+            detections = self._detections.gather(dst=0)
 
             if not comm.is_main_process():
                 return {}
         else:
             predictions = self._predictions
+            detections = self._detections.local()
 
-        if len(predictions) == 0:
+        detections, detected_img_ids = detections
+        if len(predictions) == 0 and len(detected_img_ids) == 0:
             self._logger.warning("[COCOEvaluator] Did not receive valid predictions.")
             return {}
 
-        if self._output_dir:
+        if self._output_dir and len(predictions):
             PathManager.mkdirs(self._output_dir)
             file_path = os.path.join(self._output_dir, "instances_predictions.pth")
             with PathManager.open(file_path, "wb") as f:
                 torch.save(predictions, f)
 
         self._results = OrderedDict()
-        if "proposals" in predictions[0]:
+        if len(predictions) and "proposals" in predictions[0]:
             self._eval_box_proposals(predictions)
-        if "instances" in predictions[0]:
+        if len(predictions) and "instances" in predictions[0]:
             self._eval_predictions(predictions, img_ids=img_ids)
+        if len(detected_img_ids):
+            self._eval_detections(detections, detected_img_ids, img_ids=img_ids)
         # Copy so the caller can do whatever with results
         return copy.deepcopy(self._results)
 
@@ -308,6 +375,104 @@ class COCOEvaluator(DatasetEvaluator):
             )
             self._results[task] = res
 
+    def _eval_detections(self, detections, detected_img_ids, img_ids=None):
+        """
+        Evaluate box detections (records of ``DETECTION_DTYPE``) made on the images
+        `detected_img_ids`. Fill self._results with the "bbox" metrics.
+        """
+        # unmap the category ids for COCO
+        if hasattr(self._metadata, "thing_dataset_id_to_contiguous_id"):
+            dataset_id_to_contiguous_id = self._metadata.thing_dataset_id_to_contiguous_id
+            num_classes = len(dataset_id_to_contiguous_id)
+            reverse_id_mapping = np.zeros(num_classes, dtype=np.int64)
+            for k, v in dataset_id_to_contiguous_id.items():
+                reverse_id_mapping[v] = k
+            category_ids = detections["category_id"]
+            assert len(category_ids) == 0 or category_ids.max() < num_classes, (
+                f"A prediction has class={category_ids.max()}, "
+                f"but the dataset only has {num_classes} classes and "
+                f"predicted class id should be in [0, {num_classes - 1}]."
+            )
+            detections = detections.copy()
+            detections["category_id"] = reverse_id_mapping[category_ids]
+
+        if self._output_dir and self._save_coco_json:
+            file_path = os.path.join(self._output_dir, "coco_eval_instances_results.json")
+            self._logger.info("Saving results to {}".format(file_path))
+            PathManager.mkdirs(self._output_dir)
+            with PathManager.open(file_path, "w") as f:
+                detections_to_coco_json(detections, f)
+        if self._output_dir and self._save_detections:
+            dir_path = os.path.join(self._output_dir, "detections")
+            self._logger.info("Saving detections to {}".format(dir_path))
+            save_detections(dir_path, detections, detected_img_ids)
+
+        if not self._do_evaluation:
+            self._logger.info("Annotations are not available for evaluation.")
+            return
+
+        if len(detections) == 0:
+            coco_eval = None  # cocoapi does not handle empty results very well
+        elif self._use_numpy_impl:
+            self._logger.info("Evaluating predictions with NumPy COCO API...")
+            # no process pool: the evaluator runs inside training and dataloader processes
+            coco_eval = _evaluate_detections_on_coco(
+                self._coco_api, detections, img_ids=img_ids, max_dets_per_image=self._max_dets_per_image,
+                num_workers=0,
+            )
+        else:
+            self._logger.info(
+                "Evaluating predictions with {} COCO API...".format(
+                    "unofficial" if self._use_fast_impl else "official"
+                )
+            )
+            coco_results = [
+                {"image_id": i, "category_id": c, "bbox": b, "score": sc}
+                for i, c, b, sc in zip(
+                    detections["image_id"].tolist(), detections["category_id"].tolist(),
+                    detections["bbox"].tolist(), detections["score"].tolist(),
+                )
+            ]
+            coco_eval = _evaluate_predictions_on_coco(
+                self._coco_api,
+                coco_results,
+                "bbox",
+                use_fast_impl=self._use_fast_impl,
+                cocoeval_fn=COCOeval_opt if self._use_fast_impl else COCOeval,
+                img_ids=img_ids,
+                max_dets_per_image=self._max_dets_per_image,
+            )
+        self._results["bbox"] = self._derive_coco_results(
+            coco_eval, "bbox", class_names=self._metadata.get("thing_classes")
+        )
+        if self._num_bootstrap > 0 and coco_eval is not None:
+            if isinstance(coco_eval, COCOevalNumpy):
+                self._results["bbox"].update(self._bootstrap_intervals(coco_eval))
+            else:
+                self._logger.warning("Bootstrap confidence intervals need use_numpy_impl=True.")
+
+    def _bootstrap_intervals(self, coco_eval, confidence=0.95):
+        """
+        Percentile bootstrap confidence intervals of AP and AP50, resampling the
+        evaluated images (see :meth:`COCOevalNumpy.bootstrap`).
+        """
+        aps = coco_eval.bootstrap(self._num_bootstrap)
+        iou_thrs = np.asarray(coco_eval.params.iouThrs)
+        samples = {"AP": aps.mean(axis=1), "AP50": aps[:, np.flatnonzero(np.isclose(iou_thrs, 0.5))[0]]}
+        tail = (1 - confidence) / 2 * 100
+        res = {}
+        for metric, values in samples.items():
+            low, high = np.nanpercentile(values * 100, [tail, 100 - tail])
+            res[metric + "_ci_low"] = float(low)
+            res[metric + "_ci_high"] = float(high)
+        self._logger.info(
+            "{:.0f}% bootstrap confidence intervals ({} resamples of {} images): \n".format(
+                confidence * 100, self._num_bootstrap, len(coco_eval.params.imgIds)
+            )
+            + create_small_table(res)
+        )
+        return res
+
     def _eval_box_proposals(self, predictions):
         """
         Evaluate the box proposals in predictions.
@@ -416,6 +581,40 @@ class COCOEvaluator(DatasetEvaluator):
         return results
 
 
+def _batched_instances_to(instances_list, device):
+    """
+    Like ``[x.to(device) for x in instances_list]``, but concatenates each field over
+    the batch so that it is copied once instead of once per image.
+    """
+    fields = instances_list[0].get_fields().keys()
+    if any(x.get_fields().keys() != fields for x in instances_list):
+        return [x.to(device) for x in instances_list]
+    lengths = [len(x) for x in instances_list]
+    ret = [Instances(x.image_size) for x in instances_list]
+    for name in fields:
+        values = [x.get(name) for x in instances_list]
+        tensors = [v.tensor if isinstance(v, Boxes) else v for v in values]
+        if not all(isinstance(t, torch.Tensor) and t.shape[1:] == tensors[0].shape[1:] for t in tensors):
+            parts = [v.to(device) for v in values]
+        else:
+            parts = torch.cat(tensors).to(device).split(lengths)
+            if isinstance(values[0], Boxes):
+                parts = [type(values[0])(p) for p in parts]
+        for r, p in zip(ret, parts):
+            r.set(name, p)
+    return ret
+
+
+def _instances_to_arrays(instances):
+    """
+    Boxes (XYWH_ABS), scores and classes of an "Instances" object as numpy arrays,
+    with the values ``instances_to_coco_json`` would write.
+    """
+    boxes = instances.pred_boxes.tensor.numpy()
+    boxes = BoxMode.convert(boxes, BoxMode.XYXY_ABS, BoxMode.XYWH_ABS)
+    return boxes, instances.scores.numpy(), instances.pred_classes.numpy()
+
+
 def instances_to_coco_json(instances, img_id):
     """
     Dump an "Instances" object to a COCO-format json that's used for evaluation.
@@ -662,6 +861,33 @@ def _evaluate_predictions_on_coco(
     return coco_eval
 
 
+def _evaluate_detections_on_coco(coco_gt, detections, img_ids=None, max_dets_per_image=None, num_workers=0):
+    """
+    Like :func:`_evaluate_predictions_on_coco` for "bbox", from the arrays of
+    ``DETECTION_DTYPE`` records, with :class:`COCOevalNumpy` (`num_workers` processes).
+    """
+    if max_dets_per_image is None:
+        max_dets_per_image = [1, 10, 100]  # Default from COCOEval
+    cocoeval_fn = COCOevalNumpy if max_dets_per_image[2] == 100 else COCOevalNumpyMaxDets
+    coco_eval = cocoeval_fn.from_arrays(
+        coco_gt,
+        {
+            "image_ids": detections["image_id"],
+            "category_ids": detections["category_id"],
+            "boxes": detections["bbox"],
+            "scores": detections["score"],
+        },
+        num_workers=num_workers,
+    )
+    coco_eval.params.maxDets = max_dets_per_image
+    if img_ids is not None:
+        coco_eval.params.imgIds = img_ids
+    coco_eval.evaluate()
+    coco_eval.accumulate()
+    coco_eval.summarize()
+    return coco_eval
+
+
 class COCOevalMaxDets(COCOeval):
     """
     Modified version of COCOeval for evaluating AP with a custom
@@ -751,3 +977,9 @@ class COCOevalMaxDets(COCOeval):
 
     def __str__(self):
         self.summarize()
+
+
+class COCOevalNumpyMaxDets(COCOevalMaxDets, COCOevalNumpy):
+    """
+    :class:`COCOevalMaxDets` summary on top of the :class:`COCOevalNumpy` engine.
+    """
@@ -0,0 +1,247 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import json
+import logging
+import os
+import numpy as np
+
+import detectron2.utils.comm as comm
+from detectron2.utils.file_io import PathManager
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "DETECTION_DTYPE",
+    "DetectionReader",
+    "DetectionStore",
+    "detections_to_coco_json",
+    "save_detections",
+]
+
+# one fixed-size record per detection; "bbox" is XYWH_ABS like in COCO results
+DETECTION_DTYPE = np.dtype(
+    [("image_id", np.int64), ("category_id", np.int32), ("score", np.float32), ("bbox", np.float32, (4,))]
+)
+
+
+class DetectionStore:
+    """
+    Append-only storage of the box detections of one process, as records of
+    :data:`DETECTION_DTYPE` (each field readable as a column, e.g. ``data["score"]``).
+
+    Detections are appended into a preallocated buffer. When it is full, it is
+    appended to the file at `path` (one file per rank) or, without a path, kept
+    in memory. :meth:`gather` merges the ranks by concatenating their files on the
+    destination rank, so no per-detection Python objects are created or pickled.
+    """
+
+    def __init__(self, path=None, capacity=1 << 16):
+        """
+        Args:
+            path (str or None): this rank's file; should be on a filesystem that
+                the rank gathering the detections can read.
+            capacity (int): number of records buffered before they are written.
+        """
+        self.path = path
+        self._buffer = np.empty(capacity, dtype=DETECTION_DTYPE)
+        self.reset()
+
+    def reset(self):
+        self._size = 0
+        self._chunks = []
+        self._num_flushed = 0
+        self.image_ids = []
+        if self.path:
+            PathManager.mkdirs(os.path.dirname(self.path))
+            open(self.path, "wb").close()
+
+    def __len__(self):
+        return self._num_flushed + self._size
+
+    def append(self, image_id, boxes, scores, classes):
+        """
+        Append the detections of one image.
+
+        Args:
+            image_id (int):
+            boxes (ndarray): (N, 4) boxes in XYWH_ABS.
+            scores, classes (ndarray): (N,)
+        """
+        self.image_ids.append(image_id)
+        n = len(scores)
+        if self._size + n > len(self._buffer):
+            self._flush()
+            if n > len(self._buffer):
+                self._buffer = np.empty(n, dtype=DETECTION_DTYPE)
+        rows = self._buffer[self._size : self._size + n]
+        rows["image_id"] = image_id
+        rows["category_id"] = classes
+        rows["score"] = scores
+        rows["bbox"] = boxes
+        self._size += n
+
+    def _flush(self):
+        if self._size == 0:
+            return
+        data = self._buffer[: self._size]
+        if self.path:
+            with open(self.path, "ab") as f:
+                data.tofile(f)
+        else:
+            self._chunks.append(data.copy())
+        self._num_flushed += self._size
+        self._size = 0
+
+    def local(self):
+        """
+        Returns:
+            (ndarray, ndarray): the detections of this process and the ids of the
+            images they were appended for, in order.
+        """
+        self._flush()
+        if self.path:
+            data = np.fromfile(self.path, dtype=DETECTION_DTYPE)
+        else:
+            data = np.concatenate(self._chunks + [np.zeros(0, dtype=DETECTION_DTYPE)])
+        return data, np.asarray(self.image_ids, dtype=np.int64)
+
+    def gather(self, dst=0):
+        """
+        Collective: the detections and image ids of all ranks, in rank order.
+
+        The files are concatenated on `dst` if it can read all of them; otherwise
+        (e.g. no shared filesystem) each rank sends its records as one array.
+
+        Returns:
+            (ndarray, ndarray) on `dst`, None on the other ranks. Merged files are
+            removed: call :meth:`reset` before appending again.
+        """
+        if comm.get_world_size() == 1:
+            return self.local()
+        self._flush()
+        paths = comm.all_gather(self.path)
+        # also a barrier: every rank has flushed its file
+        visible = comm.all_gather(all(p is not None and os.path.isfile(p) for p in paths))
+        image_ids = comm.gather(np.asarray(self.image_ids, dtype=np.int64), dst=dst)
+        if all(visible):
+            data = [np.fromfile(p, dtype=DETECTION_DTYPE) for p in paths] if comm.get_rank() == dst else []
+            # dst has read every file before any is removed
+            comm.synchronize()
+        else:
+            logger.info("Detection files of some ranks are not visible, gathering them instead.")
+            data = comm.gather(self.local()[0], dst=dst)
+        # the records are read and the file can go; reset() creates it again
+        if self.path:
+            os.remove(self.path)
+        if comm.get_rank() != dst:
+            return None
+        return np.concatenate(data), np.concatenate(image_ids)
+
+
+def detections_to_coco_json(detections, file, chunk_size=1 << 16):
+    """
+    Write detections to an open text file as a COCO results json, the same text
+    as ``json.dumps`` of the list of result dicts, converting `chunk_size`
+    detections at a time.
+
+    Args:
+        detections: anything with the columns "image_id", "category_id", "bbox"
+            (XYWH) and "score", e.g. records of :data:`DETECTION_DTYPE` or a
+            :class:`DetectionReader`.
+    """
+    file.write("[")
+    for start in range(0, len(detections["score"]), chunk_size):
+        chunk = {k: np.asarray(detections[k][start : start + chunk_size]) for k in DETECTION_DTYPE.names}
+        results = [
+            {"image_id": i, "category_id": c, "bbox": b, "score": s}
+            for i, c, b, s in zip(
+                chunk["image_id"].tolist(),
+                chunk["category_id"].tolist(),
+                chunk["bbox"].tolist(),
+                chunk["score"].tolist(),
+            )
+        ]
+        if start > 0:
+            file.write(", ")
+        file.write(json.dumps(results)[1:-1])
+    file.write("]")
+
+
+def save_detections(directory, detections, image_ids=None):
+    """
+    Save detections in the binary detections format: a directory with one
+    ``.npy`` file per column ("image_id", "category_id", "bbox" as float32 XYWH,
+    "score"), sorted by image, and ``index.npz`` with the sorted "image_ids" and
+    the "offsets" of their detections, so the detections of ``image_ids[i]`` are
+    rows ``offsets[i]:offsets[i + 1]``. Read it with :class:`DetectionReader`.
+
+    Args:
+        detections: records of :data:`DETECTION_DTYPE` (or same columns).
+        image_ids (array): all images that were evaluated, including those
+            without detections; defaults to the images of the detections.
+    """
+    det_images = np.asarray(detections["image_id"], dtype=np.int64)
+    order = np.argsort(det_images, kind="stable")
+    index_ids = np.unique(det_images if image_ids is None else np.concatenate([image_ids, det_images]))
+    offsets = np.searchsorted(det_images[order], index_ids, side="left")
+    offsets = np.append(offsets, len(order)).astype(np.int64)
+
+    PathManager.mkdirs(directory)
+    for name in DETECTION_DTYPE.names:
+        dtype = DETECTION_DTYPE.fields[name][0].base
+        np.save(os.path.join(directory, name + ".npy"), np.asarray(detections[name])[order].astype(dtype))
+    np.savez(os.path.join(directory, "index.npz"), image_ids=index_ids, offsets=offsets)
+
+
+class DetectionReader:
+    """
+    Read detections saved by :func:`save_detections`, with the columns memory-mapped,
+    or a COCO results json (parsed into arrays of the same layout, in float64).
+
+    Columns are available as ``reader["score"]`` etc. (all detections, sorted by
+    image) and the detections of one image with :meth:`get`, which only touches
+    the rows of that image.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path):
+            self._columns = {
+                name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in DETECTION_DTYPE.names
+            }
+            with np.load(os.path.join(path, "index.npz")) as index:
+                self.image_ids = index["image_ids"]
+                self.offsets = index["offsets"]
+        else:
+            with PathManager.open(path) as f:
+                results = json.load(f)
+            # float64 like the json numbers, so that evaluating them is not affected
+            columns = {
+                "image_id": np.asarray([r["image_id"] for r in results], dtype=np.int64),
+                "category_id": np.asarray([r["category_id"] for r in results], dtype=np.int64),
+                "score": np.asarray([r["score"] for r in results], dtype=np.float64),
+                "bbox": np.asarray([r["bbox"] for r in results], dtype=np.float64).reshape(-1, 4),
+            }
+            del results
+            order = np.argsort(columns["image_id"], kind="stable")
+            self._columns = {name: column[order] for name, column in columns.items()}
+            self.image_ids, starts = np.unique(self._columns["image_id"], return_index=True)
+            self.offsets = np.append(starts, len(order)).astype(np.int64)
+
+    def __len__(self):
+        return len(self._columns["score"])
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def get(self, image_id):
+        """
+        Returns:
+            dict: "bbox" (N, 4) XYWH, "score" and "category_id" of the detections
+            of `image_id` (empty if the image has none).
+        """
+        i = np.searchsorted(self.image_ids, image_id)
+        if i == len(self.image_ids) or self.image_ids[i] != image_id:
+            start = end = 0
+        else:
+            start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: np.asarray(self._columns[name][start:end]) for name in ("bbox", "score", "category_id")}
@@ -1,6 +1,8 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import datetime
 import logging
+import queue
+import threading
 import time
 from collections import OrderedDict, abc
 from contextlib import ExitStack, contextmanager
@@ -100,14 +102,117 @@ class DatasetEvaluators(DatasetEvaluator):
         return results
 
 
+class _EvalWorker:
+    """
+    Run `evaluator.process` on (inputs, outputs) pairs in a background thread, in
+    the order they are put, with at most `maxsize` pairs waiting.
+    """
+
+    def __init__(self, evaluator, maxsize, num_warmup):
+        self._evaluator = evaluator
+        self._num_warmup = num_warmup
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._device = torch.cuda.current_device() if torch.cuda.is_available() else None
+        self.error = None
+        # time spent in process() on the batches after the warmup
+        self.eval_time = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self._device is not None:
+            # threads do not inherit the current device
+            torch.cuda.set_device(self._device)
+        with torch.no_grad():
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                idx, inputs, outputs = item
+                if self.error is not None:
+                    # keep consuming so that put() never blocks
+                    continue
+                start = time.perf_counter()
+                try:
+                    self._evaluator.process(inputs, outputs)
+                except Exception as e:
+                    self.error = e
+                    continue
+                if idx >= self._num_warmup:
+                    self.eval_time += time.perf_counter() - start
+
+    def put(self, idx, inputs, outputs):
+        """
+        Returns:
+            int: number of pairs waiting, including this one.
+        """
+        if self.error is not None:
+            raise self.error
+        self._queue.put((idx, inputs, outputs))
+        return self._queue.qsize()
+
+    def close(self):
+        """
+        Wait until all pairs are processed, and raise the error of `process` if any.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def _prefetch(data_loader, depth, stop):
+    """
+    Iterate `data_loader` in a background thread with up to `depth` batches loaded
+    ahead. Yields (batch, number of batches that were ready).
+    """
+    out = queue.Queue(maxsize=depth)
+
+    def produce():
+        try:
+            for batch in data_loader:
+                while not stop.is_set():
+                    try:
+                        out.put(batch, timeout=1.0)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            out.put(StopIteration())
+        except Exception as e:
+            out.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        ready = out.qsize()
+        item = out.get()
+        if isinstance(item, StopIteration):
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item, ready
+
+
 def inference_on_dataset(
-    model, data_loader, evaluator: Union[DatasetEvaluator, List[DatasetEvaluator], None]
+    model,
+    data_loader,
+    evaluator: Union[DatasetEvaluator, List[DatasetEvaluator], None],
+    *,
+    prefetch: int = 2,
+    eval_queue_size: int = 4,
 ):
     """
     Run model on the data_loader and evaluate the metrics with evaluator.
     Also benchmark the inference speed of `model.__call__` accurately.
     The model will be used in eval mode.
 
+    The three stages are pipelined: batches are loaded ahead in a background thread,
+    the model runs in the calling thread, and `evaluator.process` (e.g. moving the
+    outputs to CPU and converting them) runs in another thread, in order. Data loading
+    and evaluation then overlap with the model instead of adding to its time.
+
     Args:
         model (callable): a callable which takes an object from
             `data_loader` and returns some outputs.
@@ -119,6 +224,9 @@ def inference_on_dataset(
             The elements it generates will be the inputs to the model.
         evaluator: the evaluator(s) to run. Use `None` if you only want to benchmark,
             but don't want to do any evaluation.
+        prefetch (int): number of batches loaded ahead. 0 to load them in the loop.
+        eval_queue_size (int): number of batches that may wait for `evaluator.process`.
+            0 to process them in the loop.
 
     Returns:
         The return value of `evaluator.evaluate()`
@@ -140,20 +248,38 @@ def inference_on_dataset(
     total_data_time = 0
     total_compute_time = 0
     total_eval_time = 0
+    # summed number of batches ready in the data queue / waiting in the eval queue
+    total_data_queue = 0
+    total_eval_queue = 0
+    num_images = 0
     with ExitStack() as stack:
         if isinstance(model, nn.Module):
             stack.enter_context(inference_context(model))
         stack.enter_context(torch.no_grad())
+        if prefetch > 0:
+            stop = threading.Event()
+            stack.callback(stop.set)
+            batches = _prefetch(data_loader, prefetch, stop)
+        else:
+            batches = ((inputs, 0) for inputs in data_loader)
+        worker = None
+        if eval_queue_size > 0:
+            worker = _EvalWorker(evaluator, eval_queue_size, num_warmup)
+            # runs first on exit: the evaluator is done before the time is measured
+            stack.callback(worker.close)
 
         start_data_time = time.perf_counter()
         # 迭代测试数据进行检测
-        for idx, inputs in enumerate(data_loader):
+        for idx, (inputs, data_queue) in enumerate(batches):
             total_data_time += time.perf_counter() - start_data_time
             if idx == num_warmup:
                 start_time = time.perf_counter()
                 total_data_time = 0
                 total_compute_time = 0
                 total_eval_time = 0
+                total_data_queue = 0
+                total_eval_queue = 0
+                num_images = 0
 
             start_compute_time = time.perf_counter()
             outputs = model(inputs)
@@ -161,14 +287,21 @@ def inference_on_dataset(
                 torch.cuda.synchronize()
             total_compute_time += time.perf_counter() - start_compute_time
 
-            start_eval_time = time.perf_counter()
-            evaluator.process(inputs, outputs)
-            total_eval_time += time.perf_counter() - start_eval_time
+            if worker is not None:
+                total_eval_queue += worker.put(idx, inputs, outputs)
+            else:
+                start_eval_time = time.perf_counter()
+                evaluator.process(inputs, outputs)
+                total_eval_time += time.perf_counter() - start_eval_time
+            total_data_queue += data_queue
+            num_images += len(inputs) if isinstance(inputs, (list, tuple)) else 1
 
             iters_after_start = idx + 1 - num_warmup * int(idx >= num_warmup)
             # 每次迭代时长：加载数据、测试、总时长
             data_seconds_per_iter = total_data_time / iters_after_start
             compute_seconds_per_iter = total_compute_time / iters_after_start
+            if worker is not None:
+                total_eval_time = worker.eval_time
             eval_seconds_per_iter = total_eval_time / iters_after_start
             total_seconds_per_iter = (time.perf_counter() - start_time) / iters_after_start
             if idx >= num_warmup * 2 or compute_seconds_per_iter > 5:
@@ -181,12 +314,16 @@ def inference_on_dataset(
                         f"Inference: {compute_seconds_per_iter:.4f} s/iter. "
                         f"Eval: {eval_seconds_per_iter:.4f} s/iter. "
                         f"Total: {total_seconds_per_iter:.4f} s/iter. "
+                        f"Queues: data {total_data_queue / iters_after_start:.1f}/{prefetch}, "
+                        f"eval {total_eval_queue / iters_after_start:.1f}/{eval_queue_size}. "
                         f"ETA={eta}"
                     ),
                     n=5,
                 )
             start_data_time = time.perf_counter()
 
+    if worker is not None:
+        total_eval_time = worker.eval_time
     # Measure the time only for this worker (before the synchronization barrier)
     total_time = time.perf_counter() - start_time
     total_time_str = str(datetime.timedelta(seconds=total_time))
@@ -202,6 +339,25 @@ def inference_on_dataset(
             total_compute_time_str, total_compute_time / (total - num_warmup), num_devices
         )
     )
+    if prefetch > 0 or worker is not None:
+        num_iters = max(total - num_warmup, 1)
+        logger.info(
+            "Data loading wait: {:.6f} s / iter, evaluator: {:.6f} s / iter; "
+            "average queue occupancy: data {:.2f}/{}, eval {:.2f}/{}".format(
+                total_data_time / num_iters,
+                total_eval_time / num_iters,
+                total_data_queue / num_iters,
+                prefetch,
+                total_eval_queue / num_iters,
+                eval_queue_size,
+            )
+        )
+    if num_images:
+        logger.info(
+            "Inference throughput: {:.2f} images / s per device ({:.1f} images per batch)".format(
+                num_images / total_time, num_images / (total - num_warmup)
+            )
+        )
 
     results = evaluator.evaluate()
     # An evaluator may return None when not in main process.
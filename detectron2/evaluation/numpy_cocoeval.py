@@ -0,0 +1,488 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import copy
+import datetime
+import logging
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+from pycocotools.cocoeval import COCOeval
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["COCOevalNumpy", "coco_box_arrays"]
+
+# images per task of the process pool
+_CHUNK = 512
+# state of the running evaluate(), inherited by the forked workers instead of pickled
+_STATE = None
+
+
+def coco_box_arrays(coco):
+    """
+    Columnar view of the annotations of a COCO api object (ground truth or results
+    from ``loadRes``), in the order of ``coco.dataset["annotations"]``.
+
+    Returns:
+        dict: "image_ids", "category_ids", "ids" (int64), "boxes" (float64 XYWH),
+        "areas", "scores" (float64) and "iscrowd" (bool), one row per annotation.
+    """
+    anns = coco.dataset.get("annotations", [])
+    n = len(anns)
+    return {
+        "image_ids": np.fromiter((a["image_id"] for a in anns), np.int64, n),
+        "category_ids": np.fromiter((a["category_id"] for a in anns), np.int64, n),
+        "ids": np.fromiter((a["id"] for a in anns), np.int64, n),
+        "boxes": np.array([a["bbox"] for a in anns], dtype=np.float64).reshape(-1, 4),
+        "areas": np.fromiter((a["area"] for a in anns), np.float64, n),
+        "scores": np.fromiter((a.get("score", 0.0) for a in anns), np.float64, n),
+        "iscrowd": np.fromiter((bool(a.get("iscrowd", 0)) for a in anns), bool, n),
+    }
+
+
+def _complete_box_arrays(arrays):
+    """
+    Fill the optional fields of box arrays with what ``loadRes`` would assign.
+    """
+    boxes = np.asarray(arrays["boxes"], dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    ret = {
+        "image_ids": np.asarray(arrays["image_ids"], dtype=np.int64),
+        "category_ids": np.asarray(arrays["category_ids"], dtype=np.int64),
+        "boxes": boxes,
+    }
+    ret["ids"] = np.asarray(arrays["ids"], dtype=np.int64) if "ids" in arrays else np.arange(1, n + 1)
+    ret["areas"] = (
+        np.asarray(arrays["areas"], dtype=np.float64) if "areas" in arrays else boxes[:, 2] * boxes[:, 3]
+    )
+    ret["scores"] = (
+        np.asarray(arrays["scores"], dtype=np.float64) if "scores" in arrays else np.zeros(n)
+    )
+    ret["iscrowd"] = (
+        np.asarray(arrays["iscrowd"]).astype(bool) if "iscrowd" in arrays else np.zeros(n, dtype=bool)
+    )
+    return ret
+
+
+def _group(arrays, img_ids, cat_ids):
+    """
+    Keep the rows of `arrays` on (img_ids x cat_ids) and sort them by
+    (image, category) key, stably so rows of one key keep their order.
+    """
+    img_pos = np.searchsorted(img_ids, arrays["image_ids"])
+    cat_pos = np.searchsorted(cat_ids, arrays["category_ids"])
+    known = (img_pos < len(img_ids)) & (cat_pos < len(cat_ids))
+    known[known] = (img_ids[img_pos[known]] == arrays["image_ids"][known]) & (
+        cat_ids[cat_pos[known]] == arrays["category_ids"][known]
+    )
+    keys = img_pos[known] * len(cat_ids) + cat_pos[known]
+    order = np.argsort(keys, kind="stable")
+    ret = {k: v[known][order] for k, v in arrays.items() if k not in ("image_ids", "category_ids")}
+    ret["keys"] = keys[order]
+    return ret
+
+
+def _bbox_iou(dt, gt, crowd):
+    """
+    IoU of XYWH boxes `dt` (D, 4) and `gt` (G, 4) with the operations (and hence
+    the rounding) of ``bbIou`` in the COCO api's maskApi.c.
+    """
+    dx, dy, dw, dh = (dt[:, i : i + 1] for i in range(4))
+    gx, gy, gw, gh = gt[:, 0], gt[:, 1], gt[:, 2], gt[:, 3]
+    da = dw * dh
+    ga = gw * gh
+    w = np.minimum(dw + dx, gw + gx) - np.maximum(dx, gx)
+    h = np.minimum(dh + dy, gh + gy) - np.maximum(dy, gy)
+    overlap = (w > 0) & (h > 0)
+    inter = w * h
+    union = np.where(crowd, da, da + ga - inter)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(overlap, inter / union, 0.0)
+
+
+def _last_argmax(values, mask):
+    """
+    Per row, the last column of the maximum of `values` among `mask`, or -1.
+    """
+    masked = np.where(mask, values, -np.inf)
+    idx = masked.shape[1] - 1 - np.argmax(masked[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), idx, -1)
+
+
+def _match(ious, gt_ignore, crowd, thresholds):
+    """
+    The greedy matching of ``COCOeval.evaluateImg``, for all IoU thresholds at once.
+
+    Detections (rows of `ious`) are sorted by score and GT (columns) by ignore
+    flag. A detection takes the best free (or crowd) non-ignored GT with IoU above
+    the threshold, on ties the last one, and an ignored GT only if there is none.
+
+    Returns:
+        ndarray: (T, D) column of the matched GT, -1 if unmatched.
+    """
+    num_dt = ious.shape[0]
+    matches = np.full((len(thresholds), num_dt), -1, dtype=np.int64)
+    taken = np.zeros((len(thresholds), ious.shape[1]), dtype=bool)
+    regular = ~gt_ignore
+    # a detection that overlaps no GT enough for the lowest threshold never matches
+    for d in np.flatnonzero(ious.max(axis=1) >= thresholds.min()):
+        row = ious[d]
+        ok = (~taken | crowd) & (row >= thresholds[:, None])
+        m = _last_argmax(row, ok & regular)
+        m = np.where(m >= 0, m, _last_argmax(row, ok & gt_ignore))
+        hit = np.flatnonzero(m >= 0)
+        matches[hit, d] = m[hit]
+        taken[hit, m[hit]] = True
+    return matches
+
+
+def _evaluate_chunk(bounds, state=None):
+    """
+    Evaluate the (image, category) pairs of images bounds[0]:bounds[1].
+
+    Returns:
+        dict: per pair its "keys" and number of non-ignored GT per area range
+        ("npig", (P, A)); per detection kept (the top ``maxDets[-1]`` of its pair)
+        its "pair" (index into the keys), "rank" in the pair, "score" and the
+        true / false positive flags ("tp", "fp", (A, T, N) packed along T).
+    """
+    gt, dt, params = state if state is not None else _STATE
+    num_cats = params["num_cats"]
+    thresholds = params["thresholds"]
+    area_rngs = params["area_rngs"]
+    max_det = params["max_det"]
+    num_thrs, num_areas = len(thresholds), len(area_rngs)
+
+    lo, hi = bounds[0] * num_cats, bounds[1] * num_cats
+    g0, g1 = np.searchsorted(gt["keys"], [lo, hi])
+    d0, d1 = np.searchsorted(dt["keys"], [lo, hi])
+    keys = np.union1d(gt["keys"][g0:g1], dt["keys"][d0:d1])
+    gs, ge = np.searchsorted(gt["keys"], keys, "left"), np.searchsorted(gt["keys"], keys, "right")
+    ds, de = np.searchsorted(dt["keys"], keys, "left"), np.searchsorted(dt["keys"], keys, "right")
+
+    npig = np.zeros((len(keys), num_areas), dtype=np.int64)
+    pairs, ranks, scores, tps, fps = [], [], [], [], []
+    for p in range(len(keys)):
+        g = slice(gs[p], ge[p])
+        g_boxes, g_areas, g_crowd, g_ids = gt["boxes"][g], gt["areas"][g], gt["iscrowd"][g], gt["ids"][g]
+        order = ds[p] + np.argsort(-dt["scores"][ds[p] : de[p]], kind="mergesort")[:max_det]
+        d_boxes, d_areas = dt["boxes"][order], dt["areas"][order]
+        num_gt, num_dt = len(g_ids), len(order)
+        ious = _bbox_iou(d_boxes, g_boxes, g_crowd) if num_gt and num_dt else None
+
+        tp = np.zeros((num_areas, num_thrs, num_dt), dtype=bool)
+        fp = np.zeros((num_areas, num_thrs, num_dt), dtype=bool)
+        for a, (a_lo, a_hi) in enumerate(area_rngs):
+            g_ignore = g_crowd | (g_areas < a_lo) | (g_areas > a_hi)
+            npig[p, a] = num_gt - np.count_nonzero(g_ignore)
+            d_outside = (d_areas < a_lo) | (d_areas > a_hi)
+            if ious is None:
+                fp[a] = ~d_outside
+                continue
+            gtind = np.argsort(g_ignore, kind="mergesort")
+            m = _match(ious[:, gtind], g_ignore[gtind], g_crowd[gtind], thresholds)
+            matched = m >= 0
+            m = np.maximum(m, 0)
+            # evaluateImg stores GT ids: one matched to GT id 0 counts as unmatched
+            dt_match = np.where(matched, g_ids[gtind][m], 0)
+            dt_ignore = (matched & g_ignore[gtind][m]) | ((dt_match == 0) & d_outside)
+            tp[a] = (dt_match != 0) & ~dt_ignore
+            fp[a] = (dt_match == 0) & ~dt_ignore
+        pairs.append(np.full(num_dt, p, dtype=np.int64))
+        ranks.append(np.arange(num_dt))
+        scores.append(dt["scores"][order])
+        tps.append(tp)
+        fps.append(fp)
+
+    def cat(arrays, dtype, axis=0, shape=()):
+        return np.concatenate(arrays, axis=axis) if arrays else np.zeros(shape + (0,), dtype=dtype)
+
+    return {
+        "keys": keys,
+        "npig": npig,
+        "pair": cat(pairs, np.int64),
+        "rank": cat(ranks, np.int64),
+        "score": cat(scores, np.float64),
+        "tp": np.packbits(cat(tps, bool, 2, (num_areas, num_thrs)), axis=1, bitorder="little"),
+        "fp": np.packbits(cat(fps, bool, 2, (num_areas, num_thrs)), axis=1, bitorder="little"),
+    }
+
+
+class COCOevalNumpy(COCOeval):
+    """
+    A pure-NumPy version of the COCO API's bbox evaluation that gives the same
+    precision / recall / scores arrays as ``COCOeval`` (the matching, tie-breaking
+    and floating point operations are the same), but:
+
+    1. reads GT and detections as columnar arrays (see :func:`coco_box_arrays` and
+       :meth:`from_arrays`) instead of per-(image, category) lists of dicts;
+    2. computes the IoUs of all pairs of an image and category in bulk, and runs
+       the per image evaluation for all IoU thresholds at once, sharded over a
+       process pool by image;
+    3. accumulates with array operations instead of Python loops over detections.
+
+    Like ``COCOeval_opt``, it does not populate ``self.evalImgs`` and ``self.ious``.
+    Segmentation, keypoints and ``useCats=0`` are delegated to ``COCOeval``.
+    """
+
+    def __init__(self, cocoGt=None, cocoDt=None, iouType="segm", num_workers=None):
+        """
+        Args:
+            num_workers (int): processes of the pool; None for ``min(8, cpu_count)``,
+                0 or 1 to evaluate in this process.
+        """
+        super().__init__(cocoGt, cocoDt, iouType)
+        self.num_workers = min(8, os.cpu_count() or 1) if num_workers is None else num_workers
+        self.gt_arrays = None
+        self.dt_arrays = None
+        self._eval_arrays = None
+
+    @classmethod
+    def from_arrays(cls, cocoGt, dt_arrays, gt_arrays=None, num_workers=None):
+        """
+        Evaluate detections given as arrays, without building result dicts and
+        ``loadRes``.
+
+        Args:
+            cocoGt (COCO): ground truth; defines the image and category ids.
+            dt_arrays (dict): "image_ids", "category_ids", "boxes" (XYWH) and
+                "scores", optionally "ids" and "areas" (default to what ``loadRes``
+                assigns).
+            gt_arrays (dict): the GT in the format of :func:`coco_box_arrays`,
+                if already available as arrays; in the order of the annotations
+                of each image in the json.
+        """
+        evaluator = cls(cocoGt, None, iouType="bbox", num_workers=num_workers)
+        evaluator.dt_arrays = dt_arrays
+        evaluator.gt_arrays = gt_arrays
+        return evaluator
+
+    def _is_supported(self):
+        p = self.params
+        # add backward compatibility if useSegm is specified in params
+        if p.useSegm is not None:
+            p.iouType = "segm" if p.useSegm == 1 else "bbox"
+        return p.iouType == "bbox" and p.useCats
+
+    def evaluate(self):
+        """
+        Run per image evaluation and store the per detection results in
+        ``self._eval_arrays``, which is what accumulate() reads.
+        """
+        self._eval_arrays = None
+        if not self._is_supported():
+            return super().evaluate()
+        tic = time.time()
+        p = self.params
+        logger.info("Evaluate annotation type *{}*".format(p.iouType))
+        p.imgIds = list(np.unique(p.imgIds))
+        p.catIds = list(np.unique(p.catIds))
+        p.maxDets = sorted(p.maxDets)
+        self.params = p
+        self.eval = {}
+
+        img_ids = np.asarray(p.imgIds, dtype=np.int64)
+        cat_ids = np.asarray(p.catIds, dtype=np.int64)
+        gt = self.gt_arrays if self.gt_arrays is not None else coco_box_arrays(self.cocoGt)
+        dt = self.dt_arrays if self.dt_arrays is not None else coco_box_arrays(self.cocoDt)
+        params = {
+            "num_cats": len(cat_ids),
+            "thresholds": np.minimum(np.asarray(p.iouThrs, dtype=np.float64), 1 - 1e-10),
+            "area_rngs": [tuple(a) for a in p.areaRng],
+            "max_det": p.maxDets[-1],
+        }
+        state = (
+            _group(_complete_box_arrays(gt), img_ids, cat_ids),
+            _group(_complete_box_arrays(dt), img_ids, cat_ids),
+            params,
+        )
+
+        chunks = [(s, min(s + _CHUNK, len(img_ids))) for s in range(0, len(img_ids), _CHUNK)]
+        if self.num_workers > 1 and len(chunks) > 1 and "fork" in mp.get_all_start_methods():
+            global _STATE
+            _STATE = state
+            try:
+                with mp.get_context("fork").Pool(min(self.num_workers, len(chunks))) as pool:
+                    results = pool.map(_evaluate_chunk, chunks)
+            finally:
+                _STATE = None
+        else:
+            results = [_evaluate_chunk(c, state) for c in chunks]
+        self._eval_arrays = self._merge(results, len(cat_ids), len(p.areaRng), len(p.iouThrs))
+        self._paramsEval = copy.deepcopy(self.params)
+        toc = time.time()
+        logger.info("COCOevalNumpy.evaluate() finished in {:0.2f} seconds.".format(toc - tic))
+
+    @staticmethod
+    def _merge(results, num_cats, num_areas, num_thrs):
+        """
+        Concatenate the chunks and order detections by (category, image, rank),
+        the order in which accumulate() concatenates them.
+        """
+        keys = np.concatenate([r["keys"] for r in results]) if results else np.zeros(0, dtype=np.int64)
+        npig = (
+            np.concatenate([r["npig"] for r in results]) if results else np.zeros((0, num_areas), np.int64)
+        )
+        first_pair = np.cumsum([0] + [len(r["keys"]) for r in results])
+        pair = np.concatenate([r["pair"] + s for r, s in zip(results, first_pair)] + [np.zeros(0, np.int64)])
+        pair_cat = keys % max(num_cats, 1)
+        order = np.argsort(pair_cat[pair], kind="stable")
+        num_bytes = (num_thrs + 7) // 8
+        packed = {
+            k: np.concatenate([r[k] for r in results] + [np.zeros((num_areas, num_bytes, 0), np.uint8)], axis=2)
+            for k in ("tp", "fp")
+        }
+        return {
+            "pair_img": keys // max(num_cats, 1),
+            "pair_cat": pair_cat,
+            "npig": npig,
+            "det_pair": pair[order],
+            "det_rank": np.concatenate([r["rank"] for r in results] + [np.zeros(0, np.int64)])[order],
+            "det_score": np.concatenate([r["score"] for r in results] + [np.zeros(0)])[order],
+            "det_cat_offsets": np.searchsorted(pair_cat[pair][order], np.arange(num_cats + 1)),
+            "tp": packed["tp"][:, :, order],
+            "fp": packed["fp"][:, :, order],
+        }
+
+    def accumulate(self, p=None):
+        """
+        Accumulate per image evaluation results and store the result in self.eval,
+        with the same arrays as ``COCOeval.accumulate``.
+        """
+        if self._eval_arrays is None:
+            return super().accumulate(p)
+        logger.info("Accumulating evaluation results...")
+        tic = time.time()
+        if p is None:
+            p = self.params
+        _pe = self._paramsEval
+        T = len(p.iouThrs)
+        R = len(p.recThrs)
+        K = len(p.catIds)
+        A = len(p.areaRng)
+        M = len(p.maxDets)
+        precision = -np.ones((T, R, K, A, M))
+        recall = -np.ones((T, K, A, M))
+        scores = -np.ones((T, R, K, A, M))
+
+        # the subsets of the evaluated categories / areas / images / maxDets to accumulate
+        setK, setA, setM, setI = set(_pe.catIds), set(map(tuple, _pe.areaRng)), set(_pe.maxDets), set(_pe.imgIds)
+        k_list = [n for n, k in enumerate(p.catIds) if k in setK]
+        m_list = [m for n, m in enumerate(p.maxDets) if m in setM]
+        a_list = [n for n, a in enumerate(map(tuple, p.areaRng)) if a in setA]
+        i_list = [n for n, i in enumerate(p.imgIds) if i in setI]
+
+        ev = self._eval_arrays
+        img_ok = np.zeros(len(_pe.imgIds), dtype=bool)
+        img_ok[[i for i in i_list if i < len(img_ok)]] = True
+        pair_ok = img_ok[ev["pair_img"]]
+        det_ok = pair_ok[ev["det_pair"]]
+        offsets = ev["det_cat_offsets"]
+        rec_thrs = np.asarray(p.recThrs)
+
+        for k, k0 in enumerate(k_list):
+            sel = np.arange(offsets[k0], offsets[k0 + 1])
+            sel = sel[det_ok[sel]]
+            npig_k = ev["npig"][pair_ok & (ev["pair_cat"] == k0)].sum(axis=0)
+            rank, det_scores = ev["det_rank"][sel], ev["det_score"][sel]
+            for a, a0 in enumerate(a_list):
+                npig = npig_k[a0]
+                if npig == 0:
+                    continue
+                tp_a = np.unpackbits(ev["tp"][a0][:, sel], axis=0, count=T, bitorder="little").astype(bool)
+                fp_a = np.unpackbits(ev["fp"][a0][:, sel], axis=0, count=T, bitorder="little").astype(bool)
+                for m, max_det in enumerate(m_list):
+                    keep = rank < max_det
+                    dt_scores = det_scores[keep]
+                    inds = np.argsort(-dt_scores, kind="mergesort")
+                    dt_scores_sorted = dt_scores[inds]
+                    tp_sum = np.cumsum(tp_a[:, keep][:, inds], axis=1).astype(dtype=float)
+                    fp_sum = np.cumsum(fp_a[:, keep][:, inds], axis=1).astype(dtype=float)
+                    nd = tp_sum.shape[1]
+                    rc = tp_sum / npig
+                    pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+                    recall[:, k, a, m] = rc[:, -1] if nd else 0
+                    # make precision monotonically decreasing from the right
+                    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+                    for t in range(T):
+                        q = np.zeros(R)
+                        ss = np.zeros(R)
+                        inds_r = np.searchsorted(rc[t], rec_thrs, side="left")
+                        # recall thresholds beyond the reached recall keep precision 0
+                        valid = inds_r < nd
+                        q[valid] = pr[t, inds_r[valid]]
+                        ss[valid] = dt_scores_sorted[inds_r[valid]]
+                        precision[t, :, k, a, m] = q
+                        scores[t, :, k, a, m] = ss
+
+        self.eval = {
+            "params": p,
+            "counts": [T, R, K, A, M],
+            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "precision": precision,
+            "recall": recall,
+            "scores": scores,
+        }
+        toc = time.time()
+        logger.info("COCOevalNumpy.accumulate() finished in {:0.2f} seconds.".format(toc - tic))
+
+    def bootstrap(self, num_samples=200, seed=0):
+        """
+        Bootstrap the AP over images: the evaluated images are resampled with
+        replacement `num_samples` times and the per image results of evaluate() are
+        accumulated again for each resample, an image drawn k times counting k times.
+
+        Returns:
+            ndarray: (num_samples, T) AP at each of ``params.iouThrs`` per resample,
+            for the area range "all" and the largest maxDets, averaged over the
+            categories with GT in the resample (NaN if none has).
+        """
+        assert self._eval_arrays is not None, "bootstrap() needs evaluate() of bbox with useCats=1"
+        p = self._paramsEval
+        ev = self._eval_arrays
+        T = len(p.iouThrs)
+        a0 = p.areaRngLbl.index("all")
+        num_images = len(p.imgIds)
+        rec_thrs = np.asarray(p.recThrs)
+        det_img = ev["pair_img"][ev["det_pair"]]
+        tp = np.unpackbits(ev["tp"][a0], axis=0, count=T, bitorder="little")
+        fp = np.unpackbits(ev["fp"][a0], axis=0, count=T, bitorder="little")
+
+        # per category: images and flags of its detections by decreasing score, and its GT
+        categories = []
+        offsets = ev["det_cat_offsets"]
+        for k in range(len(p.catIds)):
+            sel = np.arange(offsets[k], offsets[k + 1])
+            sel = sel[np.argsort(-ev["det_score"][sel], kind="mergesort")]
+            pairs = ev["pair_cat"] == k
+            categories.append((det_img[sel], tp[:, sel], fp[:, sel], ev["pair_img"][pairs], ev["npig"][pairs, a0]))
+
+        rng = np.random.default_rng(seed)
+        aps = np.full((num_samples, T), np.nan)
+        for b in range(num_samples):
+            weights = np.bincount(rng.integers(0, num_images, num_images), minlength=num_images)
+            ap = []
+            for img, tp_k, fp_k, gt_img, npig_k in categories:
+                npig = np.dot(weights[gt_img], npig_k)
+                if npig == 0:
+                    continue
+                if len(img) == 0:
+                    ap.append(np.zeros(T))
+                    continue
+                # k copies of a detection give the same precision at each recall
+                # threshold as one detection of weight k
+                w = weights[img]
+                tp_sum = np.cumsum(tp_k * w, axis=1).astype(float)
+                fp_sum = np.cumsum(fp_k * w, axis=1).astype(float)
+                rc = tp_sum / npig
+                pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+                pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+                q = np.zeros((T, len(rec_thrs)))
+                for t in range(T):
+                    inds = np.searchsorted(rc[t], rec_thrs, side="left")
+                    valid = inds < rc.shape[1]
+                    q[t, valid] = pr[t, inds[valid]]
+                ap.append(q.mean(axis=1))
+            if ap:
+                aps[b] = np.mean(ap, axis=0)
+        return aps
@@ -3,6 +3,7 @@ import math
 import fvcore.nn.weight_init as weight_init
 import torch
 import torch.nn.functional as F
+import torch.utils.checkpoint as checkpoint
 from torch import nn
 
 from detectron2.layers import Conv2d, ShapeSpec, get_norm
@@ -31,6 +32,7 @@ class FPN(Backbone):
         top_block=None,
         fuse_type="sum",
         square_pad=0,
+        use_checkpoint=False,
     ):
         """
         Args:
@@ -55,6 +57,8 @@ class FPN(Backbone):
                 ones. It can be "sum" (default), which sums up element-wise; or "avg",
                 which takes the element-wise mean of the two.
             square_pad (int): If > 0, require input images to be padded to specific square size.
+            use_checkpoint (bool): if True, the top-down pathway is recomputed during
+                backward instead of keeping its activations in memory.
         """
         super(FPN, self).__init__()
         assert isinstance(bottom_up, Backbone)
@@ -114,6 +118,7 @@ class FPN(Backbone):
         self._square_pad = square_pad
         assert fuse_type in {"avg", "sum"}
         self._fuse_type = fuse_type
+        self._use_checkpoint = use_checkpoint
 
     @property
     def size_divisibility(self):
@@ -137,6 +142,24 @@ class FPN(Backbone):
                 ["p2", "p3", ..., "p6"].
         """
         bottom_up_features = self.bottom_up(x)
+        if self._use_checkpoint and self.training and torch.is_grad_enabled():
+            results = self._checkpoint_top_down(bottom_up_features)
+        else:
+            results = self._top_down(bottom_up_features)
+        assert len(self._out_features) == len(results)
+        return {f: res for f, res in zip(self._out_features, results)}
+
+    @torch.jit.unused
+    def _checkpoint_top_down(self, bottom_up_features):
+        return checkpoint.checkpoint(self._top_down, bottom_up_features, use_reentrant=False)
+
+    def _top_down(self, bottom_up_features):
+        """
+        Compute the FPN outputs (including the top block) from bottom-up features.
+
+        Returns:
+            list[Tensor]: FPN feature maps in the order of ``self._out_features``.
+        """
         results = []
         prev_features = self.lateral_convs[0](bottom_up_features[self.in_features[-1]])
         results.append(self.output_convs[0](prev_features))
@@ -163,8 +186,7 @@ class FPN(Backbone):
             else:
                 top_block_in_feature = results[self._out_features.index(self.top_block.in_feature)]
             results.extend(self.top_block(top_block_in_feature))
-        assert len(self._out_features) == len(results)
-        return {f: res for f, res in zip(self._out_features, results)}
+        return results
 
     def output_shape(self):
         return {
@@ -240,6 +262,7 @@ def build_resnet_fpn_backbone(cfg, input_shape: ShapeSpec):
         norm=cfg.MODEL.FPN.NORM,
         top_block=LastLevelMaxPool(),
         fuse_type=cfg.MODEL.FPN.FUSE_TYPE,
+        use_checkpoint=cfg.MODEL.FPN.USE_CHECKPOINT,
     )
     return backbone
 
@@ -3,6 +3,7 @@ import numpy as np
 import fvcore.nn.weight_init as weight_init
 import torch
 import torch.nn.functional as F
+import torch.utils.checkpoint as checkpoint
 from torch import nn
 
 from detectron2.layers import (
@@ -364,7 +365,9 @@ class ResNet(Backbone):
     Implement :paper:`ResNet`.
     """
 
-    def __init__(self, stem, stages, num_classes=None, out_features=None, freeze_at=0):
+    def __init__(
+        self, stem, stages, num_classes=None, out_features=None, freeze_at=0, checkpoint_stages=()
+    ):
         """
         Args:
             stem (nn.Module): a stem module
@@ -377,6 +380,8 @@ class ResNet(Backbone):
                 If None, will return the output of the last layer.
             freeze_at (int): The number of stages at the beginning to freeze.
                 see :meth:`freeze` for detailed explanation.
+            checkpoint_stages (list[str]): names of stages (e.g. "res2") whose activations
+                are recomputed during backward instead of being kept in memory.
         """
         super().__init__()
         self.stem = stem
@@ -430,6 +435,9 @@ class ResNet(Backbone):
         children = [x[0] for x in self.named_children()]
         for out_feature in self._out_features:
             assert out_feature in children, "Available children: {}".format(", ".join(children))
+        for name in checkpoint_stages:
+            assert name in self.stage_names, "Available stages: {}".format(", ".join(self.stage_names))
+        self._checkpoint_stages = tuple(checkpoint_stages)
         self.freeze(freeze_at)
 
     def forward(self, x):
@@ -446,7 +454,10 @@ class ResNet(Backbone):
         if "stem" in self._out_features:
             outputs["stem"] = x
         for name, stage in zip(self.stage_names, self.stages):
-            x = stage(x)
+            if name in self._checkpoint_stages and self.training and torch.is_grad_enabled():
+                x = self._checkpoint_stage(stage, x)
+            else:
+                x = stage(x)
             if name in self._out_features:
                 outputs[name] = x
         if self.num_classes is not None:
@@ -457,6 +468,10 @@ class ResNet(Backbone):
                 outputs["linear"] = x
         return outputs
 
+    @torch.jit.unused
+    def _checkpoint_stage(self, stage, x):
+        return checkpoint.checkpoint(stage, x, use_reentrant=False)
+
     def output_shape(self):
         return {
             name: ShapeSpec(
@@ -691,4 +706,10 @@ def build_resnet_backbone(cfg, input_shape):
         out_channels *= 2
         bottleneck_channels *= 2
         stages.append(blocks)
-    return ResNet(stem, stages, out_features=out_features, freeze_at=freeze_at)
+    return ResNet(
+        stem,
+        stages,
+        out_features=out_features,
+        freeze_at=freeze_at,
+        checkpoint_stages=cfg.MODEL.RESNETS.CHECKPOINT_STAGES,
+    )
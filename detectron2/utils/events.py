@@ -118,7 +118,9 @@ class JSONWriter(EventWriter):
         """
         self._file_handle = PathManager.open(json_file, "a")
         self._window_size = window_size
-        self._last_write = -1
+        # last written iteration of each scalar: scalars put later with an older
+        # iteration (e.g. by an asynchronous evaluation) are still written
+        self._last_write = {}
 
     def write(self):
         storage = get_event_storage()
@@ -126,12 +128,10 @@ class JSONWriter(EventWriter):
 
         for k, (v, iter) in storage.latest_with_smoothing_hint(self._window_size).items():
             # keep scalars that have not been written
-            if iter <= self._last_write:
+            if iter <= self._last_write.get(k, -1):
                 continue
             to_save[iter][k] = v
-        if len(to_save):
-            all_iters = sorted(to_save.keys())
-            self._last_write = max(all_iters)
+            self._last_write[k] = iter
 
         for itr, scalars_per_iter in to_save.items():
             scalars_per_iter["iteration"] = itr
@@ -161,7 +161,7 @@ class TensorboardXWriter(EventWriter):
         """
         self._window_size = window_size
         self._writer_args = {"log_dir": log_dir, **kwargs}
-        self._last_write = -1
+        self._last_write = {}  # per scalar, see JSONWriter
 
     @cached_property
     def _writer(self):
@@ -171,12 +171,10 @@ class TensorboardXWriter(EventWriter):
 
     def write(self):
         storage = get_event_storage()
-        new_last_write = self._last_write
         for k, (v, iter) in storage.latest_with_smoothing_hint(self._window_size).items():
-            if iter > self._last_write:
+            if iter > self._last_write.get(k, -1):
                 self._writer.add_scalar(k, v, iter)
-                new_last_write = max(new_last_write, iter)
-        self._last_write = new_last_write
+                self._last_write[k] = iter
 
         # storage.put_{image,histogram} is only meant to be used by
         # tensorboard writer. So we access its internal fields directly from here.
@@ -0,0 +1,98 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Batched tensor-space augmentation.
+
+With ``INPUT.BATCHED_AUGMENTATION`` the dataloader workers only decode images to
+uint8 tensors (and convert annotations to boxes in the original image), and the
+augmentations below run in the training process on the whole batch, on the
+model's device, right before preprocessing. A batch augmentation is a callable
+taking and returning a list of mapped dicts ("image" (C, H, W) tensor and
+optionally "instances" with "gt_boxes"); new ones (e.g. SAR speckle noise or gain
+jitter) can be appended to the list returned by :func:`build_batch_augmentations`.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from detectron2.data import transforms as T
+from detectron2.structures import Boxes, Instances
+
+__all__ = ["BatchResizeFlip", "build_batch_augmentations"]
+
+
+class BatchResizeFlip:
+    """
+    Batched equivalent of ``RandomFlip`` + ``ResizeShortestEdge`` (see
+    ``dataset_mapper.build_transform_gen``).
+
+    One short edge is sampled per batch (instead of per image). Images of the same
+    size are resized with a single ``F.interpolate`` call and flipped with a random
+    per-image mask; boxes are transformed as one (N, 4) tensor per such group.
+    """
+
+    def __init__(self, min_size, max_size, sample_style="choice", flip_prob=0.5):
+        assert sample_style in ("range", "choice"), sample_style
+        if isinstance(min_size, int):
+            min_size = (min_size, min_size)
+        if sample_style == "range":
+            assert len(min_size) == 2, "more than 2 ({}) min_size(s) are provided for ranges".format(len(min_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sample_style = sample_style
+        self.flip_prob = flip_prob
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(cfg.INPUT.MIN_SIZE_TRAIN, cfg.INPUT.MAX_SIZE_TRAIN, cfg.INPUT.MIN_SIZE_TRAIN_SAMPLING)
+
+    def _sample_short_edge(self):
+        if self.sample_style == "range":
+            return np.random.randint(self.min_size[0], self.min_size[1] + 1)
+        return np.random.choice(self.min_size)
+
+    def __call__(self, batched_inputs):
+        short_edge = self._sample_short_edge()
+        groups = {}
+        for i, x in enumerate(batched_inputs):
+            groups.setdefault(tuple(x["image"].shape[-2:]), []).append(i)
+
+        ret = [dict(x) for x in batched_inputs]
+        for (h, w), idxs in groups.items():
+            new_h, new_w = T.ResizeShortestEdge.get_output_shape(h, w, short_edge, self.max_size)
+            images = torch.stack([batched_inputs[i]["image"] for i in idxs]).float()
+            if (new_h, new_w) != (h, w):
+                images = F.interpolate(images, size=(new_h, new_w), mode="bilinear", align_corners=False)
+            flip = torch.rand(len(idxs), device=images.device) < self.flip_prob
+            images = torch.where(flip[:, None, None, None], images.flip(-1), images)
+            for j, i in enumerate(idxs):
+                ret[i]["image"] = images[j]
+
+            instances = [batched_inputs[i].get("instances") for i in idxs]
+            if any(x is None for x in instances):
+                continue
+            lengths = [len(x) for x in instances]
+            boxes = torch.cat([x.gt_boxes.tensor for x in instances]).to(images.device)
+            boxes = boxes * boxes.new_tensor([new_w / w, new_h / h, new_w / w, new_h / h])
+            box_flip = flip.repeat_interleave(torch.as_tensor(lengths, device=images.device))
+            flipped = torch.stack([new_w - boxes[:, 2], boxes[:, 1], new_w - boxes[:, 0], boxes[:, 3]], dim=1)
+            boxes = torch.where(box_flip[:, None], flipped, boxes)
+            # boxes were clipped and filtered in the original image by the mapper; scaling
+            # by a positive factor keeps them inside and non-empty
+            for i, x, b in zip(idxs, instances, boxes.split(lengths)):
+                out = Instances((new_h, new_w))
+                for k, v in x.get_fields().items():
+                    out.set(k, v)
+                out.gt_boxes = Boxes(b)
+                ret[i]["instances"] = out
+        return ret
+
+
+def build_batch_augmentations(cfg):
+    """
+    Returns:
+        list[callable]: batch augmentations applied in order during training, or an
+        empty list if ``INPUT.BATCHED_AUGMENTATION`` is off.
+    """
+    if not cfg.INPUT.BATCHED_AUGMENTATION:
+        return []
+    return [BatchResizeFlip.from_config(cfg)]
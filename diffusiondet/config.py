@@ -32,6 +32,10 @@ def add_diffusiondet_config(cfg):
     cfg.MODEL.DiffusionDet.NUM_DYNAMIC = 2
     cfg.MODEL.DiffusionDet.DIM_DYNAMIC = 64
 
+    # Activation checkpointing: indices into the head cascade (0 .. NUM_HEADS - 1)
+    # whose activations are recomputed during backward. E.g. [0, 1, 2, 3, 4, 5].
+    cfg.MODEL.DiffusionDet.CHECKPOINT_HEADS = []
+
     # Loss.
     cfg.MODEL.DiffusionDet.CLASS_WEIGHT = 2.0
     cfg.MODEL.DiffusionDet.GIOU_WEIGHT = 2.0
@@ -55,6 +59,54 @@ def add_diffusiondet_config(cfg):
 
     # Inference
     cfg.MODEL.DiffusionDet.USE_NMS = True
+    # With TEST.IMS_PER_BATCH > 1, run the DDIM steps on the whole batch: box renewal then
+    # replaces the dropped boxes of each image in place instead of filtering them out, which
+    # draws different random boxes than IMS_PER_BATCH 1. Otherwise only the backbone is
+    # batched and each image is sampled on its own.
+    cfg.MODEL.DiffusionDet.BATCHED_SAMPLING = False
+    # Time every inference stage (backbone, CPDC, each DDIM step split by head stage, renewal,
+    # NMS, ...) and report p50/p95/p99 after evaluation, see diffusiondet/latency.py.
+    # Synchronizes the GPU around every stage, so total inference time goes up.
+    cfg.MODEL.DiffusionDet.PROFILE_LATENCY = False
+
+    # torch.compile: the head is many small ops that benefit from fusion.
+    # With MODEL.COMPILE.ENABLED, DDIM box renewal keeps NUM_PROPOSALS boxes (static shapes).
+    cfg.MODEL.COMPILE.MODULES = ["backbone", "head", "criterion"]
+
+    # Frozen-backbone feature cache (head-only fine-tuning), see diffusiondet/feature_cache.py
+    cfg.FEATURE_CACHE = CN()
+    cfg.FEATURE_CACHE.ENABLED = False
+    cfg.FEATURE_CACHE.DIR = ""
+    # Cached short-edge sizes; empty means INPUT.MIN_SIZE_TRAIN
+    cfg.FEATURE_CACHE.SCALES = ()
+    # Also cache the horizontally flipped variant of every scale
+    cfg.FEATURE_CACHE.FLIP = True
+    cfg.FEATURE_CACHE.SHARD_SIZE_MB = 4096
+
+    # Read images from the packed store registered for a dataset (see diffusiondet/image_store.py)
+    # instead of decoding the image files; datasets without a store always read files.
+    cfg.INPUT.IMAGE_STORE = True
+
+    # Dataloader workers only decode images; RandomFlip + ResizeShortestEdge then run on whole
+    # batches on the model's device (see diffusiondet/batch_augmentation.py). One scale is
+    # sampled per batch. Not compatible with INPUT.CROP.
+    cfg.INPUT.BATCHED_AUGMENTATION = False
+
+    # Keep the training records in flat columnar arrays (detectron2.data.common.ColumnarDetectionList)
+    # instead of one pickle per record: less RAM and no unpickling per sample. Drops annotation
+    # fields other than boxes and classes (e.g. segmentation).
+    cfg.DATALOADER.COLUMNAR_RECORDS = False
+
+    # Fixed uint8 scaling of non-8-bit (16-bit / float) SAR images, see diffusiondet/sar_scaling.py.
+    # Without it such images are min-max normalized per image.
+    cfg.INPUT.SAR_SCALING = CN()
+    cfg.INPUT.SAR_SCALING.ENABLED = False
+    # "db": clip 20*log10(amplitude) to RANGE; "linear": clip the stored values to RANGE
+    cfg.INPUT.SAR_SCALING.MODE = "db"
+    # Pixels are power instead of amplitude (10*log10 in "db" mode)
+    cfg.INPUT.SAR_SCALING.POWER = False
+    # (low, high) mapped to (0, 255); calibrate with tools/calibrate_sar_scaling.py
+    cfg.INPUT.SAR_SCALING.RANGE = ()
 
     # Swin Backbones
     cfg.MODEL.SWIN = CN()
@@ -65,6 +117,9 @@ def add_diffusiondet_config(cfg):
     # Optimizer.
     cfg.SOLVER.OPTIMIZER = "ADAMW"
     cfg.SOLVER.BACKBONE_MULTIPLIER = 1.0
+    # Batches accumulated per optimizer step; the effective batch size is
+    # IMS_PER_BATCH * ACCUMULATION_STEPS and one iteration is one optimizer step.
+    cfg.SOLVER.ACCUMULATION_STEPS = 1
 
     # TTA.
     # cfg.TEST.AUG.MIN_SIZES = (224,)
@@ -5,16 +5,19 @@
 # Contact: {sunpeize, cxrfzhang}@foxmail.com
 #
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
-import copy
 import logging
 import numpy as np
 import torch
 
 from detectron2.data import detection_utils as utils
 from detectron2.data import transforms as T
+from detectron2.structures import Boxes, BoxMode, Instances
 
+from .image_store import image_stores_for_datasets
+from .sar_scaling import SARIntensityScaling
 
-__all__ = ["DiffusionDetDatasetMapper"]
+
+__all__ = ["DiffusionDetDatasetMapper", "annotations_to_arrays", "transform_annotations_to_instances"]
 
 
 def build_transform_gen(cfg, is_train):
@@ -46,6 +49,51 @@ def build_transform_gen(cfg, is_train):
     return tfm_gens
 
 
+def annotations_to_arrays(annotations):
+    """
+    Collect the non-crowd boxes and classes of a record's annotations.
+
+    Returns:
+        boxes (ndarray): (N, 4) float64 boxes in XYXY_ABS.
+        classes (ndarray): (N,) int64 category ids.
+    """
+    annos = [obj for obj in annotations if obj.get("iscrowd", 0) == 0]
+    boxes = np.array([obj["bbox"] for obj in annos], dtype=np.float64).reshape(-1, 4)
+    classes = np.array([obj["category_id"] for obj in annos], dtype=np.int64)
+    modes = {obj["bbox_mode"] for obj in annos}
+    if modes == {BoxMode.XYWH_ABS}:
+        boxes[:, 2:] += boxes[:, :2]
+    elif len(modes) == 1:
+        boxes = BoxMode.convert(boxes, modes.pop(), BoxMode.XYXY_ABS)
+    elif modes:
+        for i, obj in enumerate(annos):
+            boxes[i] = BoxMode.convert(list(boxes[i]), obj["bbox_mode"], BoxMode.XYXY_ABS)
+    return boxes, classes
+
+
+def transform_annotations_to_instances(boxes, classes, transforms, image_shape):
+    """
+    Vectorized equivalent of ``transform_instance_annotations`` +
+    ``annotations_to_instances`` + ``filter_empty_instances`` for boxes only.
+
+    Args:
+        boxes (ndarray): (N, 4) XYXY_ABS boxes; not modified.
+        classes (ndarray): (N,) category ids.
+        transforms (TransformList): transforms applied to the image.
+        image_shape (tuple): (h, w) of the transformed image.
+
+    Returns:
+        Instances: with "gt_boxes" clipped to the image and "gt_classes", without empty boxes.
+    """
+    h, w = image_shape
+    boxes = transforms.apply_box(boxes).clip(min=0)
+    np.minimum(boxes, [w, h, w, h], out=boxes)
+    instances = Instances(image_shape)
+    instances.gt_boxes = Boxes(torch.as_tensor(boxes, dtype=torch.float32))
+    instances.gt_classes = torch.as_tensor(classes, dtype=torch.int64)
+    return utils.filter_empty_instances(instances)
+
+
 class DiffusionDetDatasetMapper:
     """
     A callable which takes a dataset dict in Detectron2 Dataset format,
@@ -53,8 +101,10 @@ class DiffusionDetDatasetMapper:
 
     The callable currently does the following:
 
-    1. Read the image from "file_name"
-    2. Applies geometric transforms to the image and annotation
+    1. Read the image from "file_name", or from the packed image store of the
+       dataset if one is registered (see :mod:`diffusiondet.image_store`)
+    2. Applies geometric transforms to the image and annotation, unless
+       ``INPUT.BATCHED_AUGMENTATION`` defers them to the model
     3. Find and applies suitable cropping to the image and annotation
     4. Prepare image and annotation to Tensors
     """
@@ -79,6 +129,24 @@ class DiffusionDetDatasetMapper:
 
         self.img_format = cfg.INPUT.FORMAT
         self.is_train = is_train
+        # resize / flip run batched in the model (see diffusiondet/batch_augmentation.py)
+        self.decode_only = is_train and cfg.INPUT.BATCHED_AUGMENTATION
+        if self.decode_only and self.crop_gen is not None:
+            raise ValueError("INPUT.BATCHED_AUGMENTATION does not support INPUT.CROP")
+
+        scaling = SARIntensityScaling.from_config(cfg)
+        self.image_reader = utils.ImageReader(self.img_format, scaling)
+        self.image_stores = []
+        if cfg.INPUT.IMAGE_STORE:
+            datasets = cfg.DATASETS.TRAIN if is_train else cfg.DATASETS.TEST
+            self.image_stores = image_stores_for_datasets(datasets, self.img_format, scaling)
+
+    def _read_image(self, file_name):
+        for store in self.image_stores:
+            if file_name in store:
+                # zero-copy view into the store; the transforms below never write in place
+                return store.read(file_name)
+        return self.image_reader(file_name)
 
     def __call__(self, dataset_dict):
         """
@@ -89,15 +157,18 @@ class DiffusionDetDatasetMapper:
         Returns:
             dict: a format that builtin models in detectron2 accept
         """
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        # the record is treated as read-only: no deep copy, only the output dict is new
+        ret = {k: v for k, v in dataset_dict.items() if k != "annotations"}
 
         # 读取图片，并进行检测
-        image = utils.read_image(dataset_dict["file_name"], format=self.img_format)
+        image = self._read_image(dataset_dict["file_name"])
         utils.check_image_size(dataset_dict, image)
 
 
         # 如果图像没有检测的对象，则随机进行剪裁，同时进行多尺度的图像变换
-        if self.crop_gen is None:
+        if self.decode_only:
+            transforms = T.TransformList([])
+        elif self.crop_gen is None:
             image, transforms = T.apply_transform_gens(self.tfm_gens, image)
         else:
             if np.random.rand() > 0.5:
@@ -114,26 +185,21 @@ class DiffusionDetDatasetMapper:
         # Pytorch's dataloader is efficient on torch.Tensor due to shared-memory,
         # but not efficient on large generic data structures due to the use of pickle & mp.Queue.
         # Therefore it's important to use torch.Tensor.
-        dataset_dict["image"] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        image = image.transpose(2, 0, 1)
+        if image.flags.writeable:
+            image = np.ascontiguousarray(image)
+        else:
+            # a view into an image store (e.g. a single-channel image left untransformed):
+            # transposing it does not copy, and the tensor must not wrap read-only memory
+            image = np.array(image, copy=True)
+        ret["image"] = torch.as_tensor(image)
 
         if not self.is_train:
-            # USER: Modify this if you want to keep them for some reason.
-            dataset_dict.pop("annotations", None)
-            return dataset_dict
+            return ret
 
         if "annotations" in dataset_dict:
-            # USER: Modify this if you want to keep them for some reason.
-            for anno in dataset_dict["annotations"]:
-                anno.pop("segmentation", None)
-                anno.pop("keypoints", None)
-
             # USER: Implement additional transformations if you have other types of data
-            # 实例分割的相关操作
-            annos = [
-                utils.transform_instance_annotations(obj, transforms, image_shape)
-                for obj in dataset_dict.pop("annotations")
-                if obj.get("iscrowd", 0) == 0
-            ]
-            instances = utils.annotations_to_instances(annos, image_shape)
-            dataset_dict["instances"] = utils.filter_empty_instances(instances)
-        return dataset_dict
+            # 只使用检测框和类别（分割和关键点被忽略）
+            boxes, classes = annotations_to_arrays(dataset_dict["annotations"])
+            ret["instances"] = transform_annotations_to_instances(boxes, classes, transforms, image_shape)
+        return ret
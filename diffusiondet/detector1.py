@@ -18,9 +18,12 @@ from detectron2.layers import batched_nms
 from detectron2.modeling import META_ARCH_REGISTRY, build_backbone, detector_postprocess
 
 from detectron2.structures import Boxes, ImageList, Instances
+from detectron2.utils.events import get_event_storage
 
+from .batch_augmentation import build_batch_augmentations
 from .loss import SetCriterionDynamicK, HungarianMatcherDynamicK
 from .head import DynamicHead
+from .latency import LatencyProfiler
 from .util.box_ops import box_cxcywh_to_xyxy, box_xyxy_to_cxcywh
 from .util.misc import nested_tensor_from_tensor_list
 
@@ -104,6 +107,10 @@ class DiffusionDet(nn.Module):
         self.scale = cfg.MODEL.DiffusionDet.SNR_SCALE
         self.box_renewal = True
         self.use_ensemble = True
+        # replace dropped boxes in place instead of filter + concat, so that every DDIM step
+        # sees NUM_PROPOSALS boxes and a compiled head does not recompile per step
+        self.static_shape_sampling = cfg.MODEL.COMPILE.ENABLED
+        self.batched_sampling = cfg.MODEL.DiffusionDet.BATCHED_SAMPLING
 
         self.register_buffer('betas', betas)
         self.register_buffer('alphas_cumprod', alphas_cumprod)
@@ -153,7 +160,18 @@ class DiffusionDet(nn.Module):
         # self.diff_conv6 = Conv2d(CPDC, channels_p6, channels_p6, kernel_size=3, stride=1, padding=1, dilation=1, groups=1,bias=False)
 
 
-        self.head = DynamicHead(cfg=cfg, roi_input_shape=self.backbone.output_shape())
+        # Per-stage inference latency (MODEL.DiffusionDet.PROFILE_LATENCY), see diffusiondet/latency.py
+        self.latency = LatencyProfiler(enabled=cfg.MODEL.DiffusionDet.PROFILE_LATENCY, device=self.device)
+        self.head = DynamicHead(cfg=cfg, roi_input_shape=self.backbone.output_shape(), latency=self.latency)
+        # submodules that :meth:`extract_features` runs
+        self.feature_modules = ("backbone", "diff_conv5")
+
+        # training-time augmentations applied to whole batches (INPUT.BATCHED_AUGMENTATION)
+        self.batch_augmentations = build_batch_augmentations(cfg)
+        if cfg.FEATURE_CACHE.ENABLED:
+            # P2-P5 come from the feature cache, so only the DynamicHead is trained.
+            self.backbone.requires_grad_(False)
+            self.diff_conv5.requires_grad_(False)
         # Loss parameters:
         class_weight = cfg.MODEL.DiffusionDet.CLASS_WEIGHT
         giou_weight = cfg.MODEL.DiffusionDet.GIOU_WEIGHT
@@ -215,6 +233,19 @@ class DiffusionDet(nn.Module):
     @torch.no_grad()
     def ddim_sample(self, batched_inputs, backbone_feats, images_whwh, images, clip_denoised=True, do_postprocess=True):
         batch = images_whwh.shape[0]
+        if batch > 1 and not (self.batched_sampling or self.static_shape_sampling):
+            # sample image by image, with the same box renewal as TEST.IMS_PER_BATCH 1
+            processed_results = [
+                self.ddim_sample(
+                    batched_inputs[i:i + 1], [f[i:i + 1] for f in backbone_feats], images_whwh[i:i + 1],
+                    ImageList(images.tensor[i:i + 1], images.image_sizes[i:i + 1]),
+                    clip_denoised=clip_denoised, do_postprocess=do_postprocess,
+                )
+                for i in range(batch)
+            ]
+            if do_postprocess:
+                return [r for results_per_image in processed_results for r in results_per_image]
+            return
         shape = (batch, self.num_proposals, 4)
         # eta 衰减因子
         total_timesteps, sampling_timesteps, eta, objective = self.num_timesteps, self.sampling_timesteps, self.ddim_sampling_eta, self.objective
@@ -226,10 +257,13 @@ class DiffusionDet(nn.Module):
 
         img = torch.randn(shape, device=self.device)
 
-        # 预测的分数，类别和框坐标
-        ensemble_score, ensemble_label, ensemble_coord = [], [], []
+        # 预测的分数，类别和框坐标 (per image)
+        ensemble = [[] for _ in range(batch)]
+        # boxes can only be filtered out when the batch holds a single image; with
+        # BATCHED_SAMPLING dropped boxes are replaced in place
+        static_shape = self.static_shape_sampling or batch > 1
         x_start = None
-        for time, time_next in time_pairs:
+        for time, time_next in self.latency.frames("ddim_step", time_pairs):
             time_cond = torch.full((batch,), time, device=self.device, dtype=torch.long)
             self_cond = x_start if self.self_condition else None
 
@@ -238,18 +272,21 @@ class DiffusionDet(nn.Module):
             pred_noise, x_start = preds.pred_noise, preds.pred_x_start
 
             if self.box_renewal:  # filter 冗余无用的框删除，添加随机的框
-                score_per_image, box_per_image = outputs_class[-1][0], outputs_coord[-1][0]
-                threshold = 0.5
-                score_per_image = torch.sigmoid(score_per_image)
-                #选取置信度最大的
-                value, _ = torch.max(score_per_image, -1, keepdim=False)
-                # 和阈值比较，得到布尔列表，求和，一共有多少超过阈值的
-                keep_idx = value > threshold
-                num_remain = torch.sum(keep_idx)
-
-                pred_noise = pred_noise[:, keep_idx, :]
-                x_start = x_start[:, keep_idx, :]
-                img = img[:, keep_idx, :]
+                with self.latency.section("renewal"):
+                    threshold = 0.5
+                    scores = torch.sigmoid(outputs_class[-1])
+                    #选取置信度最大的
+                    value, _ = torch.max(scores, -1, keepdim=False)
+                    # 和阈值比较，得到布尔列表 (batch, num_proposals)
+                    keep_idx = value > threshold
+
+                    if not static_shape:
+                        keep_idx = keep_idx[0]
+                        # 求和，一共有多少超过阈值的
+                        num_remain = torch.sum(keep_idx)
+                        pred_noise = pred_noise[:, keep_idx, :]
+                        x_start = x_start[:, keep_idx, :]
+                        img = img[:, keep_idx, :]
             if time_next < 0:
                 img = x_start
                 continue
@@ -267,45 +304,52 @@ class DiffusionDet(nn.Module):
                   sigma * noise
 
             if self.box_renewal:  # filter
-                # replenish with randn boxes
-                img = torch.cat((img, torch.randn(1, self.num_proposals - num_remain, 4, device=img.device)), dim=1)
+                with self.latency.section("renewal"):
+                    # replenish with randn boxes
+                    if static_shape:
+                        img = torch.where(keep_idx[:, :, None], img, torch.randn_like(img))
+                    else:
+                        img = torch.cat((img, torch.randn(1, self.num_proposals - num_remain, 4, device=img.device)), dim=1)
             if self.use_ensemble and self.sampling_timesteps > 1:
-                box_pred_per_image, scores_per_image, labels_per_image = self.inference(outputs_class[-1],
-                                                                                        outputs_coord[-1],
-                                                                                        images.image_sizes)
-                ensemble_score.append(scores_per_image)
-                ensemble_label.append(labels_per_image)
-                ensemble_coord.append(box_pred_per_image)
+                with self.latency.section("ensemble_topk"):
+                    preds_per_step = self.inference(outputs_class[-1], outputs_coord[-1], images.image_sizes)
+                    for preds_per_image, step_preds in zip(ensemble, preds_per_step):
+                        preds_per_image.append(step_preds)
 
         if self.use_ensemble and self.sampling_timesteps > 1:
-            box_pred_per_image = torch.cat(ensemble_coord, dim=0)
-            scores_per_image = torch.cat(ensemble_score, dim=0)
-            labels_per_image = torch.cat(ensemble_label, dim=0)
-            if self.use_nms:
-                keep = batched_nms(box_pred_per_image, scores_per_image, labels_per_image, 0.5)
-                box_pred_per_image = box_pred_per_image[keep]
-                scores_per_image = scores_per_image[keep]
-                labels_per_image = labels_per_image[keep]
-
-            result = Instances(images.image_sizes[0])
-            result.pred_boxes = Boxes(box_pred_per_image)
-            result.scores = scores_per_image
-            result.pred_classes = labels_per_image
-            results = [result]
+            with self.latency.section("ensemble_nms"):
+                results = []
+                for preds_per_image, image_size in zip(ensemble, images.image_sizes):
+                    box_pred_per_image, scores_per_image, labels_per_image = (
+                        torch.cat(x, dim=0) for x in zip(*preds_per_image)
+                    )
+                    if self.use_nms:
+                        keep = batched_nms(box_pred_per_image, scores_per_image, labels_per_image, 0.5)
+                        box_pred_per_image = box_pred_per_image[keep]
+                        scores_per_image = scores_per_image[keep]
+                        labels_per_image = labels_per_image[keep]
+
+                    result = Instances(image_size)
+                    result.pred_boxes = Boxes(box_pred_per_image)
+                    result.scores = scores_per_image
+                    result.pred_classes = labels_per_image
+                    results.append(result)
         else:
-            output = {'pred_logits': outputs_class[-1], 'pred_boxes': outputs_coord[-1]}
-            box_cls = output["pred_logits"]
-            box_pred = output["pred_boxes"]
-            results = self.inference(box_cls, box_pred, images.image_sizes)
+            with self.latency.section("nms"):
+                output = {'pred_logits': outputs_class[-1], 'pred_boxes': outputs_coord[-1]}
+                box_cls = output["pred_logits"]
+                box_pred = output["pred_boxes"]
+                results = self.inference(box_cls, box_pred, images.image_sizes)
         if do_postprocess:
-            processed_results = []
-
-            # 得到图像的高宽信息和检测结果
-            for results_per_image, input_per_image, image_size in zip(results, batched_inputs, images.image_sizes):
-                height = input_per_image.get("height", image_size[0])
-                width = input_per_image.get("width", image_size[1])
-                r = detector_postprocess(results_per_image, height, width)
-                processed_results.append({"instances": r})
+            with self.latency.section("postprocess"):
+                processed_results = []
+
+                # 得到图像的高宽信息和检测结果
+                for results_per_image, input_per_image, image_size in zip(results, batched_inputs, images.image_sizes):
+                    height = input_per_image.get("height", image_size[0])
+                    width = input_per_image.get("width", image_size[1])
+                    r = detector_postprocess(results_per_image, height, width)
+                    processed_results.append({"instances": r})
             return processed_results
 
     # forward diffusion
@@ -336,13 +380,76 @@ class DiffusionDet(nn.Module):
                 * "height", "width" (int): the output resolution of the model, used in inference.
                   See :meth:`postprocess` for details.
         """
-        images, images_whwh = self.preprocess_image(batched_inputs)
-        if isinstance(images, (list, torch.Tensor)):
-            images = nested_tensor_from_tensor_list(images)
+        if not self.training:
+            assert "features" not in batched_inputs[0], "Cached features are only supported for training."
+            with self.latency.frame("total"):
+                images, images_whwh, features = self.inference_features(batched_inputs)
+                return self.ddim_sample(batched_inputs, features, images_whwh, images)
+
+        if "features" in batched_inputs[0]:
+            # Precomputed P2-P5 features from a FeatureCache: backbone and CPDC are skipped.
+            assert self.training, "Cached features are only supported for training."
+            features, images_whwh = self.preprocess_cached_features(batched_inputs)
+        else:
+            if self.training:
+                for augmentation in self.batch_augmentations:
+                    batched_inputs = augmentation(batched_inputs)
+            images, images_whwh = self.preprocess_image(batched_inputs)
+            if isinstance(images, (list, torch.Tensor)):
+                images = nested_tensor_from_tensor_list(images)
+
+            # Feature Extraction.
+            features = self.extract_features(images.tensor)
+
+        if self.training:
+            gt_instances = [x["instances"].to(self.device) for x in batched_inputs]
+            targets, x_boxes, noises, t = self.prepare_targets(gt_instances)
+            t = t.squeeze(-1)
+            x_boxes = x_boxes * images_whwh[:, None, :]
+            # 输出类别和坐标
+            outputs_class, outputs_coord = self.head(features, x_boxes, t, None)
+            output = {'pred_logits': outputs_class[-1], 'pred_boxes': outputs_coord[-1]}
+
+            if self.deep_supervision:
+                output['aux_outputs'] = [{'pred_logits': a, 'pred_boxes': b}
+                                         for a, b in zip(outputs_class[:-1], outputs_coord[:-1])]
 
-        # Feature Extraction.
+            loss_dict = self.criterion(output, targets)
+            weight_dict = self.criterion.weight_dict
+            for k in loss_dict.keys():
+                if k in weight_dict:
+                    loss_dict[k] *= weight_dict[k]
+            return loss_dict
+
+    def inference_features(self, batched_inputs):
+        """
+        Preprocess a test batch and extract its features: the inputs of :meth:`ddim_sample`
+        other than `batched_inputs`. They only depend on the weights of :attr:`feature_modules`.
+
+        Returns:
+            ImageList, Tensor, list[Tensor]: the images, their (N, 4) sizes in (w, h, w, h)
+            order and the feature maps of :meth:`extract_features`.
+        """
+        with self.latency.section("preprocess"):
+            images, images_whwh = self.preprocess_image(batched_inputs)
+            if isinstance(images, (list, torch.Tensor)):
+                images = nested_tensor_from_tensor_list(images)
+        features = self.extract_features(images.tensor)
+        return images, images_whwh, features
+
+    def extract_features(self, images):
+        """
+        Run the backbone and the CPDC refinement on a padded image batch.
+
+        Args:
+            images (Tensor): normalized, padded images of shape (N, C, H, W).
+
+        Returns:
+            list[Tensor]: feature maps of ``self.in_features`` (P2-P5).
+        """
         # ROI HEADS : in features
-        src = self.backbone(images.tensor)
+        with self.latency.section("backbone"):
+            src = self.backbone(images)
         features = list()
         feature_p2 = src[self.in_features[0]]
         features.append(feature_p2)
@@ -353,7 +460,8 @@ class DiffusionDet(nn.Module):
         features.append(feature_p4)
         feature_p5 = src[self.in_features[3]]
         # features.append(self.diff_conv4(feature_p4))
-        features.append(self.diff_conv5(feature_p5) + feature_p5)
+        with self.latency.section("cpdc"):
+            features.append(self.diff_conv5(feature_p5) + feature_p5)
         # for f in self.in_features[4:]:
         #     feature = src[f]
         #     features.append(feature)
@@ -381,30 +489,7 @@ class DiffusionDet(nn.Module):
         #     feature = src[f]
         #     features.append(feature)
 
-        # Prepare Proposals.
-        if not self.training:
-            results = self.ddim_sample(batched_inputs, features, images_whwh, images)
-            return results
-
-        if self.training:
-            gt_instances = [x["instances"].to(self.device) for x in batched_inputs]
-            targets, x_boxes, noises, t = self.prepare_targets(gt_instances)
-            t = t.squeeze(-1)
-            x_boxes = x_boxes * images_whwh[:, None, :]
-            # 输出类别和坐标
-            outputs_class, outputs_coord = self.head(features, x_boxes, t, None)
-            output = {'pred_logits': outputs_class[-1], 'pred_boxes': outputs_coord[-1]}
-
-            if self.deep_supervision:
-                output['aux_outputs'] = [{'pred_logits': a, 'pred_boxes': b}
-                                         for a, b in zip(outputs_class[:-1], outputs_coord[:-1])]
-
-            loss_dict = self.criterion(output, targets)
-            weight_dict = self.criterion.weight_dict
-            for k in loss_dict.keys():
-                if k in weight_dict:
-                    loss_dict[k] *= weight_dict[k]
-            return loss_dict
+        return features
 
     def prepare_diffusion_repeat(self, gt_boxes):
         """
@@ -517,7 +602,8 @@ class DiffusionDet(nn.Module):
             image_sizes (List[torch.Size]): the input image sizes
 
         Returns:
-            results (List[Instances]): a list of #images elements.
+            results (List[Instances]): a list of #images elements. When ensembling the
+                DDIM steps, a list of #images (boxes, scores, labels) tuples before NMS instead.
         """
         assert len(box_cls) == len(image_sizes)
         results = []
@@ -537,7 +623,8 @@ class DiffusionDet(nn.Module):
                 box_pred_per_image = box_pred_per_image[topk_indices]
 
                 if self.use_ensemble and self.sampling_timesteps > 1:
-                    return box_pred_per_image, scores_per_image, labels_per_image
+                    results.append((box_pred_per_image, scores_per_image, labels_per_image))
+                    continue
 
                 if self.use_nms:
                     keep = batched_nms(box_pred_per_image, scores_per_image, labels_per_image, 0.5)
@@ -558,7 +645,8 @@ class DiffusionDet(nn.Module):
                     scores, labels, box_pred, image_sizes
             )):
                 if self.use_ensemble and self.sampling_timesteps > 1:
-                    return box_pred_per_image, scores_per_image, labels_per_image
+                    results.append((box_pred_per_image, scores_per_image, labels_per_image))
+                    continue
 
                 if self.use_nms:
                     keep = batched_nms(box_pred_per_image, scores_per_image, labels_per_image, 0.5)
@@ -579,6 +667,8 @@ class DiffusionDet(nn.Module):
         """
         images = [self.normalizer(x["image"].to(self.device)) for x in batched_inputs]
         images = ImageList.from_tensors(images, self.size_divisibility)
+        if self.training:
+            self._log_padding_fraction(images)
 
         images_whwh = list()
         for bi in batched_inputs:
@@ -587,3 +677,44 @@ class DiffusionDet(nn.Module):
         images_whwh = torch.stack(images_whwh)
 
         return images, images_whwh
+
+    @staticmethod
+    def _log_padding_fraction(images):
+        """
+        Record the fraction of the padded batch that is padding (see DATALOADER.SIZE_BUCKET_GRANULARITY).
+        """
+        try:
+            storage = get_event_storage()
+        except AssertionError:  # called outside of a trainer, e.g. by a benchmark
+            return
+        n, _, h, w = images.tensor.shape
+        valid = sum(int(ih) * int(iw) for ih, iw in images.image_sizes)
+        storage.put_scalar("data/padding_fraction", 1.0 - valid / float(n * h * w))
+
+    def preprocess_cached_features(self, batched_inputs):
+        """
+        Pad and batch per-image cached features, mirroring what :meth:`preprocess_image`
+        and :meth:`extract_features` produce for images.
+
+        Returns:
+            list[Tensor]: one (N, C, H, W) tensor per feature level.
+            Tensor: (N, 4) image sizes in (w, h, w, h) order.
+        """
+        features = []
+        for level in range(len(batched_inputs[0]["features"])):
+            maps = [x["features"][level] for x in batched_inputs]
+            max_h = max(m.shape[-2] for m in maps)
+            max_w = max(m.shape[-1] for m in maps)
+            batched = torch.zeros((len(maps), maps[0].shape[0], max_h, max_w), dtype=torch.float32,
+                                  device=self.device)
+            for i, m in enumerate(maps):
+                batched[i, :, :m.shape[-2], :m.shape[-1]].copy_(m, non_blocking=True)
+            features.append(batched)
+
+        images_whwh = list()
+        for bi in batched_inputs:
+            h, w = bi["image_size"]
+            images_whwh.append(torch.tensor([w, h, w, h], dtype=torch.float32, device=self.device))
+        images_whwh = torch.stack(images_whwh)
+
+        return features, images_whwh
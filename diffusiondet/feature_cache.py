@@ -0,0 +1,265 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Frozen-backbone feature cache for head-only fine-tuning.
+
+The cache stores the P2-P5 features (after CPDC) of every training image for a
+bounded set of deterministic augmentations (short-edge scale x horizontal flip).
+Features are written as fp16 into a few large shard files and read back through
+``np.memmap``; ``meta.json`` records the layout together with the hash of the
+checkpoint and the config entries the features depend on, so a stale cache is
+refused instead of silently used.
+
+Build a cache with ``tools/build_feature_cache.py``, then train with
+``FEATURE_CACHE.ENABLED True FEATURE_CACHE.DIR <dir>``: the trainer will read
+features from the cache and only update the ``DynamicHead``.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+
+from detectron2.data import build_detection_train_loader, get_detection_dataset_dicts
+from detectron2.data import detection_utils as utils
+from detectron2.data import transforms as T
+from detectron2.utils.file_io import PathManager
+
+from .dataset_mapper import annotations_to_arrays, transform_annotations_to_instances
+from .sar_scaling import SARIntensityScaling
+from .util.shards import ShardReader, ShardWriter
+
+__all__ = [
+    "FeatureCache",
+    "FeatureCacheMapper",
+    "build_feature_cache",
+    "build_feature_cache_train_loader",
+    "checkpoint_hash",
+]
+
+logger = logging.getLogger(__name__)
+
+_META_FILE = "meta.json"
+_CACHE_VERSION = 2
+
+
+def checkpoint_hash(path):
+    """
+    Returns:
+        str: sha256 of the checkpoint file contents.
+    """
+    digest = hashlib.sha256()
+    with PathManager.open(PathManager.get_local_path(path), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _config_fingerprint(cfg):
+    """
+    Hash of the config entries that change the cached features.
+    """
+    keys = {
+        "backbone": cfg.MODEL.BACKBONE.NAME,
+        "depth": cfg.MODEL.RESNETS.DEPTH,
+        "in_features": list(cfg.MODEL.ROI_HEADS.IN_FEATURES),
+        "pixel_mean": list(cfg.MODEL.PIXEL_MEAN),
+        "pixel_std": list(cfg.MODEL.PIXEL_STD),
+        "format": cfg.INPUT.FORMAT,
+        "max_size": cfg.INPUT.MAX_SIZE_TRAIN,
+        "sar_scaling": [cfg.INPUT.SAR_SCALING.ENABLED, cfg.INPUT.SAR_SCALING.MODE,
+                        cfg.INPUT.SAR_SCALING.POWER, list(cfg.INPUT.SAR_SCALING.RANGE)],
+    }
+    return hashlib.sha256(json.dumps(keys, sort_keys=True).encode()).hexdigest()
+
+
+def cache_variants(cfg):
+    """
+    Returns:
+        list[tuple[int, bool]]: the (short edge, flip) pairs stored for every image.
+    """
+    scales = cfg.FEATURE_CACHE.SCALES or cfg.INPUT.MIN_SIZE_TRAIN
+    flips = (False, True) if cfg.FEATURE_CACHE.FLIP else (False,)
+    return [(int(s), f) for s in scales for f in flips]
+
+
+def _variant_transform(height, width, scale, flip, max_size):
+    new_h, new_w = T.ResizeShortestEdge.get_output_shape(height, width, scale, max_size)
+    tfms = [T.ResizeTransform(height, width, new_h, new_w)]
+    if flip:
+        tfms.append(T.HFlipTransform(new_w))
+    return T.TransformList(tfms)
+
+
+@torch.no_grad()
+def build_feature_cache(cfg, model, dataset_dicts, cache_dir):
+    """
+    Run the backbone and CPDC of `model` once per image and cached augmentation
+    and write the P2-P5 features to `cache_dir`.
+
+    Args:
+        cfg (CfgNode): the config used for training from the cache.
+        model (DiffusionDet): model with the weights of ``cfg.MODEL.WEIGHTS`` loaded.
+        dataset_dicts (list[dict]): training records, in the order they will be
+            loaded at training time.
+        cache_dir (str): output directory; existing shards are overwritten.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    variants = cache_variants(cfg)
+    max_size = cfg.INPUT.MAX_SIZE_TRAIN
+    writer = ShardWriter(cache_dir, cfg.FEATURE_CACHE.SHARD_SIZE_MB * 1024 ** 2)
+    reader = utils.ImageReader(cfg.INPUT.FORMAT, SARIntensityScaling.from_config(cfg))
+    model.eval()
+
+    index = []
+    for i, record in enumerate(dataset_dicts):
+        image = reader(record["file_name"])
+        utils.check_image_size(record, image)
+        height, width = image.shape[:2]
+        entries = []
+        for scale, flip in variants:
+            tfm = _variant_transform(height, width, scale, flip, max_size)
+            aug_image = tfm.apply_image(image)
+            tensor = torch.as_tensor(np.ascontiguousarray(aug_image.transpose(2, 0, 1)))
+            images, _ = model.preprocess_image([{"image": tensor}])
+            features = model.extract_features(images.tensor)
+            arrays = [f[0].half().cpu().numpy() for f in features]
+            shard, offset = writer.write(np.concatenate([a.ravel() for a in arrays]))
+            entries.append({
+                "scale": scale,
+                "flip": flip,
+                "image_size": list(aug_image.shape[:2]),
+                "shard": shard,
+                "offset": offset,
+                "shapes": [list(a.shape) for a in arrays],
+            })
+        index.append({"image_id": record.get("image_id"), "file_name": record["file_name"], "variants": entries})
+        if (i + 1) % 100 == 0:
+            logger.info("Cached features of {}/{} images".format(i + 1, len(dataset_dicts)))
+    writer.close()
+
+    meta = {
+        "version": _CACHE_VERSION,
+        "checkpoint_sha256": checkpoint_hash(cfg.MODEL.WEIGHTS),
+        "config_sha256": _config_fingerprint(cfg),
+        "variants": [list(v) for v in variants],
+        "num_shards": writer.num_shards,
+        "index": index,
+    }
+    with open(os.path.join(cache_dir, _META_FILE), "w") as f:
+        json.dump(meta, f)
+    logger.info("Wrote feature cache of {} images to {}".format(len(index), cache_dir))
+
+
+class FeatureCache:
+    """
+    Read-only view of a cache written by :func:`build_feature_cache`.
+    Shards are memory-mapped lazily, so the object can be pickled to dataloader
+    workers cheaply and each worker maps the files itself.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        meta_file = os.path.join(cache_dir, _META_FILE)
+        if not os.path.isfile(meta_file):
+            raise FileNotFoundError(
+                f"No feature cache found in {cache_dir}. Build it with tools/build_feature_cache.py"
+            )
+        with open(meta_file) as f:
+            self.meta = json.load(f)
+        self.index = self.meta.pop("index")
+        self._reader = ShardReader(cache_dir)
+
+    def __len__(self):
+        return len(self.index)
+
+    def validate(self, cfg, dataset_dicts=None):
+        """
+        Check that the cache was built from ``cfg.MODEL.WEIGHTS`` with a compatible
+        config and, if given, from the same records in the same order.
+        Raises ValueError when the cache is stale.
+        """
+        problems = []
+        if self.meta["version"] != _CACHE_VERSION:
+            problems.append("cache version {} != {}".format(self.meta["version"], _CACHE_VERSION))
+        if self.meta["checkpoint_sha256"] != checkpoint_hash(cfg.MODEL.WEIGHTS):
+            problems.append("checkpoint {} differs from the one the cache was built with".format(cfg.MODEL.WEIGHTS))
+        if self.meta["config_sha256"] != _config_fingerprint(cfg):
+            problems.append("backbone / input config differs")
+        if [list(v) for v in cache_variants(cfg)] != self.meta["variants"]:
+            problems.append("cached variants {} != requested {}".format(self.meta["variants"], cache_variants(cfg)))
+        if dataset_dicts is not None:
+            cached = [(e["image_id"], e["file_name"]) for e in self.index]
+            current = [(d.get("image_id"), d["file_name"]) for d in dataset_dicts]
+            if cached != current:
+                problems.append("dataset records differ from the cached ones")
+        if problems:
+            raise ValueError(
+                "Feature cache {} is stale: {}. Rebuild it with tools/build_feature_cache.py".format(
+                    self.cache_dir, "; ".join(problems)
+                )
+            )
+
+    def load(self, idx, variant):
+        """
+        Returns:
+            list[Tensor]: fp16 features of image `idx` under `variant`, one (C, H, W) per level.
+        """
+        entry = self.index[idx]["variants"][variant]
+        offset = entry["offset"]
+        features = []
+        for shape in entry["shapes"]:
+            data = self._reader.read(entry["shard"], offset, np.float16, shape)
+            # copy out of the mapping so the tensor can be moved to shared memory by the loader
+            features.append(torch.from_numpy(np.array(data)))
+            offset += data.nbytes
+        return features
+
+
+class FeatureCacheMapper:
+    """
+    A callable which takes a dataset dict (with a "cache_index" key) and returns
+    the cached features of a randomly chosen augmentation together with the
+    annotations transformed accordingly.
+    """
+
+    def __init__(self, cfg, cache):
+        self.cache = cache
+        self.max_size = cfg.INPUT.MAX_SIZE_TRAIN
+
+    def __call__(self, dataset_dict):
+        idx = dataset_dict["cache_index"]
+        variants = self.cache.index[idx]["variants"]
+        variant = np.random.randint(len(variants))
+        entry = variants[variant]
+        tfm = _variant_transform(
+            dataset_dict["height"], dataset_dict["width"], entry["scale"], entry["flip"], self.max_size
+        )
+        image_shape = tuple(entry["image_size"])
+
+        boxes, classes = annotations_to_arrays(dataset_dict.get("annotations", []))
+        return {
+            "file_name": dataset_dict["file_name"],
+            "image_id": dataset_dict.get("image_id"),
+            "height": dataset_dict["height"],
+            "width": dataset_dict["width"],
+            "image_size": image_shape,
+            "features": self.cache.load(idx, variant),
+            "instances": transform_annotations_to_instances(boxes, classes, tfm, image_shape),
+        }
+
+
+def build_feature_cache_train_loader(cfg):
+    """
+    Build the training loader that reads features from ``cfg.FEATURE_CACHE.DIR``
+    instead of decoding images.
+    """
+    dataset_dicts = get_detection_dataset_dicts(
+        cfg.DATASETS.TRAIN, filter_empty=cfg.DATALOADER.FILTER_EMPTY_ANNOTATIONS
+    )
+    cache = FeatureCache(cfg.FEATURE_CACHE.DIR)
+    cache.validate(cfg, dataset_dicts)
+    logger.info("Training from feature cache {} ({} images)".format(cfg.FEATURE_CACHE.DIR, len(cache)))
+    records = [dict(d, cache_index=i) for i, d in enumerate(dataset_dicts)]
+    return build_detection_train_loader(cfg, dataset=records, mapper=FeatureCacheMapper(cfg, cache))
@@ -20,10 +20,13 @@ import numpy as np
 import torch
 from torch import nn, Tensor
 import torch.nn.functional as F
+import torch.utils.checkpoint as checkpoint
 
 from detectron2.modeling.poolers import ROIPooler
 from detectron2.structures import Boxes
 
+from .latency import LatencyProfiler
+
 
 _DEFAULT_SCALE_CLAMP = math.log(100000.0 / 16)
 
@@ -70,7 +73,7 @@ class Dense(nn.Module):
 
 class DynamicHead(nn.Module):
 
-    def __init__(self, cfg, roi_input_shape):
+    def __init__(self, cfg, roi_input_shape, latency=None):
         super().__init__()
 
         # Build RoI.
@@ -87,8 +90,14 @@ class DynamicHead(nn.Module):
         num_heads = cfg.MODEL.DiffusionDet.NUM_HEADS
         rcnn_head = RCNNHead(cfg, d_model, num_classes, dim_feedforward, nhead, dropout, activation)
         self.head_series = _get_clones(rcnn_head, num_heads)
+        # shared by the cloned heads, see diffusiondet/latency.py
+        latency = latency or LatencyProfiler()
+        for head in self.head_series:
+            head.latency = latency
         self.num_heads = num_heads
         self.return_intermediate = cfg.MODEL.DiffusionDet.DEEP_SUPERVISION
+        self.checkpoint_heads = set(cfg.MODEL.DiffusionDet.CHECKPOINT_HEADS)
+        assert all(0 <= i < num_heads for i in self.checkpoint_heads), self.checkpoint_heads
 
         # Gaussian random feature embedding layer for time
         self.d_model = d_model
@@ -160,8 +169,14 @@ class DynamicHead(nn.Module):
         else:
             proposal_features = None
         
+        use_checkpoint = self.training and torch.is_grad_enabled()
         for head_idx, rcnn_head in enumerate(self.head_series):
-            class_logits, pred_bboxes, proposal_features = rcnn_head(features, bboxes, proposal_features, self.box_pooler, time)
+            if use_checkpoint and head_idx in self.checkpoint_heads:
+                # recompute this stage in backward; non-reentrant mode tracks the feature list
+                class_logits, pred_bboxes, proposal_features = checkpoint.checkpoint(
+                    rcnn_head, features, bboxes, proposal_features, self.box_pooler, time, use_reentrant=False)
+            else:
+                class_logits, pred_bboxes, proposal_features = rcnn_head(features, bboxes, proposal_features, self.box_pooler, time)
             if self.return_intermediate:
                 inter_class_logits.append(class_logits)
                 inter_pred_bboxes.append(pred_bboxes)
@@ -176,10 +191,12 @@ class DynamicHead(nn.Module):
 class RCNNHead(nn.Module):
 
     def __init__(self, cfg, d_model, num_classes, dim_feedforward=2048, nhead=8, dropout=0.1, activation="relu",
-                 scale_clamp: float = _DEFAULT_SCALE_CLAMP, bbox_weights=(2.0, 2.0, 1.0, 1.0)):
+                 scale_clamp: float = _DEFAULT_SCALE_CLAMP, bbox_weights=(2.0, 2.0, 1.0, 1.0), latency=None):
         super().__init__()
 
         self.d_model = d_model
+        # disabled unless given; DynamicHead shares its own profiler between the cloned heads
+        self.latency = latency or LatencyProfiler()
 
         # dynamic.
         self.self_attn = nn.MultiheadAttention(d_model, nhead, dropout=dropout)
@@ -239,50 +256,55 @@ class RCNNHead(nn.Module):
         N, nr_boxes = bboxes.shape[:2]
         
         # roi_feature.
-        proposal_boxes = list()
-        for b in range(N):
-            proposal_boxes.append(Boxes(bboxes[b]))
-        roi_features = pooler(features, proposal_boxes)
+        with self.latency.section("roi_pooling"):
+            proposal_boxes = list()
+            for b in range(N):
+                proposal_boxes.append(Boxes(bboxes[b]))
+            roi_features = pooler(features, proposal_boxes)
 
-        if pro_features is None:
-            pro_features = roi_features.view(N, nr_boxes, self.d_model, -1).mean(-1)
+            if pro_features is None:
+                pro_features = roi_features.view(N, nr_boxes, self.d_model, -1).mean(-1)
 
-        roi_features = roi_features.view(N * nr_boxes, self.d_model, -1).permute(2, 0, 1)
+            roi_features = roi_features.view(N * nr_boxes, self.d_model, -1).permute(2, 0, 1)
 
         # self_att.
-        pro_features = pro_features.view(N, nr_boxes, self.d_model).permute(1, 0, 2)
-        pro_features2 = self.self_attn(pro_features, pro_features, value=pro_features)[0]
-        pro_features = pro_features + self.dropout1(pro_features2)
-        pro_features = self.norm1(pro_features)
+        with self.latency.section("attention"):
+            pro_features = pro_features.view(N, nr_boxes, self.d_model).permute(1, 0, 2)
+            pro_features2 = self.self_attn(pro_features, pro_features, value=pro_features)[0]
+            pro_features = pro_features + self.dropout1(pro_features2)
+            pro_features = self.norm1(pro_features)
 
         # inst_interact.
-        pro_features = pro_features.view(nr_boxes, N, self.d_model).permute(1, 0, 2).reshape(1, N * nr_boxes, self.d_model)
-        pro_features2 = self.inst_interact(pro_features, roi_features)
-        pro_features = pro_features + self.dropout2(pro_features2)
-        obj_features = self.norm2(pro_features)
+        with self.latency.section("dynamic_conv"):
+            pro_features = pro_features.view(nr_boxes, N, self.d_model).permute(1, 0, 2).reshape(1, N * nr_boxes, self.d_model)
+            pro_features2 = self.inst_interact(pro_features, roi_features)
+            pro_features = pro_features + self.dropout2(pro_features2)
+            obj_features = self.norm2(pro_features)
 
         # obj_feature.
-        obj_features2 = self.linear2(self.dropout(self.activation(self.linear1(obj_features))))
-        obj_features = obj_features + self.dropout3(obj_features2)
-        obj_features = self.norm3(obj_features)
-        
-        fc_feature = obj_features.transpose(0, 1).reshape(N * nr_boxes, -1)
-
-        scale_shift = self.block_time_mlp(time_emb)
-        scale_shift = torch.repeat_interleave(scale_shift, nr_boxes, dim=0)
-        scale, shift = scale_shift.chunk(2, dim=1)
-        fc_feature = fc_feature * (scale + 1) + shift
-
-        cls_feature = fc_feature.clone()
-        reg_feature = fc_feature.clone()
-        for cls_layer in self.cls_module:
-            cls_feature = cls_layer(cls_feature)
-        for reg_layer in self.reg_module:
-            reg_feature = reg_layer(reg_feature)
-        class_logits = self.class_logits(cls_feature)
-        bboxes_deltas = self.bboxes_delta(reg_feature)
-        pred_bboxes = self.apply_deltas(bboxes_deltas, bboxes.view(-1, 4))
-        
+        with self.latency.section("ffn"):
+            obj_features2 = self.linear2(self.dropout(self.activation(self.linear1(obj_features))))
+            obj_features = obj_features + self.dropout3(obj_features2)
+            obj_features = self.norm3(obj_features)
+
+        with self.latency.section("cls_reg"):
+            fc_feature = obj_features.transpose(0, 1).reshape(N * nr_boxes, -1)
+
+            scale_shift = self.block_time_mlp(time_emb)
+            scale_shift = torch.repeat_interleave(scale_shift, nr_boxes, dim=0)
+            scale, shift = scale_shift.chunk(2, dim=1)
+            fc_feature = fc_feature * (scale + 1) + shift
+
+            cls_feature = fc_feature.clone()
+            reg_feature = fc_feature.clone()
+            for cls_layer in self.cls_module:
+                cls_feature = cls_layer(cls_feature)
+            for reg_layer in self.reg_module:
+                reg_feature = reg_layer(reg_feature)
+            class_logits = self.class_logits(cls_feature)
+            bboxes_deltas = self.bboxes_delta(reg_feature)
+            pred_bboxes = self.apply_deltas(bboxes_deltas, bboxes.view(-1, 4))
+
         return class_logits.view(N, nr_boxes, -1), pred_bboxes.view(N, nr_boxes, -1), obj_features
 
     def apply_deltas(self, deltas, boxes):
@@ -0,0 +1,136 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Pre-decoded image store.
+
+``pack_image_store`` decodes every image of a dataset once (with EXIF orientation,
+SAR intensity scaling and in the model's input format) and writes the raw uint8 pixels into a few large
+shard files; ``index.json`` maps each image's base name to (shard, offset, shape).
+:class:`ImageStore` then serves images as zero-copy ``np.memmap`` views, which
+skips the open/decode/convert work of ``detection_utils.read_image``.
+
+Stores are looked up through the ``image_store`` metadata of a dataset, which
+``register_atrnet.py`` sets when a packed store exists. Pack one with
+``tools/pack_image_store.py``.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from detectron2.data import MetadataCatalog
+from detectron2.data import detection_utils as utils
+
+from .util.shards import ShardReader, ShardWriter
+
+__all__ = ["ImageStore", "pack_image_store", "image_stores_for_datasets"]
+
+logger = logging.getLogger(__name__)
+
+_INDEX_FILE = "index.json"
+
+
+def _key(file_name):
+    # base names are unique within an ATRNet-STAR split and survive moving the data root
+    return os.path.basename(file_name)
+
+
+def pack_image_store(dataset_dicts, store_dir, image_format, shard_size_mb=1024, scaling=None):
+    """
+    Decode the images of `dataset_dicts` and write them to `store_dir`.
+
+    Args:
+        dataset_dicts (list[dict]): records with a "file_name" key.
+        store_dir (str): output directory; existing shards are overwritten.
+        image_format (str): format passed to ``detection_utils.read_image``, e.g. "RGB".
+        shard_size_mb (int): maximum size of one shard file.
+        scaling (SARIntensityScaling): scaling of non-8-bit images, recorded in the index.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    writer = ShardWriter(store_dir, shard_size_mb * 1024 ** 2)
+    reader = utils.ImageReader(image_format, scaling)
+    index = {}
+    for i, record in enumerate(dataset_dicts):
+        key = _key(record["file_name"])
+        if key in index:
+            continue
+        image = reader(record["file_name"])
+        if image.ndim == 2:
+            image = image[:, :, None]
+        shard, offset = writer.write(image.astype(np.uint8, copy=False))
+        index[key] = [shard, offset] + list(image.shape)
+        if (i + 1) % 1000 == 0:
+            logger.info("Packed {}/{} images".format(i + 1, len(dataset_dicts)))
+    writer.close()
+
+    with open(os.path.join(store_dir, _INDEX_FILE), "w") as f:
+        meta = {
+            "format": image_format,
+            "scaling": scaling.describe() if scaling is not None else None,
+            "num_shards": writer.num_shards,
+            "images": index,
+        }
+        json.dump(meta, f)
+    logger.info("Packed {} images into {} shard(s) in {}".format(len(index), writer.num_shards, store_dir))
+
+
+class ImageStore:
+    """
+    Read-only access to a store written by :func:`pack_image_store`.
+    Can be pickled to dataloader workers; each worker maps the shards itself.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, _INDEX_FILE)) as f:
+            meta = json.load(f)
+        self.format = meta["format"]
+        self.scaling = meta.get("scaling")
+        self.index = meta["images"]
+        self._reader = ShardReader(store_dir)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, file_name):
+        return _key(file_name) in self.index
+
+    def read(self, file_name):
+        """
+        Returns:
+            np.ndarray: read-only (H, W, C) uint8 view of the image.
+        """
+        shard, offset, *shape = self.index[_key(file_name)]
+        return self._reader.read(shard, offset, np.uint8, shape)
+
+
+def image_stores_for_datasets(dataset_names, image_format, scaling=None):
+    """
+    Returns:
+        list[ImageStore]: the stores registered (``image_store`` metadata) for
+        `dataset_names` that were packed in `image_format` with `scaling`.
+    """
+    scaling = scaling.describe() if scaling is not None else None
+    stores = []
+    for name in dataset_names:
+        store_dir = MetadataCatalog.get(name).get("image_store")
+        if not store_dir:
+            continue
+        store = ImageStore(store_dir)
+        if store.format != image_format:
+            logger.warning(
+                "Image store {} was packed as {}, but {} is needed; reading files instead.".format(
+                    store_dir, store.format, image_format
+                )
+            )
+            continue
+        if store.scaling != scaling:
+            logger.warning(
+                "Image store {} was packed with SAR scaling {}, but {} is configured; reading files instead.".format(
+                    store_dir, store.scaling, scaling
+                )
+            )
+            continue
+        logger.info("Reading images of {} from packed store {}".format(name, store_dir))
+        stores.append(store)
+    return stores
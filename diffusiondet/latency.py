@@ -0,0 +1,175 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Opt-in latency breakdown of DiffusionDet inference (MODEL.DiffusionDet.PROFILE_LATENCY).
+
+The model times its stages with ``profiler.section(name)``: preprocess, backbone,
+CPDC, every DDIM step and, within a step, RoI pooling, self-attention,
+DynamicConv, FFN, cls/reg, box renewal, then ensemble NMS and postprocess.
+Sections are grouped in frames (one per DDIM step, one per batch): the time of
+a section is summed over the frame, e.g. over the cascade of RCNN heads, and
+becomes one sample when the frame closes. :meth:`LatencyProfiler.summary`
+reports the p50 / p95 / p99 of the samples.
+
+When disabled, a section is a shared ``nullcontext``, so the instrumentation
+costs an attribute lookup and a call. When enabled, the CUDA device is
+synchronized at the start and the end of every section so that asynchronous
+kernels are charged to the section that launched them; this serializes the
+host and the device and adds to the total time.
+"""
+import contextlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from tabulate import tabulate
+
+from detectron2.utils.file_io import PathManager
+
+__all__ = ["LatencyProfiler"]
+
+_DISABLED = contextlib.nullcontext()
+
+
+class LatencyProfiler:
+    """
+    Collects wall times of named sections of the model, see the module docstring.
+    """
+
+    def __init__(self, enabled=False, device=None, num_warmup=5):
+        """
+        Args:
+            enabled (bool): record times; otherwise sections do nothing.
+            device (torch.device or None): CUDA device to synchronize, if any.
+            num_warmup (int): number of outermost frames (batches) to discard,
+                like the warmup iterations of ``inference_on_dataset``.
+        """
+        self.enabled = enabled
+        self.num_warmup = num_warmup
+        self._sync = device is not None and torch.device(device).type == "cuda" and torch.cuda.is_available()
+        self._device = device
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all samples, including the warmup count.
+        """
+        self._samples = OrderedDict()
+        self._open = OrderedDict()
+        self._pending = []
+        self._depth = 0
+        self._num_frames = 0
+
+    def section(self, name):
+        """
+        Returns:
+            a context manager that adds its wall time to section `name` of the current
+            frame. Outside of a frame (e.g. in training) nothing is recorded.
+        """
+        if not self.enabled or self._depth == 0:
+            return _DISABLED
+        return self._timed(name, frame=False)
+
+    def frame(self, name):
+        """
+        Like :meth:`section`, and closes a frame on exit: every section timed since
+        the previous frame (including this one) becomes one sample.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return self._timed(name, frame=True)
+
+    def frames(self, name, iterable):
+        """
+        Iterate over `iterable`, timing the loop body of every item as a :meth:`frame`.
+        """
+        for item in iterable:
+            with self.frame(name):
+                yield item
+
+    @contextlib.contextmanager
+    def _timed(self, name, frame):
+        if frame:
+            self._depth += 1
+        self._synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._synchronize()
+            self._open[name] = self._open.get(name, 0.0) + time.perf_counter() - start
+            if frame:
+                self._close_frame()
+
+    def _synchronize(self):
+        if self._sync:
+            torch.cuda.synchronize(self._device)
+
+    def _close_frame(self):
+        self._pending.append(self._open)
+        self._open = OrderedDict()
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        # the outermost frame is complete: keep its samples unless it is a warmup batch
+        self._num_frames += 1
+        if self._num_frames > self.num_warmup:
+            for frame in self._pending:
+                for name, seconds in frame.items():
+                    self._samples.setdefault(name, []).append(seconds)
+        self._pending = []
+
+    def summary(self):
+        """
+        Returns:
+            OrderedDict: for each section, in order of first appearance, "count"
+            and the "mean", "p50", "p95", "p99" and "total" times in milliseconds.
+        """
+        summary = OrderedDict()
+        for name, samples in self._samples.items():
+            ms = np.asarray(samples) * 1000.0
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[name] = {
+                "count": len(ms),
+                "mean": float(ms.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "total": float(ms.sum()),
+            }
+        return summary
+
+    def log_summary(self, logger=None):
+        """
+        Log :meth:`summary` as a table.
+        """
+        logger = logger or logging.getLogger(__name__)
+        summary = self.summary()
+        if not summary:
+            logger.info("No latency samples were recorded.")
+            return
+        rows = [
+            [name, s["count"], s["mean"], s["p50"], s["p95"], s["p99"]] for name, s in summary.items()
+        ]
+        table = tabulate(
+            rows,
+            headers=["section", "count", "mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"],
+            tablefmt="pipe",
+            floatfmt=".3f",
+        )
+        logger.info(
+            "Inference latency breakdown ({} batches after {} warmup, CUDA synchronized: {}):\n".format(
+                max(self._num_frames - self.num_warmup, 0), self.num_warmup, self._sync
+            )
+            + table
+        )
+
+    def dump(self, path, **meta):
+        """
+        Write :meth:`summary` and `meta` (e.g. the sampling config) to a json file.
+        """
+        data = {"meta": meta, "cuda_synchronized": self._sync, "sections": self.summary()}
+        with PathManager.open(path, "w") as f:
+            json.dump(data, f, indent=2)
@@ -18,10 +18,33 @@ Supports both local and PANDO supercomputer layouts:
   - PANDO:  ~/DiffDet4SAR-project/DiffDet4SAR/ +  ~/DiffDet4SAR-project/ATRNet-STAR-data/
 
 Override with env var ATRNET_DATA_DIR if needed.
+
+Annotation files are loaded through a cached binary index (see
+detectron2/data/datasets/coco_index.py), so only the first load parses the json.
+
+Images are read from Ground_Range/<product>/, where <product> defaults to
+Amplitude_8bit. Set ATRNET_IMAGE_PRODUCT to train from another (e.g. 16-bit or
+float amplitude) product directory; enable INPUT.SAR_SCALING for those.
+
+Images packed with tools/pack_image_store.py into <ATRNET_IMAGE_STORE_DIR>/<dataset name>
+(default: <data dir>/image_store) are registered as the dataset's "image_store"
+metadata and read from there by DiffusionDetDatasetMapper.
+
+diffusiondet/staging.py copies a split to node-local disk, repoints ATRNET_DATA_DIR
+and registers the datasets again with register_all().
 """
 
 import os
-from detectron2.data.datasets import register_coco_instances
+from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data.datasets import register_coco_instances_cached
+
+# registered dataset -> (split directory, subset) of the images it reads
+DATASET_SPLITS = {
+    "atrnet_star_train": ("SOC_50classes", "train"),
+    "atrnet_star_test": ("SOC_50classes", "test"),
+    "atrnet_military_train": ("SOC_50classes", "train"),
+    "atrnet_military_test": ("SOC_50classes", "test"),
+}
 
 
 def _base_path():
@@ -33,18 +56,37 @@ def _base_path():
     )
 
 
+def _image_product():
+    return os.environ.get("ATRNET_IMAGE_PRODUCT", "Amplitude_8bit")
+
+
+def image_store_dir(name):
+    """Directory of the packed image store of dataset `name` (it may not exist yet)."""
+    root = os.environ.get("ATRNET_IMAGE_STORE_DIR") or os.path.join(_base_path(), "image_store")
+    return os.path.join(os.path.abspath(root), name)
+
+
+def _register_image_store(name):
+    store_dir = image_store_dir(name)
+    if os.path.isfile(os.path.join(store_dir, "index.json")):
+        MetadataCatalog.get(name).set(image_store=store_dir)
+        print(f"  Image store for {name}: {store_dir}")
+
+
 def register_atrnet_star():
     """Register SOC_50classes (all 50 vehicle types)."""
     base_path = _base_path()
 
-    train_image_dir = os.path.join(base_path, "Ground_Range", "Amplitude_8bit", "SOC_50classes", "train")
-    test_image_dir  = os.path.join(base_path, "Ground_Range", "Amplitude_8bit", "SOC_50classes", "test")
+    train_image_dir = os.path.join(base_path, "Ground_Range", _image_product(), "SOC_50classes", "train")
+    test_image_dir  = os.path.join(base_path, "Ground_Range", _image_product(), "SOC_50classes", "test")
     annotation_dir  = os.path.join(base_path, "Ground_Range", "annotation_coco", "SOC_50classes", "annotations")
     train_json = os.path.join(annotation_dir, "train.json")
     test_json  = os.path.join(annotation_dir, "test.json")
 
-    register_coco_instances("atrnet_star_train", {}, train_json, train_image_dir)
-    register_coco_instances("atrnet_star_test",  {}, test_json,  test_image_dir)
+    register_coco_instances_cached("atrnet_star_train", {}, train_json, train_image_dir)
+    register_coco_instances_cached("atrnet_star_test",  {}, test_json,  test_image_dir)
+    _register_image_store("atrnet_star_train")
+    _register_image_store("atrnet_star_test")
 
     print(f"✓ Registered atrnet_star (SOC_50classes, 50 classes)")
     print(f"  Train: {train_image_dir}")
@@ -61,8 +103,8 @@ def register_atrnet_military():
     """
     base_path = _base_path()
 
-    image_dir_train = os.path.join(base_path, "Ground_Range", "Amplitude_8bit", "SOC_50classes", "train")
-    image_dir_test  = os.path.join(base_path, "Ground_Range", "Amplitude_8bit", "SOC_50classes", "test")
+    image_dir_train = os.path.join(base_path, "Ground_Range", _image_product(), "SOC_50classes", "train")
+    image_dir_test  = os.path.join(base_path, "Ground_Range", _image_product(), "SOC_50classes", "test")
     annotation_dir  = os.path.join(base_path, "Ground_Range", "annotation_coco", "SOC_50classes", "annotations")
     train_json = os.path.join(annotation_dir, "train_military.json")
     test_json  = os.path.join(annotation_dir, "test_military.json")
@@ -73,14 +115,25 @@ def register_atrnet_military():
             "Run:  python prepare_military_dataset.py"
         )
 
-    register_coco_instances("atrnet_military_train", {}, train_json, image_dir_train)
-    register_coco_instances("atrnet_military_test",  {}, test_json,  image_dir_test)
+    register_coco_instances_cached("atrnet_military_train", {}, train_json, image_dir_train)
+    register_coco_instances_cached("atrnet_military_test",  {}, test_json,  image_dir_test)
+    _register_image_store("atrnet_military_train")
+    _register_image_store("atrnet_military_test")
 
     print(f"✓ Registered atrnet_military (SOC_50classes military subset, 10 classes)")
     print(f"  Train: {image_dir_train}")
     print(f"  Test:  {image_dir_test}")
 
 
+def register_all():
+    """(Re-)register all variants, e.g. after ATRNET_DATA_DIR has changed."""
+    for name in DATASET_SPLITS:
+        if name in DatasetCatalog.list():
+            DatasetCatalog.remove(name)
+            MetadataCatalog.remove(name)
+    register_atrnet_star()
+    register_atrnet_military()
+
+
 # Auto-register on import
-register_atrnet_star()
-register_atrnet_military()
+register_all()
@@ -0,0 +1,98 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Calibrated intensity scaling of non-8-bit SAR products to uint8.
+
+Unlike per-image min-max normalization, a fixed (dataset-wide) range keeps the
+radiometry comparable across chips: a pixel value maps to the same uint8 value
+in every image. Values are optionally converted to dB first and then clipped to
+``INPUT.SAR_SCALING.RANGE``, which is typically calibrated from percentiles of a
+sample of training images with ``tools/calibrate_sar_scaling.py``.
+"""
+import numpy as np
+
+__all__ = ["SARIntensityScaling", "calibrate_sar_range"]
+
+
+class SARIntensityScaling:
+    """
+    Map an amplitude (or power) image of any dtype to uint8.
+
+    ``mode="db"``: ``20 * log10(amplitude)`` (``10 * log10`` for power), then
+    linear mapping of ``[low, high]`` dB to [0, 255]. ``mode="linear"``: linear
+    mapping of ``[low, high]`` in the stored units. Values outside the range are clipped.
+    """
+
+    def __init__(self, low, high, mode="db", power=False, eps=1e-6):
+        assert mode in ("db", "linear"), mode
+        assert high > low, (low, high)
+        self.low = float(low)
+        self.high = float(high)
+        self.mode = mode
+        self.power = power
+        self.eps = eps
+
+    @classmethod
+    def from_config(cls, cfg):
+        """
+        Returns:
+            SARIntensityScaling or None: None if ``INPUT.SAR_SCALING.ENABLED`` is off.
+        """
+        c = cfg.INPUT.SAR_SCALING
+        if not c.ENABLED:
+            return None
+        if len(c.RANGE) != 2:
+            raise ValueError(
+                "INPUT.SAR_SCALING.RANGE must be (low, high); calibrate it with tools/calibrate_sar_scaling.py"
+            )
+        return cls(c.RANGE[0], c.RANGE[1], mode=c.MODE, power=c.POWER)
+
+    def describe(self):
+        """
+        Returns:
+            dict: the parameters, stored with packed images and feature caches.
+        """
+        return {"mode": self.mode, "power": self.power, "range": [self.low, self.high]}
+
+    def to_db(self, image):
+        """
+        Returns:
+            np.ndarray: float32 `image` in the units of the clipping range.
+        """
+        image = image.astype(np.float32)
+        if self.mode == "db":
+            np.maximum(image, self.eps, out=image)
+            np.log10(image, out=image)
+            image *= 10.0 if self.power else 20.0
+        return image
+
+    def __call__(self, image):
+        image = self.to_db(image)
+        image -= self.low
+        image *= 255.0 / (self.high - self.low)
+        np.clip(image, 0, 255, out=image)
+        return image.astype(np.uint8)
+
+
+def calibrate_sar_range(images, mode="db", power=False, percentiles=(1.0, 99.0), max_pixels=100000, seed=0):
+    """
+    Estimate a dataset-wide clipping range from a sample of images.
+
+    Args:
+        images (iterable[np.ndarray]): raw (non-scaled) images.
+        mode, power: as in :class:`SARIntensityScaling`.
+        percentiles (tuple[float, float]): lower and upper percentile.
+        max_pixels (int): pixels sampled per image.
+
+    Returns:
+        tuple[float, float]: the (low, high) range.
+    """
+    rng = np.random.default_rng(seed)
+    to_db = SARIntensityScaling(0.0, 1.0, mode=mode, power=power).to_db
+    samples = []
+    for image in images:
+        values = image.reshape(-1)
+        if values.size > max_pixels:
+            values = values[rng.choice(values.size, max_pixels, replace=False)]
+        samples.append(to_db(values))
+    low, high = np.percentile(np.concatenate(samples), percentiles)
+    return float(low), float(high)
@@ -0,0 +1,224 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Stage an ATRNet-STAR split from the shared filesystem onto node-local disk.
+
+Training reads many small image files from every dataloader worker, which is slow
+against network storage. :func:`stage_atrnet` copies what a split needs (the
+annotation directory plus either the image directories or the packed image
+stores) into a node-local directory, keeping the layout of ``ATRNET_DATA_DIR``,
+and points ``ATRNET_DATA_DIR`` at the copy.
+
+A manifest (``.staging_manifest.json``) records size, mtime and sha1 of every
+staged file, so a later job on the same node only copies files that are missing
+or changed at the source. Concurrent jobs on one node are serialized with a lock
+file. The default destination is ``$ATRNET_STAGE_DIR``, else
+``$TMPDIR/atrnet-<user>``; set ``ATRNET_STAGE_DIR`` to a node-local directory
+that outlives the job (e.g. local NVMe scratch) if ``$TMPDIR`` is wiped per job.
+
+From a slurm script (prints ``export ATRNET_DATA_DIR=...``):
+    eval "$(python tools/stage_dataset.py --split SOC_50classes)"
+"""
+import concurrent.futures
+import fcntl
+import getpass
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from . import register_atrnet
+
+__all__ = ["stage_files", "stage_atrnet", "default_stage_dir"]
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = ".staging_manifest.json"
+_LOCK_FILE = ".staging.lock"
+_CHUNK = 8 << 20
+
+
+def default_stage_dir():
+    """
+    Returns:
+        str: ``$ATRNET_STAGE_DIR``, else ``atrnet-<user>`` in ``$TMPDIR``.
+    """
+    env = os.environ.get("ATRNET_STAGE_DIR")
+    if env:
+        return os.path.abspath(env)
+    return os.path.join(tempfile.gettempdir(), "atrnet-{}".format(getpass.getuser()))
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy(src, dst):
+    """
+    Copy `src` to `dst` through a temporary file, hashing the bytes on the way.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    digest = hashlib.sha1()
+    tmp = dst + ".staging"
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        for chunk in iter(lambda: fin.read(_CHUNK), b""):
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+    return digest.hexdigest()
+
+
+def _list_files(src_root, relpaths):
+    files = []
+    for rel in relpaths:
+        path = os.path.join(src_root, rel)
+        if os.path.isfile(path):
+            files.append(rel)
+            continue
+        if not os.path.isdir(path):
+            raise FileNotFoundError("Nothing to stage at {}".format(path))
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                files.append(os.path.relpath(os.path.join(dirpath, name), src_root))
+    return sorted(files)
+
+
+def stage_files(src_root, dst_root, relpaths, num_workers=8, verify=False):
+    """
+    Mirror `relpaths` (files or directories, relative to `src_root`) into `dst_root`.
+
+    Files already staged, i.e. listed in the manifest with the source's current
+    size and mtime and present in `dst_root` with that size, are skipped.
+
+    Args:
+        src_root (str): the shared dataset root.
+        dst_root (str): the node-local copy.
+        relpaths (list[str]): what to stage.
+        num_workers (int): parallel copies.
+        verify (bool): re-hash skipped files and re-copy those whose sha1 differs
+            from the manifest.
+
+    Returns:
+        dict: number of "copied" and "skipped" files and "bytes" copied.
+    """
+    os.makedirs(dst_root, exist_ok=True)
+    with open(os.path.join(dst_root, _LOCK_FILE), "w") as lock:
+        # one stager per node; a second job waits here and then skips everything
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest_file = os.path.join(dst_root, MANIFEST_FILE)
+        manifest = {}
+        if os.path.isfile(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+
+        def is_staged(rel, st):
+            entry = manifest.get(rel)
+            if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+                return False
+            dst = os.path.join(dst_root, rel)
+            if not os.path.isfile(dst) or os.path.getsize(dst) != st.st_size:
+                return False
+            return not verify or _sha1(dst) == entry["sha1"]
+
+        def stage(rel):
+            st = os.stat(os.path.join(src_root, rel))
+            if is_staged(rel, st):
+                return rel, None
+            sha1 = _copy(os.path.join(src_root, rel), os.path.join(dst_root, rel))
+            return rel, {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": sha1}
+
+        files = _list_files(src_root, relpaths)
+        stats = {"copied": 0, "skipped": 0, "bytes": 0}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+                for rel, entry in executor.map(stage, files):
+                    if entry is None:
+                        stats["skipped"] += 1
+                        continue
+                    manifest[rel] = entry
+                    stats["copied"] += 1
+                    stats["bytes"] += entry["size"]
+                    if stats["copied"] % 10000 == 0:
+                        logger.info("Staged {} files into {}".format(stats["copied"], dst_root))
+        finally:
+            # keep what was copied so far, an interrupted job resumes from there
+            tmp = manifest_file + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, manifest_file)
+    logger.info(
+        "Staged {} into {}: {} copied ({:.1f} MB), {} already staged".format(
+            src_root, dst_root, stats["copied"], stats["bytes"] / 1024 ** 2, stats["skipped"]
+        )
+    )
+    return stats
+
+
+def stage_atrnet(split="SOC_50classes", dst_root=None, images="files", num_workers=8, verify=False):
+    """
+    Stage a split of the dataset at ``ATRNET_DATA_DIR`` and repoint
+    ``ATRNET_DATA_DIR`` (and ``ATRNET_IMAGE_STORE_DIR``) at the staged copy.
+
+    The datasets registered by ``register_atrnet`` at import time are registered
+    again with the staged paths.
+
+    Args:
+        split (str): directory name of the split, e.g. "SOC_50classes".
+        dst_root (str): destination; defaults to :func:`default_stage_dir`.
+        images (str): "files" stages the image directories, "store" the packed
+            image stores of the split's datasets (see ``tools/pack_image_store.py``),
+            "auto" the stores if all of them exist and the files otherwise.
+            Stores are only read when their format and SAR scaling match the
+            config, so the image directories of the non-training subsets, which
+            evaluation reads in that case, are staged with the stores as well.
+        num_workers, verify: see :func:`stage_files`.
+
+    Returns:
+        str: the staged dataset root.
+    """
+    assert images in ("auto", "files", "store"), images
+    src_root = register_atrnet._base_path()
+    dst_root = os.path.abspath(dst_root or default_stage_dir())
+    product = register_atrnet._image_product()
+    relpaths = [os.path.join("Ground_Range", "annotation_coco", split)]
+    # the image directories and image stores of the datasets that read this split
+    datasets = {
+        name: subset for name, (dataset_split, subset) in register_atrnet.DATASET_SPLITS.items()
+        if dataset_split == split
+    }
+    image_dirs = [os.path.join("Ground_Range", product, split, s) for s in sorted(set(datasets.values()))]
+    stores = {name: register_atrnet.image_store_dir(name) for name in datasets}
+    have_stores = bool(stores) and all(
+        os.path.isfile(os.path.join(d, "index.json")) for d in stores.values()
+    )
+    if images == "store" and not have_stores:
+        raise FileNotFoundError(
+            "Image stores of {} are missing; pack them with tools/pack_image_store.py".format(split)
+        )
+    use_stores = images == "store" or (images == "auto" and have_stores)
+    if not use_stores:
+        relpaths += image_dirs
+    else:
+        relpaths += [
+            os.path.join("Ground_Range", product, split, s)
+            for s in sorted(set(datasets.values())) if s != "train"
+        ]
+    stage_files(src_root, dst_root, relpaths, num_workers=num_workers, verify=verify)
+    if use_stores:
+        for name, store_dir in stores.items():
+            stage_files(store_dir, os.path.join(dst_root, "image_store", name), ["."],
+                        num_workers=num_workers, verify=verify)
+        os.environ.pop("ATRNET_IMAGE_STORE_DIR", None)
+    else:
+        # the image files are now local; a store left on network storage would be slower
+        os.environ["ATRNET_IMAGE_STORE_DIR"] = os.path.join(dst_root, "image_store")
+
+    os.environ["ATRNET_DATA_DIR"] = dst_root
+    register_atrnet.register_all()
+    return dst_root
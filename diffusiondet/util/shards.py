@@ -0,0 +1,72 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+"""
+Append-only shard files of raw arrays, read back zero-copy through ``np.memmap``.
+
+Used by the feature cache and the packed image store: arrays are appended to
+``shard_XXXX.bin`` files of bounded size and addressed by (shard, byte offset),
+with dtype and shape kept in the caller's index.
+"""
+import os
+
+import numpy as np
+
+SHARD_FILE = "shard_{:04d}.bin"
+
+
+class ShardWriter:
+    """
+    Append arrays to shard files in `directory`, starting a new shard once
+    `shard_size` bytes would be exceeded.
+    """
+
+    def __init__(self, directory, shard_size):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.num_shards = 0
+        self.offset = 0
+        self._file = None
+
+    def write(self, array):
+        """
+        Returns:
+            tuple[int, int]: (shard, byte offset) where `array` starts.
+        """
+        array = np.ascontiguousarray(array)
+        if self._file is None or self.offset > 0 and self.offset + array.nbytes > self.shard_size:
+            self.close()
+            self._file = open(os.path.join(self.directory, SHARD_FILE.format(self.num_shards)), "wb")
+            self.num_shards += 1
+            self.offset = 0
+        self._file.write(array.tobytes())
+        start = self.offset
+        self.offset += array.nbytes
+        return self.num_shards - 1, start
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ShardReader:
+    """
+    Lazily memory-map the shards of `directory`. Mappings are not pickled, so the
+    reader can be sent to dataloader workers and each worker maps the files itself.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._shards = {}
+
+    def __getstate__(self):
+        return {"directory": self.directory, "_shards": {}}
+
+    def read(self, shard, offset, dtype, shape):
+        """
+        Returns:
+            np.ndarray: a read-only view into the mapped shard (no copy).
+        """
+        if shard not in self._shards:
+            path = os.path.join(self.directory, SHARD_FILE.format(shard))
+            self._shards[shard] = np.memmap(path, dtype=np.uint8, mode="r")
+        return np.ndarray(shape, dtype=dtype, buffer=self._shards[shard], offset=offset)
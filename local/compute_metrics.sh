@@ -3,7 +3,8 @@
 # LOCAL — Compute detection metrics
 #
 # Mirrors pando/compute_metrics.slurm.
-# Searches for predictions JSON inside the given run directory, then calls
+# Searches for predictions (detections/ directory, else JSON) inside the given
+# run directory, then calls
 # compute_metrics.py to produce AP tables, CSV, and confusion-matrix plots.
 #
 # Usage:
@@ -35,9 +36,15 @@ export ATRNET_DATA_DIR="$DATA_DIR"
 
 cd "$PROJECT_DIR"
 
-# --- Find predictions JSON ---
-# COCOEvaluator saves to: <output_dir>/inference/<dataset_name>/coco_eval_instances_results.json
-PRED_FILE=$(find "${OUTPUT_RUN}/inference" -name "coco_eval_instances_results.json" 2>/dev/null | head -1)
+# --- Find predictions ---
+# COCOEvaluator saves to: <output_dir>/inference/<dataset_name>/detections/ (binary, preferred)
+# and/or <output_dir>/inference/<dataset_name>/coco_eval_instances_results.json
+PRED_FILE=$(find "${OUTPUT_RUN}/inference" -path "*/detections/index.npz" 2>/dev/null | head -1)
+if [ -n "$PRED_FILE" ]; then
+    PRED_FILE=$(dirname "$PRED_FILE")
+else
+    PRED_FILE=$(find "${OUTPUT_RUN}/inference" -name "coco_eval_instances_results.json" 2>/dev/null | head -1)
+fi
 
 if [ -z "$PRED_FILE" ]; then
     echo "ERROR: Predictions file not found under ${OUTPUT_RUN}/inference/"
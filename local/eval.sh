@@ -1,10 +1,11 @@
 #!/bin/bash
 ###############################################################################
-# LOCAL — Eval-only: run inference and save predictions JSON
+# LOCAL — Eval-only: run inference and save predictions
 #
 # Runs --eval-only on the test set to produce:
+#   <output_dir>/inference/atrnet_star_test/detections/
 #   <output_dir>/inference/atrnet_star_test/coco_eval_instances_results.json
-# which is then consumed by compute_metrics.sh.
+# which are then consumed by compute_metrics.sh (the binary detections/ first).
 #
 # Usage:
 #   cd /media/alexandre/E6AE9051AE901BDD/PIE\ Code/ATR/ATR-Segmentation/DiffDet4SAR
@@ -73,6 +74,8 @@ python train_net.py \
     MODEL.WEIGHTS "$WEIGHTS" \
     OUTPUT_DIR "$OUTPUT_RUN" \
     INPUT.MIN_SIZE_TEST 800 \
+    TEST.SAVE_DETECTIONS True \
+    TEST.SAVE_COCO_JSON True \
     2>&1 | tee "${OUTPUT_RUN}/eval.log"
 
 echo ""
@@ -81,6 +84,7 @@ echo " Eval Complete! $(date)"
 echo "=============================================="
 echo ""
 echo "Predictions saved to:"
+echo "  ${OUTPUT_RUN}/inference/*/detections/"
 echo "  ${OUTPUT_RUN}/inference/*/coco_eval_instances_results.json"
 echo ""
 echo "Now run:  bash local/compute_metrics.sh $OUTPUT_RUN"
@@ -8,6 +8,10 @@
 # Usage:
 #   cd /media/alexandre/E6AE9051AE901BDD/PIE\ Code/ATR/ATR-Segmentation/DiffDet4SAR
 #   bash local/train_military_finetune.sh
+#
+# Head-only fine-tuning from a frozen-backbone feature cache (much faster,
+# backbone and CPDC stay fixed; the cache is built once per checkpoint):
+#   USE_FEATURE_CACHE=1 bash local/train_military_finetune.sh
 ###############################################################################
 
 set -e
@@ -57,6 +61,19 @@ fi
 echo ">>> Using checkpoint: $LATEST_CKPT"
 echo ""
 
+CACHE_OPTS=()
+if [ "${USE_FEATURE_CACHE:-0}" = "1" ]; then
+    CACHE_DIR="output_military_finetune/feature_cache"
+    echo ">>> Building feature cache in ${CACHE_DIR} (skipped if up to date)..."
+    python tools/build_feature_cache.py \
+        --config-file configs/diffdet.atrnet.military.yaml \
+        MODEL.WEIGHTS "${LATEST_CKPT}" \
+        FEATURE_CACHE.DIR "${CACHE_DIR}" \
+        INPUT.MIN_SIZE_TRAIN "(640,800)"
+    CACHE_OPTS=(FEATURE_CACHE.ENABLED True FEATURE_CACHE.DIR "${CACHE_DIR}")
+    echo ""
+fi
+
 # RTX 3070 (8 GB): batch=2, proposals=300, reduced resolution.
 # Fewer iterations than PANDO since fine-tuning converges faster.
 python train_net.py \
@@ -72,6 +89,7 @@ python train_net.py \
     SOLVER.MAX_ITER 30000 \
     SOLVER.STEPS "(20000,26000)" \
     SOLVER.CHECKPOINT_PERIOD 5000 \
+    "${CACHE_OPTS[@]}" \
     2>&1 | tee output_military_finetune/training.log
 
 echo ""
@@ -8,7 +8,8 @@ vehicle categories, and writes:
   <annotation_dir>/test_military.json
 
 These filtered files share the same image directory as SOC_50classes so no
-copying of images is required.
+copying of images is required. All fields of the kept categories, images and
+annotations (e.g. segmentations, custom attributes) are written unchanged.
 
 Usage:
   python prepare_military_dataset.py
@@ -18,6 +19,7 @@ Usage:
 import argparse
 import json
 import os
+from collections import Counter
 from pathlib import Path
 
 MILITARY_NAMES = {
@@ -45,13 +47,13 @@ def filter_split(src_json: Path, dst_json: Path) -> None:
     img_ids_with_ann = {a["image_id"] for a in mil_anns}
     mil_imgs = [img for img in data["images"] if img["id"] in img_ids_with_ann]
 
-    out = {
-        "info":        data.get("info", {}),
-        "licenses":    data.get("licenses", []),
-        "categories":  mil_cats,
-        "images":      mil_imgs,
-        "annotations": mil_anns,
-    }
+    # Any other top-level field (info, licenses, ...) is carried over as is.
+    out = {k: v for k, v in data.items() if k not in ("categories", "images", "annotations")}
+    out.setdefault("info", {})
+    out.setdefault("licenses", [])
+    out["categories"]  = mil_cats
+    out["images"]      = mil_imgs
+    out["annotations"] = mil_anns
 
     dst_json.parent.mkdir(parents=True, exist_ok=True)
     with open(dst_json, "w") as f:
@@ -61,11 +63,8 @@ def filter_split(src_json: Path, dst_json: Path) -> None:
     print(f"           {len(mil_cats)} categories | "
           f"{len(mil_imgs)} images | "
           f"{len(mil_anns)} annotations")
-    ann_by_class = {}
-    for a in mil_anns:
-        cid = a["category_id"]
-        name = next(c["name"] for c in mil_cats if c["id"] == cid)
-        ann_by_class[name] = ann_by_class.get(name, 0) + 1
+    names = {c["id"]: c["name"] for c in mil_cats}
+    ann_by_class = Counter(names[a["category_id"]] for a in mil_anns)
     for name in sorted(ann_by_class):
         print(f"    {name:<12}: {ann_by_class[name]}")
 
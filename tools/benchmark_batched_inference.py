@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measure DiffusionDet inference throughput (images / s) for several test batch
+sizes (TEST.IMS_PER_BATCH) on a synthetic dataset of random images with random
+sizes. The model is randomly initialized: only speed is measured.
+
+For batch sizes > 1, images are ordered by size like the test loader does
+(InferenceSampler sort keys); --no-sort feeds them in random order instead, to
+show the padding this saves. Only the backbone runs on whole batches unless
+MODEL.DiffusionDet.BATCHED_SAMPLING is set.
+
+Example (CPU):
+    python tools/benchmark_batched_inference.py --config-file configs/diffdet.atrnet.res50.yaml \\
+        --batch-sizes 1 4 8 --num-images 64 MODEL.DEVICE cpu
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+
+
+def synthetic_inputs(num_images, min_size, max_size, seed=0):
+    rng = np.random.default_rng(seed)
+    inputs = []
+    for i in range(num_images):
+        h, w = rng.integers(min_size, max_size + 1, size=2)
+        image = torch.from_numpy(rng.integers(0, 256, size=(3, h, w), dtype=np.uint8))
+        inputs.append({"image": image, "height": int(h), "width": int(w), "image_id": i})
+    return inputs
+
+
+def run(model, inputs, batch_size, sort, warmup=2):
+    if sort and batch_size > 1:
+        # same key as the test loader's InferenceSampler
+        order = sorted(range(len(inputs)), key=lambda i: (inputs[i]["width"] > inputs[i]["height"],
+                                                          inputs[i]["width"] * inputs[i]["height"]))
+    else:
+        order = np.random.default_rng(1).permutation(len(inputs)).tolist()
+    batches = [[inputs[i] for i in order[k:k + batch_size]] for k in range(0, len(order), batch_size)]
+    padded = sum(len(b) * max(x["height"] for x in b) * max(x["width"] for x in b) for b in batches)
+    valid = sum(x["height"] * x["width"] for x in inputs)
+
+    with torch.no_grad():
+        for batch in batches[:warmup]:
+            model(batch)
+        start = time.perf_counter()
+        for batch in batches:
+            model(batch)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+    return len(inputs) / elapsed, 1.0 - valid / padded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--num-images", type=int, default=64)
+    parser.add_argument("--min-size", type=int, default=96)
+    parser.add_argument("--max-size", type=int, default=192)
+    parser.add_argument("--no-sort", action="store_true", help="do not order images by size")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    torch.manual_seed(0)
+    model = build_model(cfg)
+    model.eval()
+
+    inputs = synthetic_inputs(args.num_images, args.min_size, args.max_size)
+    print("{} synthetic images of {}-{} px on {}".format(
+        args.num_images, args.min_size, args.max_size, cfg.MODEL.DEVICE))
+    print("{:>10} {:>12} {:>10} {:>9}".format("batch", "images/s", "speedup", "padding"))
+    base = None
+    for batch_size in args.batch_sizes:
+        throughput, padding = run(model, inputs, batch_size, sort=not args.no_sort)
+        base = base or throughput
+        print("{:>10} {:>12.2f} {:>9.2f}x {:>8.1%}".format(batch_size, throughput, throughput / base, padding))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Measure peak memory and step time of DiffusionDet training with and without
+activation checkpointing.
+
+Runs a few training steps on synthetic SAR-sized images for every checkpointing
+setting and prints one line per setting. Peak memory is only reported on CUDA;
+"saved MiB" (activations kept for backward, counted with saved-tensor hooks) is
+reported on every device.
+
+Example:
+    python tools/benchmark_checkpointing.py --config-file configs/diffdet.atrnet.res50.yaml \\
+        --batch-size 2 --num-proposals 500 --image-size 800
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+from detectron2.structures import Boxes, Instances  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+
+# (name, MODEL.DiffusionDet.CHECKPOINT_HEADS, MODEL.RESNETS.CHECKPOINT_STAGES, MODEL.FPN.USE_CHECKPOINT)
+SETTINGS = [
+    ("none", [], [], False),
+    ("heads", [0, 1, 2, 3, 4, 5], [], False),
+    ("heads+fpn", [0, 1, 2, 3, 4, 5], [], True),
+    ("heads+fpn+backbone", [0, 1, 2, 3, 4, 5], ["res2", "res3", "res4", "res5"], True),
+]
+
+
+def synthetic_batch(batch_size, image_size, num_boxes, num_classes, device):
+    batch = []
+    for _ in range(batch_size):
+        image = torch.randint(0, 255, (3, image_size, image_size), dtype=torch.uint8)
+        xy = torch.rand(num_boxes, 2) * image_size * 0.8
+        wh = torch.rand(num_boxes, 2) * image_size * 0.2 + 8
+        instances = Instances((image_size, image_size))
+        instances.gt_boxes = Boxes(torch.cat([xy, xy + wh], dim=1))
+        instances.gt_classes = torch.randint(0, num_classes, (num_boxes,))
+        batch.append({"image": image, "instances": instances, "height": image_size, "width": image_size})
+    return batch
+
+
+def saved_activation_bytes(model, batch):
+    """
+    Bytes of the distinct non-parameter tensors that autograd keeps for backward in one
+    forward pass. Tensors saved inside a checkpointed region are not kept, so they are not counted.
+    """
+    seen = {}
+
+    def pack(tensor):
+        if not isinstance(tensor, torch.nn.Parameter):
+            seen[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        losses = sum(model(batch).values())
+    del losses
+    return sum(seen.values())
+
+
+def run_setting(cfg, args):
+    model = build_model(cfg)
+    model.train()
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    batch = synthetic_batch(args.batch_size, args.image_size, args.num_boxes,
+                            cfg.MODEL.DiffusionDet.NUM_CLASSES, cfg.MODEL.DEVICE)
+    cuda = cfg.MODEL.DEVICE.startswith("cuda")
+
+    times = []
+    for it in range(args.warmup + args.iters):
+        if cuda:
+            torch.cuda.synchronize()
+            if it == args.warmup:
+                torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        losses = sum(model(batch).values())
+        optimizer.zero_grad()
+        losses.backward()
+        optimizer.step()
+        if cuda:
+            torch.cuda.synchronize()
+        if it >= args.warmup:
+            times.append(time.perf_counter() - start)
+
+    peak = torch.cuda.max_memory_allocated() / 1024 ** 2 if cuda else float("nan")
+    saved = saved_activation_bytes(model, batch) / 1024 ** 2
+    del model, optimizer
+    if cuda:
+        torch.cuda.empty_cache()
+    return peak, saved, sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--num-proposals", type=int, default=500)
+    parser.add_argument("--image-size", type=int, default=800)
+    parser.add_argument("--num-boxes", type=int, default=4, help="GT boxes per synthetic image")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    print(f"{'setting':<22}{'peak MiB':>12}{'saved MiB':>12}{'step s':>10}")
+    for name, heads, stages, fpn in SETTINGS:
+        cfg = get_cfg()
+        add_diffusiondet_config(cfg)
+        add_model_ema_configs(cfg)
+        cfg.merge_from_file(args.config_file)
+        cfg.merge_from_list(args.opts)
+        cfg.MODEL.WEIGHTS = ""
+        cfg.MODEL.DiffusionDet.NUM_PROPOSALS = args.num_proposals
+        cfg.MODEL.DiffusionDet.CHECKPOINT_HEADS = heads
+        cfg.MODEL.RESNETS.CHECKPOINT_STAGES = stages
+        cfg.MODEL.FPN.USE_CHECKPOINT = fpn
+        cfg.freeze()
+        peak, saved, step = run_setting(cfg, args)
+        print(f"{name:<22}{peak:>12.0f}{saved:>12.0f}{step:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
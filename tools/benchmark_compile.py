@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Report torch.compile cost and benefit for DiffusionDet: time of the first
+(compiling) iteration and steady-state time per iteration, eager vs compiled.
+
+Example:
+    python tools/benchmark_compile.py --config-file configs/diffdet.atrnet.res50.yaml --mode inference
+    python tools/benchmark_compile.py --config-file configs/diffdet.atrnet.res50.yaml --mode train
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.engine import maybe_compile_model  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+from detectron2.structures import Boxes, Instances  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+
+
+def synthetic_batch(batch_size, image_size, num_classes):
+    batch = []
+    for _ in range(batch_size):
+        instances = Instances((image_size, image_size))
+        xy = torch.rand(4, 2) * image_size * 0.8
+        instances.gt_boxes = Boxes(torch.cat([xy, xy + image_size * 0.1], dim=1))
+        instances.gt_classes = torch.randint(0, num_classes, (4,))
+        batch.append({
+            "image": torch.randint(0, 255, (3, image_size, image_size), dtype=torch.uint8),
+            "instances": instances,
+            "height": image_size,
+            "width": image_size,
+        })
+    return batch
+
+
+def run(cfg, args):
+    model = maybe_compile_model(cfg, build_model(cfg))
+    batch = synthetic_batch(args.batch_size, args.image_size, cfg.MODEL.DiffusionDet.NUM_CLASSES)
+    cuda = cfg.MODEL.DEVICE.startswith("cuda")
+    if args.mode == "train":
+        model.train()
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    else:
+        model.eval()
+
+    def step():
+        if args.mode == "train":
+            losses = sum(model(batch).values())
+            optimizer.zero_grad()
+            losses.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad():
+                model(batch)
+        if cuda:
+            torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    step()
+    first = time.perf_counter() - start
+    for _ in range(args.warmup):
+        step()
+    start = time.perf_counter()
+    for _ in range(args.iters):
+        step()
+    return first, (time.perf_counter() - start) / args.iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--mode", choices=["inference", "train"], default="inference")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--image-size", type=int, default=800)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    results = {}
+    for compiled in (False, True):
+        cfg = get_cfg()
+        add_diffusiondet_config(cfg)
+        add_model_ema_configs(cfg)
+        cfg.merge_from_file(args.config_file)
+        cfg.merge_from_list(args.opts)
+        cfg.MODEL.WEIGHTS = ""
+        cfg.MODEL.COMPILE.ENABLED = compiled
+        cfg.freeze()
+        results[compiled] = run(cfg, args)
+        name = "compiled" if compiled else "eager"
+        print(f"{name:<10} first iteration {results[compiled][0]:8.2f} s   "
+              f"steady state {results[compiled][1] * 1000:8.1f} ms/iter")
+    print(f"steady-state speedup: {results[False][1] / results[True][1]:.2f}x, "
+          f"compile overhead: {results[True][0] - results[False][0]:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compare data loading throughput of DiffusionDetDatasetMapper when images are
+decoded from files vs. read from the packed image store, for several numbers
+of dataloader workers. Reports samples/sec and samples/sec per worker.
+
+Pack the store first with tools/pack_image_store.py.
+
+Example:
+    python tools/benchmark_image_store.py --config-file configs/diffdet.atrnet.res50.yaml --workers 0 1 4 8
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.data import DatasetFromList, MapDataset, get_detection_dataset_dicts  # noqa: E402
+from detectron2.data.benchmark import iter_benchmark  # noqa: E402
+from detectron2.data.build import build_batch_data_loader  # noqa: E402
+from detectron2.data.samplers import TrainingSampler  # noqa: E402
+
+from diffusiondet import DiffusionDetDatasetMapper, add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+import diffusiondet.register_atrnet  # noqa: E402,F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 4])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--iters", type=int, default=100, help="batches per worker")
+    parser.add_argument("--max-time", type=float, default=60, help="seconds per measurement")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+
+    dataset = DatasetFromList(get_detection_dataset_dicts(cfg.DATASETS.TRAIN), copy=False)
+    sampler = TrainingSampler(len(dataset))
+
+    results = {}
+    for source in ("files", "image store"):
+        cfg.defrost()
+        cfg.INPUT.IMAGE_STORE = source == "image store"
+        cfg.freeze()
+        mapper = DiffusionDetDatasetMapper(cfg, is_train=True)
+        if cfg.INPUT.IMAGE_STORE and not mapper.image_stores:
+            sys.exit("No image store registered for {}; run tools/pack_image_store.py".format(cfg.DATASETS.TRAIN))
+        for n in args.workers:
+            loader = build_batch_data_loader(
+                MapDataset(dataset, mapper), sampler, args.batch_size, num_workers=n
+            )
+            avg, _ = iter_benchmark(loader, args.iters * max(n, 1), 5 * max(n, 1), args.max_time)
+            samples_per_sec = args.batch_size / avg
+            results[source, n] = samples_per_sec
+            print(f"{source:<12} workers={n:<3} {samples_per_sec:9.1f} samples/s  "
+                  f"{samples_per_sec / max(n, 1):8.1f} samples/s/worker")
+            del loader
+
+    for n in args.workers:
+        print(f"workers={n:<3} speedup {results['image store', n] / results['files', n]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Compare per-sample time of DiffusionDetDatasetMapper with the previous
+implementation (deep copy of the record + per-annotation transforms).
+
+With --skip-decode every sample reuses one decoded image, so the numbers show
+the record/annotation handling and the augmentation only.
+
+Example:
+    python tools/benchmark_mapper.py --config-file configs/diffdet.atrnet.res50.yaml --num-samples 2000 --skip-decode
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.data import detection_utils as utils  # noqa: E402
+from detectron2.data import get_detection_dataset_dicts  # noqa: E402
+from detectron2.data import transforms as T  # noqa: E402
+
+from diffusiondet import DiffusionDetDatasetMapper, add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+import diffusiondet.register_atrnet  # noqa: E402,F401
+
+
+class DeepCopyDatasetMapper(DiffusionDetDatasetMapper):
+    """The mapper as it was before records were treated as read-only."""
+
+    def __call__(self, dataset_dict):
+        dataset_dict = copy.deepcopy(dataset_dict)
+        image = self._read_image(dataset_dict["file_name"])
+        utils.check_image_size(dataset_dict, image)
+        if self.crop_gen is None or np.random.rand() > 0.5:
+            image, transforms = T.apply_transform_gens(self.tfm_gens, image)
+        else:
+            image, transforms = T.apply_transform_gens(self.tfm_gens[:-1] + self.crop_gen + self.tfm_gens[-1:], image)
+        image_shape = image.shape[:2]
+        dataset_dict["image"] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        for anno in dataset_dict["annotations"]:
+            anno.pop("segmentation", None)
+            anno.pop("keypoints", None)
+        annos = [
+            utils.transform_instance_annotations(obj, transforms, image_shape)
+            for obj in dataset_dict.pop("annotations")
+            if obj.get("iscrowd", 0) == 0
+        ]
+        instances = utils.annotations_to_instances(annos, image_shape)
+        dataset_dict["instances"] = utils.filter_empty_instances(instances)
+        return dataset_dict
+
+
+def time_mapper(mapper, dataset_dicts, num_samples):
+    np.random.seed(0)
+    start = time.perf_counter()
+    for i in range(num_samples):
+        mapper(dataset_dicts[i % len(dataset_dicts)])
+    return (time.perf_counter() - start) / num_samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--num-samples", type=int, default=1000)
+    parser.add_argument("--skip-decode", action="store_true", help="reuse one decoded image for all samples")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.freeze()
+
+    dataset_dicts = get_detection_dataset_dicts(cfg.DATASETS.TRAIN, filter_empty=True)
+    results = {}
+    for name, cls in [("deepcopy", DeepCopyDatasetMapper), ("copy-free", DiffusionDetDatasetMapper)]:
+        mapper = cls(cfg, is_train=True)
+        if args.skip_decode:
+            image = mapper._read_image(dataset_dicts[0]["file_name"])
+            mapper._read_image = lambda file_name: image
+            records = [dict(d, height=image.shape[0], width=image.shape[1]) for d in dataset_dicts]
+        else:
+            records = dataset_dicts
+        time_mapper(mapper, records, min(20, args.num_samples))  # warmup
+        results[name] = time_mapper(mapper, records, args.num_samples)
+        print(f"{name:<10} {results[name] * 1e3:8.3f} ms/sample")
+    print(f"speedup: {results['deepcopy'] / results['copy-free']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
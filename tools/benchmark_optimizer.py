@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Compare optimizer-step time of the old per-parameter AdamW setup with the
+grouped foreach/fused setup of ``Trainer.build_optimizer``.
+
+Gradients are filled with random values once; only ``optimizer.step()``
+(including full-model gradient clipping) is timed.
+
+Example:
+    python tools/benchmark_optimizer.py --config-file configs/diffdet.atrnet.res50.yaml MODEL.DEVICE cpu
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+from train_net import Trainer  # noqa: E402
+
+
+def build_per_parameter_optimizer(cfg, model):
+    """The optimizer as built before param groups were merged."""
+    params = []
+    for key, value in model.named_parameters(recurse=True):
+        if not value.requires_grad:
+            continue
+        lr = cfg.SOLVER.BASE_LR
+        if "backbone" in key:
+            lr = lr * cfg.SOLVER.BACKBONE_MULTIPLIER
+        params += [{"params": [value], "lr": lr, "weight_decay": cfg.SOLVER.WEIGHT_DECAY}]
+    clip_norm_val = cfg.SOLVER.CLIP_GRADIENTS.CLIP_VALUE
+
+    class FullModelGradientClippingOptimizer(torch.optim.AdamW):
+        def step(self, closure=None):
+            all_params = itertools.chain(*[x["params"] for x in self.param_groups])
+            torch.nn.utils.clip_grad_norm_(all_params, clip_norm_val)
+            super().step(closure=closure)
+
+    return FullModelGradientClippingOptimizer(params, cfg.SOLVER.BASE_LR)
+
+
+def time_steps(optimizer, warmup, iters):
+    cuda = any(p.is_cuda for g in optimizer.param_groups for p in g["params"])
+    for _ in range(warmup):
+        optimizer.step()
+    if cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iters):
+        optimizer.step()
+    if cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.MODEL.WEIGHTS = ""
+    cfg.freeze()
+
+    model = build_model(cfg)
+    for p in model.parameters():
+        if p.requires_grad:
+            p.grad = torch.randn_like(p)
+
+    for name, builder in [("per-parameter groups", build_per_parameter_optimizer),
+                          ("grouped (build_optimizer)", Trainer.build_optimizer)]:
+        optimizer = builder(cfg, model)
+        step = time_steps(optimizer, args.warmup, args.iters)
+        print(f"{name:<28} groups={len(optimizer.param_groups):<5} step={step * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
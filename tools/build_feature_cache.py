@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Precompute the P2-P5 features (after CPDC) of the training split into a
+feature cache for head-only fine-tuning (see diffusiondet/feature_cache.py).
+
+The cache is skipped if it already exists and matches MODEL.WEIGHTS, the
+dataset and the cached variants.
+
+Example:
+    python tools/build_feature_cache.py --config-file configs/diffdet.atrnet.military.yaml \\
+        MODEL.WEIGHTS output_atrnet_star_pando/model_final.pth \\
+        FEATURE_CACHE.DIR feature_cache_military INPUT.MIN_SIZE_TRAIN "(640,800)"
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.checkpoint import DetectionCheckpointer  # noqa: E402
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.data import get_detection_dataset_dicts  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+from detectron2.utils.logger import setup_logger  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.feature_cache import FeatureCache, build_feature_cache, cache_variants  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+import diffusiondet.register_atrnet  # noqa: E402,F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", required=True)
+    parser.add_argument("--force", action="store_true", help="rebuild even if a valid cache exists")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    setup_logger(name="diffusiondet")
+    logger = setup_logger()
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.freeze()
+    assert cfg.FEATURE_CACHE.DIR, "FEATURE_CACHE.DIR must be set"
+
+    dataset_dicts = get_detection_dataset_dicts(
+        cfg.DATASETS.TRAIN, filter_empty=cfg.DATALOADER.FILTER_EMPTY_ANNOTATIONS
+    )
+    if not args.force:
+        try:
+            FeatureCache(cfg.FEATURE_CACHE.DIR).validate(cfg, dataset_dicts)
+            logger.info("Feature cache {} is up to date".format(cfg.FEATURE_CACHE.DIR))
+            return
+        except (FileNotFoundError, ValueError) as e:
+            logger.info(str(e))
+
+    logger.info("Caching {} images x {} variants (scale, flip): {}".format(
+        len(dataset_dicts), len(cache_variants(cfg)), cache_variants(cfg)))
+    model = build_model(cfg)
+    DetectionCheckpointer(model).load(cfg.MODEL.WEIGHTS)
+    build_feature_cache(cfg, model, dataset_dicts, cfg.FEATURE_CACHE.DIR)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
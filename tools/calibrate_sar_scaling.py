@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Calibrate INPUT.SAR_SCALING.RANGE from percentiles of a random sample of
+training images (see diffusiondet/sar_scaling.py) and print the config options
+to train with.
+
+Example:
+    ATRNET_IMAGE_PRODUCT=Amplitude_float python tools/calibrate_sar_scaling.py \\
+        --config-file configs/diffdet.atrnet.res50.yaml --num-images 500 --percentiles 0.5 99.5
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.data import get_detection_dataset_dicts  # noqa: E402
+from detectron2.data.detection_utils import ImageReader  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.sar_scaling import calibrate_sar_range  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+import diffusiondet.register_atrnet  # noqa: E402,F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml")
+    parser.add_argument("--num-images", type=int, default=500)
+    parser.add_argument("--percentiles", type=float, nargs=2, default=[1.0, 99.0])
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+
+    dataset_dicts = get_detection_dataset_dicts(cfg.DATASETS.TRAIN, filter_empty=False)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(dataset_dicts), min(args.num_images, len(dataset_dicts)), replace=False)
+    # identity transform: keep the stored values; "BGR" leaves the channels as decoded
+    reader = ImageReader("BGR", intensity_transform=lambda image: image)
+    images = (reader(dataset_dicts[i]["file_name"]) for i in sample)
+
+    mode, power = cfg.INPUT.SAR_SCALING.MODE, cfg.INPUT.SAR_SCALING.POWER
+    low, high = calibrate_sar_range(images, mode=mode, power=power, percentiles=args.percentiles)
+    print(f"Calibrated on {len(sample)} images: p{args.percentiles[0]:g}={low:.3f} p{args.percentiles[1]:g}={high:.3f}")
+    print(f'INPUT.SAR_SCALING.ENABLED True INPUT.SAR_SCALING.MODE {mode} '
+          f'INPUT.SAR_SCALING.POWER {power} INPUT.SAR_SCALING.RANGE "({low:.3f}, {high:.3f})"')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Convert detections between the binary detections format written by COCOEvaluator
+with TEST.SAVE_DETECTIONS (a detections/ directory of .npy columns, see
+detectron2/evaluation/detection_store.py) and a COCO results json, for tools
+that only read the json (e.g. the COCO API or external leaderboards).
+
+The direction follows the input: a detections/ directory is exported to json,
+a json is converted to a detections/ directory. The json is written in chunks,
+without building the list of result dicts of all detections.
+
+Example:
+    python tools/convert_detections.py output/inference/atrnet_star_test/detections \\
+        output/inference/atrnet_star_test/coco_eval_instances_results.json
+    python tools/convert_detections.py results.json results_detections/
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.evaluation.detection_store import (  # noqa: E402
+    DetectionReader,
+    detections_to_coco_json,
+    save_detections,
+)
+from detectron2.utils.file_io import PathManager  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="detections/ directory or COCO results json")
+    parser.add_argument("output", help="COCO results json or detections/ directory")
+    args = parser.parse_args()
+
+    reader = DetectionReader(args.input)
+    if os.path.isdir(args.input):
+        with PathManager.open(args.output, "w") as f:
+            detections_to_coco_json(reader, f)
+    else:
+        save_detections(args.output, reader)
+    print("Converted {} detections of {} images to {}".format(len(reader), len(reader.image_ids), args.output))
+
+
+if __name__ == "__main__":
+    main()
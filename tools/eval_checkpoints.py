@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Evaluate several checkpoints of a run on the test sets (cfg.DATASETS.TEST) while
+decoding each test image once, and print one table of the results.
+
+Checkpoints are evaluated --models-per-pass at a time (default: all of them);
+each pass reads the test loader once and runs every checkpoint of the pass on
+each batch. The weights are either held side by side on the device (one model
+per checkpoint), or, with --swap, kept in pinned host memory and copied into a
+single model for every batch. Checkpoints with the same backbone and CPDC
+weights (e.g. head-only fine-tuning from a feature cache) share one feature
+extraction per batch. With MODEL_EMA.ENABLED the EMA weights are evaluated,
+like train_net.py --eval-only.
+
+Each checkpoint writes its evaluator outputs to OUTPUT_DIR/inference/<checkpoint>/
+(the file name, preceded by parent directories if other checkpoints have the same
+file name), and the table is saved to OUTPUT_DIR/inference/eval_checkpoints.json.
+
+Example:
+    python tools/eval_checkpoints.py --config-file configs/diffdet.atrnet.res50.yaml \\
+        --run-dir output_atrnet_star OUTPUT_DIR output_atrnet_star
+    python tools/eval_checkpoints.py --config-file configs/diffdet.atrnet.res50.yaml --swap \\
+        --checkpoint output_atrnet_star/model_0044999.pth --checkpoint output_atrnet_star/model_final.pth \\
+        OUTPUT_DIR output_atrnet_star
+"""
+
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, OrderedDict
+
+import torch
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import detectron2.utils.comm as comm  # noqa: E402
+from detectron2.checkpoint import DetectionCheckpointer  # noqa: E402
+from detectron2.engine import default_argument_parser, launch, maybe_compile_model  # noqa: E402
+from detectron2.evaluation.evaluator import inference_context  # noqa: E402
+from detectron2.modeling import build_model  # noqa: E402
+from detectron2.utils.file_io import PathManager  # noqa: E402
+from detectron2.utils.logger import log_every_n_seconds  # noqa: E402
+
+from diffusiondet.util.model_ema import (  # noqa: E402
+    EMADetectionCheckpointer,
+    EMAState,
+    apply_model_ema_and_restore,
+    may_get_ema_checkpointer,
+)
+from train_net import Trainer, setup  # noqa: E402
+
+logger = logging.getLogger("detectron2.eval_checkpoints")
+
+_METRICS = ["AP", "AP50", "AP75", "APs", "APm", "APl"]
+
+
+def find_checkpoints(run_dir):
+    """
+    Returns:
+        list[str]: the model_*.pth files of a training run, in iteration order
+        (model_final.pth last).
+    """
+    paths = sorted(glob.glob(os.path.join(run_dir, "model_*.pth")))
+    return sorted(paths, key=lambda p: os.path.basename(p) == "model_final.pth")
+
+
+def checkpoint_names(paths):
+    """
+    Returns:
+        list[str]: a unique name per checkpoint: its file name without extension,
+        preceded by as many parent directories as needed to tell checkpoints with
+        the same file name apart (e.g. "run_a/model_final").
+    """
+    parts = [os.path.splitext(os.path.abspath(p))[0].split(os.sep)[1:] for p in paths]
+    depth = [1] * len(paths)
+    while True:
+        names = ["/".join(p[-d:]) for p, d in zip(parts, depth)]
+        counts = Counter(names)
+        clashes = [i for i, name in enumerate(names) if counts[name] > 1 and depth[i] < len(parts[i])]
+        if not clashes:
+            break
+        for i in clashes:
+            depth[i] += 1
+    assert len(set(names)) == len(names), "Checkpoint names are not unique: {}".format(names)
+    return names
+
+
+def load_snapshots(cfg, model, paths, pin_memory=False):
+    """
+    Load each checkpoint into `model` in turn and keep the weights that are
+    evaluated (the EMA weights with MODEL_EMA.ENABLED).
+
+    Returns:
+        list[EMAState]: parameters and buffers of each checkpoint, in host memory.
+    """
+    kwargs = may_get_ema_checkpointer(cfg, model)
+    checkpointer_cls = EMADetectionCheckpointer if cfg.MODEL_EMA.ENABLED else DetectionCheckpointer
+    checkpointer = checkpointer_cls(model, save_dir=cfg.OUTPUT_DIR, **kwargs)
+    snapshots = []
+    for path in paths:
+        checkpointer.resume_or_load(path, resume=False)
+        if cfg.MODEL_EMA.ENABLED:
+            with apply_model_ema_and_restore(model):
+                state = EMAState.FromModel(model, "cpu")
+        else:
+            state = EMAState.FromModel(model, "cpu")
+        if pin_memory and torch.cuda.is_available():
+            state.state = {k: v.pin_memory() for k, v in state.state.items()}
+        snapshots.append(state)
+    if cfg.MODEL_EMA.ENABLED:
+        # the EMA weights of the last checkpoint are not needed any more
+        model.ema_state.clear()
+    return snapshots
+
+
+def feature_groups(model, snapshots):
+    """
+    Group checkpoints whose :attr:`DiffusionDet.feature_modules` weights are equal,
+    so their features are only extracted once per batch.
+
+    Returns:
+        list[list[int]]: indices into `snapshots`.
+    """
+    names = _feature_names(model, snapshots[0])
+    groups = []
+    for i, snapshot in enumerate(snapshots):
+        for group in groups:
+            lead = snapshots[group[0]].state
+            if all(torch.equal(snapshot.state[k], lead[k]) for k in names):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+    return groups
+
+
+def _feature_names(model, snapshot):
+    prefixes = tuple(m + "." for m in model.feature_modules)
+    return [k for k in snapshot.state if k.startswith(prefixes)]
+
+
+class _WeightSwapper:
+    """
+    Copies the feature (backbone, CPDC) and head weights of snapshots into one
+    model, skipping a copy when the model already holds those weights.
+    """
+
+    def __init__(self, model, snapshots):
+        feature_names = set(_feature_names(model, snapshots[0]))
+        tensors = OrderedDict(EMAState().get_model_state_iterator(model))
+        self.model = model
+        self.snapshots = snapshots
+        self.parts = {
+            "features": [(t, k) for k, t in tensors.items() if k in feature_names],
+            "head": [(t, k) for k, t in tensors.items() if k not in feature_names],
+        }
+        self.loaded = {"features": None, "head": None}
+
+    def load(self, index, part):
+        if self.loaded[part] == index:
+            return self.model
+        state = self.snapshots[index].state
+        with torch.no_grad():
+            for tensor, name in self.parts[part]:
+                tensor.copy_(state[name], non_blocking=True)
+        self.loaded[part] = index
+        return self.model
+
+
+def evaluate_pass(cfg, models, snapshots, names, swap):
+    """
+    Run the checkpoints of one pass on every test set, reading each test loader once.
+
+    Args:
+        models (list[nn.Module]): one model per checkpoint with its weights
+            applied or, with `swap`, a single model.
+        snapshots (list[EMAState]): weights of the checkpoints.
+        names (list[str]): checkpoint names, used for the output folders.
+
+    Returns:
+        list[OrderedDict]: results of each checkpoint, keyed by dataset name.
+    """
+    groups = feature_groups(models[0], snapshots)
+    logger.info(
+        "Evaluating {} checkpoints ({} distinct backbones) {}.".format(
+            len(names), len(groups), "swapping weights" if swap else "side by side"
+        )
+    )
+    swapper = _WeightSwapper(models[0], snapshots) if swap else None
+    results = [OrderedDict() for _ in names]
+    for dataset_name in cfg.DATASETS.TEST:
+        data_loader = Trainer.build_test_loader(cfg, dataset_name)
+        evaluators = [
+            Trainer.build_evaluator(cfg, dataset_name, output_folder=os.path.join(cfg.OUTPUT_DIR, "inference", name))
+            for name in names
+        ]
+        for evaluator in evaluators:
+            evaluator.reset()
+
+        total = len(data_loader)
+        start_time = time.perf_counter()
+        with torch.no_grad(), inference_context(models[0]):
+            for model in models[1:]:
+                model.eval()
+            for idx, inputs in enumerate(data_loader):
+                for group in groups:
+                    model = swapper.load(group[0], "features") if swap else models[group[0]]
+                    images, images_whwh, features = model.inference_features(inputs)
+                    for i in group:
+                        model = swapper.load(i, "head") if swap else models[i]
+                        outputs = model.ddim_sample(inputs, features, images_whwh, images)
+                        evaluators[i].process(inputs, outputs)
+                elapsed = time.perf_counter() - start_time
+                log_every_n_seconds(
+                    logging.INFO,
+                    "{}: batch {}/{}, {:.4f} s / batch for {} checkpoints. ETA={:.0f} s".format(
+                        dataset_name, idx + 1, total, elapsed / (idx + 1), len(names),
+                        elapsed / (idx + 1) * (total - idx - 1),
+                    ),
+                    n=5,
+                    name=logger.name,
+                )
+        logger.info(
+            "{}: {} checkpoints on {} batches in {:.1f} s".format(
+                dataset_name, len(names), total, time.perf_counter() - start_time
+            )
+        )
+        for result, evaluator in zip(results, evaluators):
+            result[dataset_name] = evaluator.evaluate()
+    return results
+
+
+def results_table(names, results):
+    rows = []
+    headers = ["checkpoint"]
+    for name, result in zip(names, results):
+        row = [name]
+        for dataset_name, res in result.items():
+            bbox = (res or {}).get("bbox", {})
+            row += [bbox.get(m, float("nan")) for m in _METRICS]
+            if len(rows) == 0:
+                prefix = dataset_name + " " if len(result) > 1 else ""
+                headers += [prefix + m for m in _METRICS]
+        rows.append(row)
+    return tabulate(rows, headers=headers, tablefmt="pipe", floatfmt=".3f", numalign="left")
+
+
+def main(args):
+    cfg = setup(args)
+    paths = list(args.checkpoints or []) + (find_checkpoints(args.run_dir) if args.run_dir else [])
+    # a checkpoint given twice (e.g. also found in --run-dir) is evaluated once
+    paths = list(OrderedDict((os.path.realpath(p), p) for p in paths).values())
+    assert paths, "No checkpoints to evaluate: pass --checkpoint or --run-dir."
+    names = checkpoint_names(paths)
+    per_pass = args.models_per_pass or len(paths)
+
+    model = Trainer.build_model(cfg)
+    results = []
+    for start in range(0, len(paths), per_pass):
+        snapshots = load_snapshots(cfg, model, paths[start : start + per_pass], pin_memory=args.swap)
+        if args.swap:
+            models = [model]
+        else:
+            # the other models only hold weights: no EMA state
+            models = [model] + [maybe_compile_model(cfg, build_model(cfg)) for _ in snapshots[1:]]
+            for m, snapshot in zip(models, snapshots):
+                snapshot.apply_to(m)
+        results += evaluate_pass(cfg, models, snapshots, names[start : start + per_pass], args.swap)
+        del models, snapshots
+
+    if comm.is_main_process():
+        table = results_table(names, results)
+        logger.info("Results of {} checkpoints:\n{}".format(len(names), table))
+        path = os.path.join(cfg.OUTPUT_DIR, "inference", "eval_checkpoints.json")
+        PathManager.mkdirs(os.path.dirname(path))
+        with PathManager.open(path, "w") as f:
+            json.dump(OrderedDict(zip(names, results)), f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = default_argument_parser(epilog=__doc__)
+    # repeated instead of nargs="+", which would also swallow the config options that follow
+    parser.add_argument(
+        "--checkpoint", action="append", dest="checkpoints", help="a checkpoint file to evaluate (repeatable)"
+    )
+    parser.add_argument("--run-dir", help="evaluate all model_*.pth files of this directory")
+    parser.add_argument(
+        "--models-per-pass", type=int, default=0, help="checkpoints evaluated per pass over the data; 0: all"
+    )
+    parser.add_argument(
+        "--swap", action="store_true", help="keep the weights in host memory and swap them into one model"
+    )
+    args = parser.parse_args()
+    args.eval_only = True
+    print("Command Line Args:", args)
+    launch(
+        main,
+        args.num_gpus,
+        num_machines=args.num_machines,
+        machine_rank=args.machine_rank,
+        dist_url=args.dist_url,
+        args=(args,),
+    )
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Pack the decoded images of registered datasets into a sharded image store
+(see diffusiondet/image_store.py). DiffusionDetDatasetMapper reads from the
+store automatically once it exists; re-run this after the images change.
+
+Stores are written to <ATRNET_IMAGE_STORE_DIR>/<dataset> (default:
+<ATRNET_DATA_DIR>/image_store/<dataset>) unless --output is given.
+
+Example:
+    python tools/pack_image_store.py --config-file configs/diffdet.atrnet.res50.yaml \\
+        --dataset atrnet_star_train atrnet_star_test
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.config import get_cfg  # noqa: E402
+from detectron2.data import DatasetCatalog  # noqa: E402
+from detectron2.utils.logger import setup_logger  # noqa: E402
+
+from diffusiondet import add_diffusiondet_config  # noqa: E402
+from diffusiondet.image_store import pack_image_store  # noqa: E402
+from diffusiondet.register_atrnet import image_store_dir  # noqa: E402
+from diffusiondet.sar_scaling import SARIntensityScaling  # noqa: E402
+from diffusiondet.util.model_ema import add_model_ema_configs  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", default="configs/diffdet.atrnet.res50.yaml",
+                        help="INPUT.FORMAT and INPUT.SAR_SCALING are used")
+    parser.add_argument("--dataset", nargs="+", required=True, help="registered dataset names")
+    parser.add_argument("--output", help="store directory (only with a single --dataset)")
+    parser.add_argument("--shard-size-mb", type=int, default=1024)
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    assert args.output is None or len(args.dataset) == 1, "--output needs a single --dataset"
+
+    setup_logger(name="diffusiondet")
+    cfg = get_cfg()
+    add_diffusiondet_config(cfg)
+    add_model_ema_configs(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+
+    scaling = SARIntensityScaling.from_config(cfg)
+    for name in args.dataset:
+        store_dir = args.output or image_store_dir(name)
+        pack_image_store(DatasetCatalog.get(name), store_dir, cfg.INPUT.FORMAT, args.shard_size_mb, scaling)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
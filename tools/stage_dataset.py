@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Stage an ATRNet-STAR split onto node-local disk (see diffusiondet/staging.py)
+and print the shell exports that point the training at the staged copy.
+Only files that are missing or changed since the last staging are copied.
+
+Example (in a slurm script, before train_net.py):
+    export ATRNET_STAGE_DIR=/local/scratch/$USER/atrnet   # optional, default $TMPDIR/atrnet-$USER
+    eval "$(python tools/stage_dataset.py --split SOC_50classes)"
+"""
+
+import argparse
+import contextlib
+import os
+import shlex
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--split", default="SOC_50classes")
+    parser.add_argument("--output", help="staging directory (default: $ATRNET_STAGE_DIR or $TMPDIR/atrnet-$USER)")
+    parser.add_argument("--images", choices=["auto", "files", "store"], default="files",
+                        help="stage the image files, or the packed image stores (training only) "
+                             "plus the image files of the other subsets")
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--verify", action="store_true", help="re-hash already staged files")
+    args = parser.parse_args()
+
+    # stdout carries the exports only; dataset registration prints go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        from detectron2.utils.logger import setup_logger
+        from diffusiondet.staging import stage_atrnet
+
+        setup_logger(name="diffusiondet")  # its handler picks up the redirected stream
+        stage_atrnet(args.split, args.output, images=args.images, num_workers=args.num_workers, verify=args.verify)
+
+    for key in ("ATRNET_DATA_DIR", "ATRNET_IMAGE_STORE_DIR"):
+        if key in os.environ:
+            print("export {}={}".format(key, shlex.quote(os.environ[key])))
+        else:
+            print("unset {}".format(key))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Check that COCOevalNumpy gives exactly the numbers of pycocotools' COCOeval
+(precision / recall / scores arrays and the 12 summary stats) and compare their
+evaluation times.
+
+Without arguments, the check runs on a synthetic regression fixture (fixed seed)
+that covers crowd GT, all area ranges, tied scores, empty images and more than
+maxDets detections per image. With --annotations / --predictions it runs on a
+real GT json and COCOEvaluator results json instead.
+
+Example:
+    python tools/verify_numpy_cocoeval.py
+    python tools/verify_numpy_cocoeval.py --annotations test.json \\
+        --predictions output/inference/coco_eval_instances_results.json --num-workers 8
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detectron2.evaluation.numpy_cocoeval import COCOevalNumpy  # noqa: E402
+
+
+def synthetic_fixture(num_images=300, num_cats=6, seed=0):
+    rng = np.random.default_rng(seed)
+    images, annotations, results = [], [], []
+    for img_id in range(1, num_images + 1):
+        images.append({"id": img_id, "file_name": "{}.png".format(img_id), "height": 512, "width": 512})
+        for _ in range(rng.integers(0, 8)):
+            # sides from 4 to 300 px: small, medium and large objects
+            w, h = np.exp(rng.uniform(np.log(4), np.log(300), size=2)).round(1)
+            x, y = rng.uniform(0, 512 - w), rng.uniform(0, 512 - h)
+            cat = int(rng.integers(1, num_cats + 1))
+            annotations.append({
+                "id": len(annotations) + 1, "image_id": img_id, "category_id": cat,
+                "bbox": [x, y, w, h], "area": float(w * h), "iscrowd": int(rng.random() < 0.05),
+            })
+            # a few jittered detections per GT, sometimes with the wrong class
+            for _ in range(rng.integers(0, 4)):
+                jitter = rng.normal(0, 0.15, size=4) * [w, h, w, h]
+                box = [x + jitter[0], y + jitter[1], max(w + jitter[2], 1.0), max(h + jitter[3], 1.0)]
+                det_cat = cat if rng.random() < 0.8 else int(rng.integers(1, num_cats + 1))
+                results.append({"image_id": img_id, "category_id": det_cat, "bbox": box,
+                                "score": float(rng.integers(1, 20) / 20)})  # coarse: many ties
+        # background detections, sometimes more than maxDets in one image
+        for _ in range(rng.integers(0, 120) if rng.random() < 0.1 else rng.integers(0, 10)):
+            w, h = rng.uniform(2, 200, size=2)
+            results.append({"image_id": img_id, "category_id": int(rng.integers(1, num_cats + 1)),
+                            "bbox": [rng.uniform(0, 400), rng.uniform(0, 400), w, h],
+                            "score": float(rng.integers(1, 20) / 20)})
+    categories = [{"id": c, "name": "class_{}".format(c)} for c in range(1, num_cats + 1)]
+    return {"images": images, "annotations": annotations, "categories": categories}, results
+
+
+def run(cls, coco_gt, results, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_dt = coco_gt.loadRes(results)
+        evaluator = cls(coco_gt, coco_dt, "bbox", **kwargs)
+        start = time.perf_counter()
+        evaluator.evaluate()
+        evaluator.accumulate()
+        elapsed = time.perf_counter() - start
+        evaluator.summarize()
+    return evaluator, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--annotations", help="GT json; default: the synthetic fixture")
+    parser.add_argument("--predictions", help="results json")
+    parser.add_argument("--num-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.annotations:
+            coco_gt = COCO(args.annotations)
+            results = args.predictions
+        else:
+            dataset, results = synthetic_fixture()
+            coco_gt = COCO()
+            coco_gt.dataset = dataset
+            coco_gt.createIndex()
+
+    reference, reference_time = run(COCOeval, coco_gt, results)
+    candidate, candidate_time = run(COCOevalNumpy, coco_gt, results, num_workers=args.num_workers)
+
+    ok = True
+    for key in ("precision", "recall", "scores"):
+        a, b = reference.eval[key], candidate.eval[key]
+        same = a.shape == b.shape and np.array_equal(a, b)
+        diff = np.abs(a - b).max() if a.shape == b.shape else float("nan")
+        print("{:<10} {:<9} max abs diff {}".format(key, "identical" if same else "DIFFERENT", diff))
+        ok &= same
+    same = np.array_equal(reference.stats, candidate.stats)
+    print("{:<10} {}".format("stats", "identical" if same else "DIFFERENT"))
+    ok &= same
+    print("COCOeval {:.2f}s, COCOevalNumpy {:.2f}s (evaluate + accumulate)".format(reference_time, candidate_time))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
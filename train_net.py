@@ -11,6 +11,8 @@ DiffusionDet Training Script.
 This script is a simplified version of the training script in detectron2/tools.
 """
 
+import contextlib
+import functools
 import os
 import itertools
 import weakref
@@ -20,21 +22,36 @@ from collections import OrderedDict
 
 import torch
 from fvcore.nn.precise_bn import get_bn_modules
+from torch.nn.parallel import DistributedDataParallel
 
 import detectron2.utils.comm as comm
 from detectron2.utils.logger import setup_logger
 from detectron2.checkpoint import DetectionCheckpointer
 from detectron2.config import get_cfg
-from detectron2.data import build_detection_train_loader
+from detectron2.data import (
+    DatasetCatalog,
+    build_detection_test_loader,
+    build_detection_train_loader,
+    stratified_image_subset,
+)
+from detectron2.data.common import (
+    ColumnarDetectionList,
+    DevicePrefetcher,
+    set_default_dataset_from_list_serialize_method,
+)
 from detectron2.engine import DefaultTrainer, default_argument_parser, default_setup, launch, create_ddp_model, \
-    AMPTrainer, SimpleTrainer, hooks
-from detectron2.evaluation import COCOEvaluator, LVISEvaluator, verify_results
-from detectron2.solver.build import maybe_add_gradient_clipping
+    AMPTrainer, SimpleTrainer, hooks, maybe_compile_model
+from detectron2.evaluation import COCOEvaluator, LVISEvaluator, inference_on_dataset, print_csv_format, \
+    verify_results
+from detectron2.solver.build import maybe_add_gradient_clipping, reduce_param_groups
+from detectron2.utils.env import TORCH_VERSION
+from detectron2.utils.file_io import PathManager
 from detectron2.modeling import build_model
 
 from diffusiondet import DiffusionDetDatasetMapper, add_diffusiondet_config, DiffusionDetWithTTA
+from diffusiondet.feature_cache import build_feature_cache_train_loader
 from diffusiondet.util.model_ema import add_model_ema_configs, may_build_model_ema, may_get_ema_checkpointer, EMAHook, \
-    apply_model_ema_and_restore, EMADetectionCheckpointer
+    apply_model_ema_and_restore, EMADetectionCheckpointer, EMAState, get_model_ema_state
 
 # Register ATRNet-STAR dataset
 import diffusiondet.register_atrnet
@@ -43,6 +60,9 @@ import diffusiondet.register_atrnet
 class Trainer(DefaultTrainer):
     """ Extension of the Trainer class adapted to DiffusionDet. """
 
+    # image ids of the TEST.EVAL_SUBSET samples, by (dataset name, NUM_IMAGES, SEED)
+    _eval_subsets = {}
+
     def __init__(self, cfg):
         """
         Args:
@@ -61,7 +81,14 @@ class Trainer(DefaultTrainer):
 
         model = create_ddp_model(model, broadcast_buffers=False)
         self._trainer = (AMPTrainer if cfg.SOLVER.AMP.ENABLED else SimpleTrainer)(
-            model, data_loader, optimizer
+            model, data_loader, optimizer, accumulation_steps=cfg.SOLVER.ACCUMULATION_STEPS
+        )
+        logger.info(
+            "Effective batch size: {} ({} images per batch x {} accumulation steps)".format(
+                cfg.SOLVER.IMS_PER_BATCH * cfg.SOLVER.ACCUMULATION_STEPS,
+                cfg.SOLVER.IMS_PER_BATCH,
+                cfg.SOLVER.ACCUMULATION_STEPS,
+            )
         )
 
         self.scheduler = self.build_lr_scheduler(cfg, optimizer)
@@ -87,6 +114,46 @@ class Trainer(DefaultTrainer):
 
 
 
+    def load_state_dict(self, state_dict):
+        optim_state = state_dict.get("_trainer", {}).get("optimizer")
+        if optim_state is not None:
+            state_dict["_trainer"]["optimizer"] = self._regroup_optimizer_state(optim_state)
+        super().load_state_dict(state_dict)
+
+    def _regroup_optimizer_state(self, optim_state):
+        """
+        Convert an optimizer state saved with one param group per parameter (checkpoints
+        written before groups were merged in :meth:`build_optimizer`) to the current groups,
+        so that such runs can still be resumed.
+        """
+        groups = self.optimizer.param_groups
+        saved_groups = optim_state["param_groups"]
+        ordered = [p for p in self.model.parameters() if p.requires_grad]
+        if (
+                len(saved_groups) == len(groups)
+                or len(saved_groups) != len(ordered)
+                or any(len(g["params"]) != 1 for g in saved_groups)
+        ):
+            return optim_state  # nothing to convert, or let the optimizer report the mismatch
+
+        # saved group k holds the k-th trainable parameter in model order
+        position = {id(p): i for i, p in enumerate(itertools.chain(*[g["params"] for g in groups]))}
+        saved_by_param = {id(p): g for p, g in zip(ordered, saved_groups)}
+        state = {}
+        for p, g in zip(ordered, saved_groups):
+            if g["params"][0] in optim_state["state"]:
+                state[position[id(p)]] = optim_state["state"][g["params"][0]]
+        new_groups = []
+        for g in groups:
+            new_group = dict(saved_by_param[id(g["params"][0])])
+            new_group.update({k: g[k] for k in ("foreach", "fused") if k in g})
+            new_group["params"] = [position[id(p)] for p in g["params"]]
+            new_groups.append(new_group)
+        logging.getLogger(__name__).info(
+            "Regrouped optimizer state from {} to {} param groups".format(len(saved_groups), len(groups))
+        )
+        return {"state": state, "param_groups": new_groups}
+
     @classmethod
     def build_model(cls, cfg):
         """
@@ -101,28 +168,64 @@ class Trainer(DefaultTrainer):
         logger.info("Model:\n{}".format(model))
         # setup EMA
         may_build_model_ema(cfg, model)
+        maybe_compile_model(cfg, model)
         return model
 
     @classmethod
-    def build_evaluator(cls, cfg, dataset_name, output_folder=None):
+    def build_evaluator(cls, cfg, dataset_name, output_folder=None, img_ids=None):
         """
         Create evaluator(s) for a given dataset.
         This uses the special metadata "evaluator_type" associated with each builtin dataset.
         For your own dataset, you can simply create an evaluator manually in your
         script and do not have to worry about the hacky if-else logic here.
+
+        With `img_ids` (a subset of the dataset, see :meth:`test_subset`), only these
+        images are evaluated and bootstrap confidence intervals are reported.
         """
         if output_folder is None:
             output_folder = os.path.join(cfg.OUTPUT_DIR, "inference")
         if 'lvis' in dataset_name:
             return LVISEvaluator(dataset_name, cfg, True, output_folder)
         else:
-            return COCOEvaluator(dataset_name, cfg, True, output_folder)
+            return COCOEvaluator(
+                dataset_name,
+                cfg,
+                True,
+                output_folder,
+                save_coco_json=cfg.TEST.SAVE_COCO_JSON,
+                save_detections=cfg.TEST.SAVE_DETECTIONS,
+                use_numpy_impl=cfg.TEST.NUMPY_COCOEVAL,
+                img_ids=img_ids,
+                num_bootstrap=cfg.TEST.EVAL_SUBSET.NUM_BOOTSTRAP if img_ids is not None else 0,
+            )
+
+    @classmethod
+    def build_test_loader(cls, cfg, dataset_name, image_ids=None):
+        """
+        Read the test images like the training images (same SAR intensity
+        scaling and image stores), restricted to `image_ids` if given.
+        """
+        mapper = DiffusionDetDatasetMapper(cfg, is_train=False)
+        return build_detection_test_loader(cfg, dataset_name, mapper=mapper, image_ids=image_ids)
 
     @classmethod
     def build_train_loader(cls, cfg):
-        # 第一步先做了数据增强，但是这里似乎是中心化剪裁？   把数据映射成模型训练需要的格式
-        mapper = DiffusionDetDatasetMapper(cfg, is_train=True)
-        return build_detection_train_loader(cfg, mapper=mapper)
+        if cfg.FEATURE_CACHE.ENABLED:
+            # head-only fine-tuning from precomputed backbone features
+            data_loader = build_feature_cache_train_loader(cfg)
+        else:
+            # 第一步先做了数据增强，但是这里似乎是中心化剪裁？   把数据映射成模型训练需要的格式
+            mapper = DiffusionDetDatasetMapper(cfg, is_train=True)
+            if cfg.DATALOADER.COLUMNAR_RECORDS:
+                storage = set_default_dataset_from_list_serialize_method(ColumnarDetectionList)
+            else:
+                storage = contextlib.nullcontext()
+            with storage:
+                data_loader = build_detection_train_loader(cfg, mapper=mapper)
+        depth = cfg.DATALOADER.DEVICE_PREFETCH_DEPTH
+        if depth > 0 and torch.device(cfg.MODEL.DEVICE).type == "cuda":
+            data_loader = DevicePrefetcher(data_loader, cfg.MODEL.DEVICE, depth)
+        return data_loader
 
     @classmethod
     def build_optimizer(cls, cfg, model):
@@ -140,37 +243,58 @@ class Trainer(DefaultTrainer):
             if "backbone" in key:
                 lr = lr * cfg.SOLVER.BACKBONE_MULTIPLIER
             params += [{"params": [value], "lr": lr, "weight_decay": weight_decay}]
+        # Merge the per-parameter groups by (lr, weight_decay) so that the multi-tensor
+        # (foreach / fused) kernels see a few large groups instead of hundreds of tiny ones.
+        params = reduce_param_groups(params)
+
+        clip_norm_val = cfg.SOLVER.CLIP_GRADIENTS.CLIP_VALUE
+        full_model_clipping = (
+                cfg.SOLVER.CLIP_GRADIENTS.ENABLED
+                and cfg.SOLVER.CLIP_GRADIENTS.CLIP_TYPE == "full_model"
+                and clip_norm_val > 0.0
+        )
 
         def maybe_add_full_model_gradient_clipping(optim):  # optim: the optimizer class
             # detectron2 doesn't have full model gradient clipping now
-            clip_norm_val = cfg.SOLVER.CLIP_GRADIENTS.CLIP_VALUE
-            enable = (
-                    cfg.SOLVER.CLIP_GRADIENTS.ENABLED
-                    and cfg.SOLVER.CLIP_GRADIENTS.CLIP_TYPE == "full_model"
-                    and clip_norm_val > 0.0
-            )
-
             class FullModelGradientClippingOptimizer(optim):
                 def step(self, closure=None):
-                    all_params = itertools.chain(*[x["params"] for x in self.param_groups])
-                    torch.nn.utils.clip_grad_norm_(all_params, clip_norm_val)
+                    # the flat parameter list only changes if groups are added
+                    if getattr(self, "_clip_params_groups", None) != len(self.param_groups):
+                        self._clip_params = list(itertools.chain(*[x["params"] for x in self.param_groups]))
+                        self._clip_params_groups = len(self.param_groups)
+                    # global norm over all grads with the multi-tensor norm kernel
+                    torch.nn.utils.clip_grad_norm_(self._clip_params, clip_norm_val, foreach=True)
                     super().step(closure=closure)
 
-            return FullModelGradientClippingOptimizer if enable else optim
+            return FullModelGradientClippingOptimizer if full_model_clipping else optim
+
+        # The fused kernel unscales AMP gradients inside `step`, after our clipping would run,
+        # so only use it when that ordering does not matter.
+        use_fused = (
+                TORCH_VERSION >= (2, 0)
+                and all(p.is_cuda for p in memo)
+                and not (cfg.SOLVER.AMP.ENABLED and cfg.SOLVER.CLIP_GRADIENTS.ENABLED)
+        )
+        impl_kwargs = {"fused": True} if use_fused else {"foreach": True}
 
         optimizer_type = cfg.SOLVER.OPTIMIZER
         if optimizer_type == "SGD":
             optimizer = maybe_add_full_model_gradient_clipping(torch.optim.SGD)(
-                params, cfg.SOLVER.BASE_LR, momentum=cfg.SOLVER.MOMENTUM
+                params, cfg.SOLVER.BASE_LR, momentum=cfg.SOLVER.MOMENTUM, foreach=True
             )
         elif optimizer_type == "ADAMW":
             optimizer = maybe_add_full_model_gradient_clipping(torch.optim.AdamW)(
-                params, cfg.SOLVER.BASE_LR
+                params, cfg.SOLVER.BASE_LR, **impl_kwargs
             )
         else:
             raise NotImplementedError(f"no optimizer type {optimizer_type}")
         if not cfg.SOLVER.CLIP_GRADIENTS.CLIP_TYPE == "full_model":
             optimizer = maybe_add_gradient_clipping(cfg, optimizer)
+        logging.getLogger(__name__).info(
+            "Optimizer {} with {} param groups ({})".format(
+                optimizer_type, len(optimizer.param_groups), ", ".join(f"{k}={v}" for k, v in impl_kwargs.items())
+            )
+        )
         return optimizer
 
     @classmethod
@@ -185,6 +309,71 @@ class Trainer(DefaultTrainer):
             results = cls.test(cfg, model, evaluators=evaluators)
         return results
 
+    @classmethod
+    def test(cls, cfg, model, evaluators=None):
+        results = super().test(cfg, model, evaluators=evaluators)
+        cls.report_latency(cfg, model)
+        return results
+
+    @staticmethod
+    def report_latency(cfg, model, filename="latency.json"):
+        """
+        Log the latency breakdown recorded by the model during the last evaluation
+        (MODEL.DiffusionDet.PROFILE_LATENCY), save it to OUTPUT_DIR/inference/`filename`
+        (inference_TTA/ with test-time augmentation) and reset it. The numbers are
+        those of the main process.
+        """
+        folder = "inference"
+        if isinstance(model, DiffusionDetWithTTA):
+            model = model.model
+            folder = "inference_TTA"
+        if isinstance(model, DistributedDataParallel):
+            model = model.module
+        latency = getattr(model, "latency", None)
+        if latency is None or not latency.enabled:
+            return
+        if comm.is_main_process():
+            latency.log_summary(logging.getLogger("detectron2.trainer"))
+            path = os.path.join(cfg.OUTPUT_DIR, folder, filename)
+            PathManager.mkdirs(os.path.dirname(path))
+            latency.dump(
+                path,
+                datasets=list(cfg.DATASETS.TEST),
+                sample_step=cfg.MODEL.DiffusionDet.SAMPLE_STEP,
+                num_proposals=cfg.MODEL.DiffusionDet.NUM_PROPOSALS,
+                num_heads=cfg.MODEL.DiffusionDet.NUM_HEADS,
+            )
+        latency.reset()
+
+    @classmethod
+    def test_subset(cls, cfg, model):
+        """
+        Like :meth:`test`, on the fixed class-stratified sample of each test set
+        configured by TEST.EVAL_SUBSET, with bootstrap confidence intervals.
+        """
+        logger = logging.getLogger("detectron2.trainer")
+        results = OrderedDict()
+        for dataset_name in cfg.DATASETS.TEST:
+            key = (dataset_name, cfg.TEST.EVAL_SUBSET.NUM_IMAGES, cfg.TEST.EVAL_SUBSET.SEED)
+            img_ids = cls._eval_subsets.get(key)
+            if img_ids is None:
+                img_ids = cls._eval_subsets[key] = stratified_image_subset(
+                    DatasetCatalog.get(dataset_name), cfg.TEST.EVAL_SUBSET.NUM_IMAGES, seed=cfg.TEST.EVAL_SUBSET.SEED
+                )
+            logger.info("Evaluating on a subset of {} images of {}.".format(len(img_ids), dataset_name))
+            data_loader = cls.build_test_loader(cfg, dataset_name, image_ids=img_ids)
+            evaluator = cls.build_evaluator(cfg, dataset_name, img_ids=img_ids)
+            results_i = inference_on_dataset(model, data_loader, evaluator)
+            results[dataset_name] = results_i
+            if comm.is_main_process():
+                logger.info("Evaluation results for {} (subset) in csv format:".format(dataset_name))
+                print_csv_format(results_i)
+        cls.report_latency(cfg, model, filename="latency_subset.json")
+
+        if len(results) == 1:
+            results = list(results.values())[0]
+        return results
+
     @classmethod
     def test_with_TTA(cls, cfg, model):
         logger = logging.getLogger("detectron2.trainer")
@@ -239,12 +428,19 @@ class Trainer(DefaultTrainer):
             ret.append(hooks.PeriodicCheckpointer(self.checkpointer, cfg.SOLVER.CHECKPOINT_PERIOD))
 
         def test_and_save_results():
-            self._last_eval_results = self.test(self.cfg, self.model)
+            if cfg.TEST.EVAL_SUBSET.ENABLED and self.iter + 1 < self.max_iter:
+                # periodic evaluation; the one after training is on the full test sets
+                self._last_eval_results = self.test_subset(self.cfg, self.model)
+            else:
+                self._last_eval_results = self.test(self.cfg, self.model)
             return self._last_eval_results
 
         # Do evaluation after checkpointer, because then if it fails,
         # we can use the saved checkpoint to debug.
-        ret.append(hooks.EvalHook(cfg.TEST.EVAL_PERIOD, test_and_save_results))
+        if not cfg.TEST.ASYNC_EVAL.ENABLED:
+            ret.append(hooks.EvalHook(cfg.TEST.EVAL_PERIOD, test_and_save_results))
+        elif comm.is_main_process():
+            ret.append(self.build_async_eval_hook())
 
         if comm.is_main_process():
             # Here the default print/log frequency of each writer is used.
@@ -252,6 +448,61 @@ class Trainer(DefaultTrainer):
             ret.append(hooks.PeriodicWriter(self.build_writers(), period=20))
         return ret
 
+    def build_async_eval_hook(self):
+        """
+        Evaluate in a separate process on snapshots of the model (its EMA weights
+        if MODEL_EMA is enabled) copied to CPU, see TEST.ASYNC_EVAL.
+        """
+        cfg = self.cfg
+
+        def snapshot():
+            if cfg.MODEL_EMA.ENABLED:
+                state = get_model_ema_state(self.model).state.items()
+            else:
+                model = self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
+                state = EMAState().get_model_state_iterator(model)
+            state = {name: val.detach().to("cpu", copy=True) for name, val in state}
+            # periodic snapshots are evaluated on the subset, the final one on the full test sets
+            return state, cfg.TEST.EVAL_SUBSET.ENABLED and self.iter + 1 < self.max_iter
+
+        def save_results(iteration, results):
+            self._last_eval_results = results
+
+        eval_cfg = cfg.clone()
+        eval_cfg.defrost()
+        eval_cfg.MODEL.DEVICE = cfg.TEST.ASYNC_EVAL.DEVICE or cfg.MODEL.DEVICE
+        eval_cfg.freeze()
+        return hooks.AsyncEvalHook(
+            cfg.TEST.EVAL_PERIOD,
+            snapshot,
+            functools.partial(async_eval, eval_cfg),
+            max_in_flight=cfg.TEST.ASYNC_EVAL.MAX_IN_FLIGHT,
+            callback=save_results,
+        )
+
+
+# model of the asynchronous evaluation process, built at its first evaluation
+_ASYNC_EVAL_MODEL = None
+
+
+def async_eval(cfg, snapshot):
+    """
+    Evaluate a snapshot of the training process in the process of the AsyncEvalHook:
+    weights (parameter and buffer name -> tensor) and whether to evaluate on the
+    TEST.EVAL_SUBSET subset.
+    """
+    state, subset = snapshot
+    global _ASYNC_EVAL_MODEL
+    if _ASYNC_EVAL_MODEL is None:
+        setup_logger(os.path.join(cfg.OUTPUT_DIR, "async_eval_log.txt"), name="detectron2")
+        _ASYNC_EVAL_MODEL = Trainer.build_model(cfg)
+    ema = EMAState()
+    ema.load_state_dict(state)
+    ema.apply_to(_ASYNC_EVAL_MODEL)
+    if subset:
+        return Trainer.test_subset(cfg, _ASYNC_EVAL_MODEL)
+    return Trainer.test(cfg, _ASYNC_EVAL_MODEL)
+
 
 def setup(args):
     """
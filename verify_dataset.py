@@ -4,6 +4,7 @@
 import json
 import os
 import sys
+from collections import Counter
 from pathlib import Path
 
 ROOT = Path("/media/alexandre/E6AE9051AE901BDD/PIE Code/ATR/ATR-Segmentation")
@@ -54,6 +55,10 @@ for fname in ("train.json", "test.json", "train_military.json", "test_military.j
         n_ann  = len(d["annotations"])
         ok(fname)
         info(f"categories={n_cat}  images={n_img}  annotations={n_ann}")
+        counts = Counter(a["category_id"] for a in d["annotations"])
+        hist = sorted((counts[c["id"]], c["name"]) for c in d["categories"])
+        if hist:
+            info(f"annotations per class: min={hist[0][0]} ({hist[0][1]})  max={hist[-1][0]} ({hist[-1][1]})")
 
         if "military" in fname:
             cat_names = {c["name"] for c in d["categories"]}
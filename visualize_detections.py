@@ -6,7 +6,6 @@ Creates beautiful visualizations with bounding boxes, labels, and confidence sco
 
 import argparse
 import os
-import json
 import sys
 import numpy as np
 import cv2
@@ -16,7 +15,9 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from detectron2.config import get_cfg
 from detectron2.data import MetadataCatalog, DatasetCatalog
+from detectron2.data.datasets.coco_index import load_coco_index
 from detectron2.engine import DefaultPredictor
+from detectron2.evaluation import DetectionReader
 from detectron2.utils.visualizer import Visualizer, ColorMode
 from detectron2.checkpoint import DetectionCheckpointer
 
@@ -80,13 +81,26 @@ def get_category_names(data_dir: str = None) -> dict:
             f"Annotation file not found: {annotation_file}\n"
             "Set ATRNET_DATA_DIR env var or pass --data-dir."
         )
-    with open(annotation_file, "r") as f:
-        data = json.load(f)
-    return {cat["id"]: cat["name"] for cat in data["categories"]}
+    return {cat["id"]: cat["name"] for cat in load_coco_index(str(annotation_file)).categories()}
 
-def draw_predictions(image, outputs, categories, confidence_threshold=0.3):
+def model_detections(outputs):
+    """Boxes (XYXY), scores and COCO category ids of the predictor outputs"""
+    instances = outputs["instances"].to("cpu")
+    # +1 because COCO IDs are 1-indexed
+    return instances.pred_boxes.tensor.numpy(), instances.scores.numpy(), instances.pred_classes.numpy() + 1
+
+
+def saved_detections(reader, image_id):
+    """Boxes (XYXY), scores and COCO category ids of one image in saved detections"""
+    det = reader.get(image_id)
+    boxes = det["bbox"].astype(np.float64)
+    boxes[:, 2:] += boxes[:, :2]  # XYWH -> XYXY
+    return boxes, det["score"], det["category_id"]
+
+
+def draw_predictions(image, boxes, scores, classes, categories, confidence_threshold=0.3):
     """
-    Draw bounding boxes and labels on image
+    Draw bounding boxes and labels on image (`classes` are COCO category ids)
     """
     height, width = image.shape[:2]
     
@@ -96,11 +110,6 @@ def draw_predictions(image, outputs, categories, confidence_threshold=0.3):
     elif image.shape[2] == 1:
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
     
-    instances = outputs["instances"].to("cpu")
-    boxes = instances.pred_boxes.tensor.numpy()
-    scores = instances.scores.numpy()
-    classes = instances.pred_classes.numpy()
-    
     # Filter by confidence
     keep = scores > confidence_threshold
     boxes = boxes[keep]
@@ -120,7 +129,7 @@ def draw_predictions(image, outputs, categories, confidence_threshold=0.3):
         cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
         
         # Get category name
-        category_name = categories.get(int(cls_id) + 1, f"Class_{cls_id}")  # +1 because COCO IDs are 1-indexed
+        category_name = categories.get(int(cls_id), f"Class_{cls_id}")
         
         # Create label
         label = f"{category_name}: {score:.2f}"
@@ -183,7 +192,7 @@ def display_images_grid(images_data, cols=3):
     plt.show()
 
 def visualize_samples(args):
-    """Run inference and create visualizations"""
+    """Run inference (or read saved detections) and create visualizations"""
     print("=" * 70)
     print("DiffDet4SAR Visualization on ATRNet-STAR")
     print("=" * 70)
@@ -195,10 +204,17 @@ def visualize_samples(args):
     categories = get_category_names(args.data_dir)
     print(f"✓ Loaded {len(categories)} categories")
     
-    # Create predictor
-    print(f"✓ Loading model from: {cfg.MODEL.WEIGHTS}")
-    predictor = DefaultPredictor(cfg)
-    print(f"✓ Model loaded successfully!")
+    if args.predictions:
+        # Saved detections: no model needed, images are found by their COCO image id
+        reader = DetectionReader(args.predictions)
+        print(f"✓ Loaded {len(reader)} detections from: {args.predictions}")
+        test_data = DatasetCatalog.get("atrnet_star_test")
+        image_ids = {Path(d["file_name"]).name: d["image_id"] for d in test_data}
+    else:
+        # Create predictor
+        print(f"✓ Loading model from: {cfg.MODEL.WEIGHTS}")
+        predictor = DefaultPredictor(cfg)
+        print(f"✓ Model loaded successfully!")
     
     # Get sample images
     if args.input_dir:
@@ -211,7 +227,8 @@ def visualize_samples(args):
         )
     else:
         # Use random samples from test set
-        test_data = DatasetCatalog.get("atrnet_star_test")
+        if not args.predictions:
+            test_data = DatasetCatalog.get("atrnet_star_test")
         sample_indices = random.sample(range(len(test_data)), min(args.num_samples, len(test_data)))
         image_files = [test_data[i]["file_name"] for i in sample_indices]
     
@@ -243,15 +260,21 @@ def visualize_samples(args):
             print(f"  ⚠ Could not read image, skipping...")
             continue
         
-        # Convert to 3-channel for Detectron2
-        # np.ascontiguousarray ensures compatibility with numpy 2.x + PyTorch
-        image_rgb = np.ascontiguousarray(cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
-        
-        # Run inference
-        outputs = predictor(image_rgb)
+        if args.predictions:
+            if image_path.name not in image_ids:
+                print(f"  ⚠ Not an atrnet_star_test image, skipping...")
+                continue
+            boxes, scores, classes = saved_detections(reader, image_ids[image_path.name])
+        else:
+            # Convert to 3-channel for Detectron2
+            # np.ascontiguousarray ensures compatibility with numpy 2.x + PyTorch
+            image_rgb = np.ascontiguousarray(cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
+            
+            # Run inference
+            boxes, scores, classes = model_detections(predictor(image_rgb))
         
         # Draw predictions
-        vis_image, num_det = draw_predictions(image, outputs, categories, args.confidence_threshold)
+        vis_image, num_det = draw_predictions(image, boxes, scores, classes, categories, args.confidence_threshold)
         total_detections += num_det
         
         # Save for display if requested
@@ -286,6 +309,10 @@ def main():
     parser.add_argument("--weights",
                        default=None,
                        help="Path to model weights (.pth file)")
+    parser.add_argument("--predictions",
+                       default=None,
+                       help="Draw saved detections instead of running the model: a detections/ directory "
+                            "(TEST.SAVE_DETECTIONS) or COCO results json of atrnet_star_test")
     parser.add_argument("--input-dir",
                        default=None,
                        help="Directory with input images (if not specified, uses random test samples)")